@@ -1,25 +1,116 @@
 # admin_filter.py
-from aiogram import BaseMiddleware
-from aiogram.types import Message, CallbackQuery
-
-# Список Telegram ID админов
-ADMINS = {5610915553, 1838230929}  # <- сюда свои ID
-
-class AdminFilterMiddleware(BaseMiddleware):
-    async def __call__(self, handler, event, data):
-        user_id = None
-
-        if isinstance(event, Message):
-            user_id = event.from_user.id
-        elif isinstance(event, CallbackQuery):
-            user_id = event.from_user.id
-
-        if user_id not in ADMINS:
-            # Сообщение для обычных пользователей
-            if isinstance(event, Message):
-                await event.answer("❌ У тебя нет доступа к этому боту.")
-            elif isinstance(event, CallbackQuery):
-                await event.answer("❌ У тебя нет доступа к этому боту.", show_alert=True)
-            return  # блокируем дальнейшую обработку
-
-        return await handler(event, data)
+import os
+import time
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.types import CallbackQuery, Message, Update
+from dotenv import dotenv_values
+from loguru import logger
+
+from config import ADMIN_IDS_RAW, ADMIN_RELOAD_INTERVAL, ADMIN_DENY_REPLY_INTERVAL, ENV_FILE
+from metrics import Counter, registry
+from utils import LRUCache
+
+DENY_TEXT = "❌ У тебя нет доступа к этому боту."
+
+unauthorized_updates = registry.register(Counter(
+    "bot_unauthorized_updates_total", "Updates from non-admins", ("action",)))
+
+
+def parse_admin_ids(raw: str) -> set[int]:
+    return {int(part) for part in raw.split(",") if part.strip()}
+
+
+class AdminList:
+    """
+    Список Telegram ID админов (ADMIN_IDS).
+    Раз в reload_interval проверяет mtime .env и, если файл поменялся, перечитывает список.
+    """
+
+    def __init__(self, raw: str, env_file: str, reload_interval: float):
+        self.ids = parse_admin_ids(raw)
+        self.env_file = env_file
+        self.reload_interval = reload_interval
+        self._mtime = self._stat()
+        self._checked = time.monotonic()
+
+    def _stat(self) -> float | None:
+        try:
+            return os.stat(self.env_file).st_mtime if self.env_file else None
+        except OSError:
+            return None
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+
+        mtime = self._stat()
+        if mtime is None or mtime == self._mtime:
+            return
+        self._mtime = mtime
+
+        raw = dotenv_values(self.env_file).get("ADMIN_IDS")
+        if raw is None:
+            return
+        try:
+            ids = parse_admin_ids(raw)
+        except ValueError:
+            logger.error(f"ADMIN_IDS in {self.env_file} is invalid, keeping the current list")
+            return
+        if ids != self.ids:
+            logger.info(f"Admin list reloaded: {len(ids)} admins")
+            self.ids = ids
+
+    def __contains__(self, user_id: int) -> bool:
+        self._maybe_reload()
+        return user_id in self.ids
+
+
+ADMINS = AdminList(ADMIN_IDS_RAW, ENV_FILE, ADMIN_RELOAD_INTERVAL)
+
+
+class AdminGateMiddleware(BaseMiddleware):
+    """
+    Внешний middleware на уровне Update: чужие апдейты отбрасываются ещё до FSM,
+    то есть без единого обращения к storage. «Нет доступа» отвечаем не чаще
+    раза в reply_interval на пользователя, остальное выкидываем молча.
+    """
+
+    def __init__(self, admins: AdminList, reply_interval: float):
+        self.admins = admins
+        self.reply_interval = reply_interval
+        self._replied = LRUCache(10000)
+
+    async def __call__(self, handler, event: Update, data):
+        user = data.get("event_from_user")
+        if user is not None and user.id in self.admins:
+            return await handler(event, data)
+
+        if user is None:
+            unauthorized_updates.inc("dropped")
+            return None
+
+        now = time.monotonic()
+        last = self._replied.get(user.id)
+        if last is not None and now - last < self.reply_interval:
+            unauthorized_updates.inc("dropped")
+            return None
+        self._replied.set(user.id, now)
+        unauthorized_updates.inc("replied")
+
+        inner = event.event
+        if isinstance(inner, Message):
+            return inner.answer(DENY_TEXT)
+        if isinstance(inner, CallbackQuery):
+            return inner.answer(DENY_TEXT, show_alert=True)
+        return None
+
+
+def setup_admin_gate(dp: Dispatcher):
+    """Ставит проверку админа перед FSM middleware — до неё состояние не читается."""
+    gate = AdminGateMiddleware(ADMINS, ADMIN_DENY_REPLY_INTERVAL)
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(gate)
+    dp.update.outer_middleware(dp.fsm)
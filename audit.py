@@ -0,0 +1,178 @@
+import asyncio
+import glob
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from loguru import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: там бот работает одним процессом, блокировать не от кого
+    fcntl = None
+
+from config import AUDIT_PATH, AUDIT_MAX_BYTES, AUDIT_BACKUPS, AUDIT_QUEUE_SIZE
+
+# Сколько записей писать одним вызовом write
+BATCH_SIZE = 500
+# Чтение хвоста с конца файла блоками
+TAIL_BLOCK = 64 * 1024
+
+
+def request_hash(body) -> str:
+    """Отпечаток полей запроса: одинаковые запросы — один хэш, сами данные в аудит не пишем."""
+    if hasattr(body, "model_dump"):
+        body = body.model_dump(mode="json", by_alias=True)
+    raw = json.dumps(body, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode()).hexdigest()[:16]
+
+
+class AuditLog:
+    """
+    Журнал действий админов в JSONL. record() только кладёт запись в очередь
+    ограниченного размера; на диск пишет фоновая задача пачками, в отдельном
+    потоке — медленный диск не превращается в задержку хендлеров. Переполнение
+    очереди не блокирует бота: запись теряется и считается в dropped.
+    Файл ротируется по размеру, старые части сжимаются gzip, хранятся последние backups.
+    Воркеры супервизора пишут в один файл: запись и ротация — под flock на path.lock.
+    """
+
+    def __init__(self, path: str, max_bytes: int, backups: int, queue_size: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.queue_size = queue_size
+        self.written = 0
+        self.dropped = 0
+        self._queue: asyncio.Queue | None = None
+        self._task: asyncio.Task | None = None
+        # Один поток: запись, ротация и чтение хвоста не пересекаются
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit")
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # ---------- поток записи ----------
+
+    def _write(self, lines: list[str]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("".join(lines))
+                size = f.tell()
+            self.written += len(lines)
+            # Под той же блокировкой: иначе другой процесс допишет в уже переименованный файл
+            if size >= self.max_bytes:
+                self._rotate()
+
+    def _rotate(self):
+        base, ext = os.path.splitext(self.path)
+        rotated = f"{base}-{datetime.now(tz=timezone.utc):%Y%m%d-%H%M%S-%f}{ext}"
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(rotated)
+        # Имена с датой сортируются по времени — удаляем самые старые
+        for old in sorted(glob.glob(f"{glob.escape(base)}-*{ext}.gz"))[:-self.backups or None]:
+            os.remove(old)
+
+    def _tail(self, count: int) -> list[str]:
+        """Последние count строк: читаем блоками с конца, а не весь файл."""
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            return []
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            chunks, newlines = [], 0
+            # Последняя строка заканчивается \n — нужно на один перевод строки больше
+            while end > 0 and newlines <= count:
+                start = max(0, end - TAIL_BLOCK)
+                f.seek(start)
+                chunk = f.read(end - start)
+                chunks.append(chunk)
+                newlines += chunk.count(b"\n")
+                end = start
+        lines = b"".join(reversed(chunks)).decode("utf-8", errors="replace").splitlines()
+        return lines[-count:]
+
+    # ---------- event loop ----------
+
+    def record(self, event: str, **fields) -> bool:
+        """Не ждёт диска. False — очередь полна, запись потеряна (или журнал не запущен)."""
+        if self._queue is None:
+            return False
+        entry = {"ts": datetime.now(tz=timezone.utc).isoformat(timespec="milliseconds"), "event": event, **fields}
+        line = json.dumps(entry, ensure_ascii=False, default=str) + "\n"
+        try:
+            self._queue.put_nowait(line)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                logger.warning(f"Audit queue is full, {self.dropped} records dropped so far")
+            return False
+        return True
+
+    async def _loop(self):
+        while True:
+            line = await self._queue.get()
+            if line is None:
+                return
+            batch = [line]
+            # Всё, что накопилось, пока писали прошлую пачку, — одним write
+            while len(batch) < BATCH_SIZE and not self._queue.empty():
+                line = self._queue.get_nowait()
+                if line is None:
+                    await self._flush(batch)
+                    return
+                batch.append(line)
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[str]):
+        try:
+            await self._run(self._write, batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error(f"Audit write failed, {len(batch)} records lost: {e}")
+
+    async def recent(self, count: int) -> list[dict]:
+        entries = []
+        for line in await self._run(self._tail, count):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(self.queue_size)
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        """Дописывает всё, что в очереди, и останавливает запись."""
+        if self._task is None or self._task.done():
+            return
+        started = time.monotonic()
+        await self._queue.put(None)
+        await self._task
+        self._queue = None
+        logger.info(f"Audit log flushed in {time.monotonic() - started:.2f}s: {self.written} written, "
+                    f"{self.dropped} dropped")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+        }
+
+
+audit_log = AuditLog(AUDIT_PATH, AUDIT_MAX_BYTES, AUDIT_BACKUPS, AUDIT_QUEUE_SIZE)
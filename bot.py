@@ -1,13 +1,60 @@
 import asyncio
+import gc
+import sys
+import time
+from typing import Awaitable, Callable
+
+# python bot.py --check-config — проверка настроек до импорта aiogram и SDK панели:
+# миллисекунды вместо секунд, можно гонять перед деплоем
+if __name__ == "__main__" and "--check-config" in sys.argv[1:]:
+    try:
+        from config import check_config
+    except ValueError as e:
+        print(f"error: {e}")
+        sys.exit(1)
+    problems = check_config()
+    print("\n".join(problems) or "config OK")
+    sys.exit(1 if any(problem.startswith("error") for problem in problems) else 0)
+
+from aiohttp import web
 from aiogram import Bot, Dispatcher, F
-from aiogram.fsm.storage.memory import MemoryStorage
-from admin_filter import AdminFilterMiddleware
+from aiogram.filters import Command, CommandStart, StateFilter
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from admin_filter import setup_admin_gate
 from loguru import logger
 
-from config import BOT_TOKEN
-from states import CreateUserFlow
+from config import BOT_TOKEN, BOT_MODE, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT
+from config import METRICS_HOST, METRICS_PORT, LOG_PATH
+from metrics import MetricsMiddleware, TelegramMetricsMiddleware, registry, start_metrics_server
+import remnawave_client
+from remnawave_client import init_sdk, close_sdk, panel_breaker
+from storage import create_storage
+from callback_router import CallbackRouter
+from rate_limit import setup_rate_limiter, send_scheduler
+from squads import squad_catalog
+from user_index import user_index
+from id_pool import id_pool
+from audit import audit_log
+from states import CreateUserFlow, BulkCreateFlow, BulkActionFlow
+from bulk_jobs import job_runner
 from handlers import (
     cmd_start,
+    cmd_find,
+    cmd_users,
+    cmd_export,
+    cmd_stats,
+    stats_refresh,
+    cmd_audit,
+    users_open,
+    users_list,
+    users_next,
+    users_prev,
+    users_filters,
+    users_filter_set,
+    users_filter_reset,
+    users_close,
+    user_detail,
     start_create,
     username_generate,
     username_manual,
@@ -31,78 +78,278 @@ from handlers import (
     internal_next,
     external_handler,
     confirm_create,
-    cancel_flow
+    noop_handler,
+    cancel_handler,
+    bulk_start,
+    bulk_file,
+    bulk_run,
+    bulk_action_start,
+    bulk_action_pick,
+    bulk_days_pick,
+    bulk_days_text,
+    bulk_squad_toggle,
+    bulk_squads_next,
+    bulk_action_run,
+    bulk_job_cancel,
+    bulk_job_resume,
+    restore_jobs,
+    preset_pick,
+    preset_count,
+    confirm_overrides_text,
+    preset_run,
+    preset_save,
+    preset_back,
+    preset_name_text,
+    cmd_presets,
+    preset_delete
 )
 
-logger.add("logs/bot.log", level="INFO", rotation="10 MB", retention="1 month", compression="gz")
+# enqueue: запись на диск, ротацию и сжатие делает поток loguru, а не event loop
+logger.add(LOG_PATH, level="INFO", rotation="10 MB", retention="1 month", compression="gz", enqueue=True)
 
-@logger.catch
-async def main():
-    bot = Bot(token=BOT_TOKEN)
-    dp = Dispatcher(storage=MemoryStorage())
-    
-    # Регистрируем middleware
-    dp.message.middleware(AdminFilterMiddleware())
-    dp.callback_query.middleware(AdminFilterMiddleware())
 
-    # /start
-    dp.message.register(cmd_start, F.text == "/start")
+def create_webhook_app(dp: Dispatcher, bot: Bot) -> web.Application:
+    """Приложение с обработчиком webhook — без сервера, его же гоняет тест."""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=WEBHOOK_SECRET,
+        handle_in_background=False,
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot):
+    """
+    Апдейты приходят во встроенный aiohttp-сервер. Обработка идёт прямо в запросе,
+    так что метод, возвращённый хендлером (call.answer() и т.п.), уходит в Telegram
+    ответом на webhook — без отдельного запроса к Bot API.
+    """
+    runner = web.AppRunner(create_webhook_app(dp, bot))
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    await bot.set_webhook(
+        WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+    logger.info(f"Webhook server listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
 
-    # start flow
-    dp.callback_query.register(start_create, F.data == "start_create")
 
-    # cancel
-    dp.callback_query.register(lambda call, state: cancel_flow(state, call), F.data == "cancel")
+def create_callback_router() -> CallbackRouter:
+    router = CallbackRouter()
+
+    # start flow / cancel / skip — в любом состоянии
+    router.action("start_create", start_create)
+    router.action("cancel", cancel_handler)
+    router.action("skip", skip_handler)
 
     # username
-    dp.callback_query.register(username_generate, CreateUserFlow.username, F.data == "username_generate")
-    dp.callback_query.register(username_manual, CreateUserFlow.username, F.data == "username_manual")
-    dp.message.register(username_text, CreateUserFlow.username)
+    router.action("username_generate", username_generate, CreateUserFlow.username)
+    router.action("username_manual", username_manual, CreateUserFlow.username)
 
     # expire
-    dp.callback_query.register(expire_buttons, CreateUserFlow.expire_select, F.data.in_({"exp_1", "exp_3", "exp_6", "exp_12", "exp_reset"}))
-    dp.callback_query.register(expire_manual, CreateUserFlow.expire_select, F.data == "exp_manual")
-    dp.message.register(expire_manual_text, CreateUserFlow.expire_manual_days)
-    dp.callback_query.register(expire_next, CreateUserFlow.expire_select, F.data == "exp_next")
-
-    # skip handler
-    dp.callback_query.register(skip_handler, F.data == "skip")
-
-    # email / telegram / hwid / tag / description
-    dp.message.register(email_text, CreateUserFlow.email)
-    dp.message.register(telegram_text, CreateUserFlow.telegram_id)
-    dp.message.register(hwid_text, CreateUserFlow.hwid_limit)
-    dp.message.register(tag_text, CreateUserFlow.tag)
-    dp.message.register(description_text, CreateUserFlow.description)
-
-    # traffic
-    dp.callback_query.register(traffic_buttons, CreateUserFlow.traffic_select, F.data.startswith("tr_") | (F.data == "tr_reset"))
-    dp.callback_query.register(traffic_manual, CreateUserFlow.traffic_select, F.data == "tr_manual")
-    dp.message.register(traffic_manual_text, CreateUserFlow.traffic_manual_gb)
-    dp.callback_query.register(traffic_next, CreateUserFlow.traffic_select, F.data == "tr_next")
+    for action in ("exp_1", "exp_3", "exp_6", "exp_12", "exp_reset"):
+        router.action(action, expire_buttons, CreateUserFlow.expire_select)
+    router.action("exp_manual", expire_manual, CreateUserFlow.expire_select)
+    router.action("exp_next", expire_next, CreateUserFlow.expire_select)
+
+    # traffic: tr_50, tr_unlim, tr_reset ...; manual/next — отдельные хендлеры
+    router.namespace("tr", traffic_buttons, CreateUserFlow.traffic_select)
+    router.action("tr_manual", traffic_manual, CreateUserFlow.traffic_select)
+    router.action("tr_next", traffic_next, CreateUserFlow.traffic_select)
 
     # strategy
-    dp.callback_query.register(strategy_handler, CreateUserFlow.traffic_strategy, F.data.startswith("str_"))
+    router.namespace("str", strategy_handler, CreateUserFlow.traffic_strategy)
 
-    # internal squads
-    dp.callback_query.register(
-        internal_squad_handler,
-        CreateUserFlow.internal_squads,
-        (F.data.startswith("int_") & (F.data != "int_next")) | (F.data == "int_reset")
-    )
-    dp.callback_query.register(
-        internal_next,
-        CreateUserFlow.internal_squads,
-        F.data == "int_next"
-    )
+    # internal squads: int_<key>, int_reset
+    router.namespace("int", internal_squad_handler, CreateUserFlow.internal_squads)
+    router.action("int_next", internal_next, CreateUserFlow.internal_squads)
+
+    # external squad: ext_<key>, ext_skip
+    router.namespace("ext", external_handler, CreateUserFlow.external_squad)
+
+    # confirm; noop — кнопка «⏳ Создаю…», пока идёт запрос
+    router.action("confirm_create", confirm_create, CreateUserFlow.confirm)
+    router.action("noop", noop_handler)
+
+    # пресеты: кнопка в главном меню — в любом состоянии, остальное — с экрана подтверждения.
+    # У кнопок пресетов свой namespace: общий с pr_run/pr_save ловил бы их устаревшие нажатия
+    router.namespace("pp", preset_pick)
+    router.namespace("prk", preset_count, CreateUserFlow.confirm)
+    router.action("pr_run", preset_run, CreateUserFlow.confirm)
+    router.action("pr_save", preset_save, CreateUserFlow.confirm)
+    router.action("pr_back", preset_back, CreateUserFlow.preset_name)
+    router.namespace("prd", preset_delete)
+
+    # /users: список, фильтры ubs_/ubt_/ubq_, карточка ubu_<uuid> — в любом состоянии
+    router.action("ub_open", users_open)
+    router.action("ub_list", users_list)
+    router.action("ub_next", users_next)
+    router.action("ub_prev", users_prev)
+    router.action("ub_filters", users_filters)
+    router.action("ub_reset", users_filter_reset)
+    router.action("ub_close", users_close)
+    for namespace in ("ubs", "ubt", "ubq"):
+        router.namespace(namespace, users_filter_set)
+    router.namespace("ubu", user_detail)
+
+    # bulk create
+    router.action("bulk_start", bulk_start)
+    router.action("bulk_run", bulk_run, BulkCreateFlow.confirm)
+
+    # массовые действия: мастер из /users, сквады — та же клавиатура int_*, что и в создании
+    router.action("ba_start", bulk_action_start)
+    router.namespace("ba", bulk_action_pick, BulkActionFlow.action)
+    router.namespace("bad", bulk_days_pick, BulkActionFlow.days)
+    router.namespace("int", bulk_squad_toggle, BulkActionFlow.squads)
+    router.action("int_next", bulk_squads_next, BulkActionFlow.squads)
+    # Не ba_run: в состоянии action его перехватил бы namespace ba (router.check это ловит)
+    router.action("bj_run", bulk_action_run, BulkActionFlow.confirm)
+    router.namespace("bjc", bulk_job_cancel)
+    router.namespace("bjr", bulk_job_resume)
+
+    # /stats
+    router.action("st_refresh", stats_refresh)
 
-    # external squad
-    dp.callback_query.register(external_handler, CreateUserFlow.external_squad, F.data.startswith("ext_") | (F.data == "ext_skip"))
+    return router
 
-    # confirm
-    dp.callback_query.register(confirm_create, CreateUserFlow.confirm, F.data == "confirm_create")
 
-    await dp.start_polling(bot)
+def create_dispatcher(storage: BaseStorage | None = None) -> Dispatcher:
+    """Диспетчер со всеми хендлерами — одинаковый для polling и webhook. storage — для тестов."""
+    dp = Dispatcher(storage=storage or create_storage())
+
+    # Регистрируем middleware: проверка админа — до FSM, чужие апдейты не трогают storage
+    setup_admin_gate(dp)
+    dp.message.middleware(MetricsMiddleware())
+    dp.callback_query.middleware(MetricsMiddleware())
+
+    # Только async-фильтры: синхронные (F.text, голый State) aiogram
+    # проверяет через to_thread — поток на каждое сообщение и каждый хендлер
+    dp.message.register(cmd_start, CommandStart())
+    # Команды — до текстовых шагов флоу, иначе «/find ...» уйдёт в username
+    dp.message.register(cmd_find, Command("find"))
+    dp.message.register(cmd_users, Command("users"))
+    dp.message.register(cmd_export, Command("export"))
+    dp.message.register(cmd_stats, Command("stats"))
+    dp.message.register(cmd_audit, Command("audit"))
+    dp.message.register(cmd_presets, Command("presets"))
+
+    # текстовый ввод по шагам флоу
+    dp.message.register(username_text, StateFilter(CreateUserFlow.username))
+    dp.message.register(expire_manual_text, StateFilter(CreateUserFlow.expire_manual_days))
+    dp.message.register(email_text, StateFilter(CreateUserFlow.email))
+    dp.message.register(telegram_text, StateFilter(CreateUserFlow.telegram_id))
+    dp.message.register(hwid_text, StateFilter(CreateUserFlow.hwid_limit))
+    dp.message.register(tag_text, StateFilter(CreateUserFlow.tag))
+    dp.message.register(description_text, StateFilter(CreateUserFlow.description))
+    dp.message.register(traffic_manual_text, StateFilter(CreateUserFlow.traffic_manual_gb))
+    dp.message.register(confirm_overrides_text, StateFilter(CreateUserFlow.confirm))
+    dp.message.register(preset_name_text, StateFilter(CreateUserFlow.preset_name))
+    dp.message.register(bulk_file, StateFilter(BulkCreateFlow.upload), F.document)
+    dp.message.register(bulk_days_text, StateFilter(BulkActionFlow.days))
+
+    # Все кнопки — через один роутер с таблицами вместо цепочки фильтров
+    router = create_callback_router()
+    router.check()
+    dp.callback_query.register(router.dispatch)
+
+    return dp
+
+
+# Своя обёртка: warm_up идёт фоновой задачей, и без неё ошибка всплыла бы только
+# как «Task exception was never retrieved», без трейсбека в логе
+@logger.catch
+async def warm_up(bot: Bot, owns: Callable[[int], bool] | None = None):
+    """
+    То, что нужно только для работы с панелью, — после старта приёма апдейтов:
+    импорт SDK в потоке (~1.3 с моделей), клиент, каталог сквадов, индекс и
+    незаконченные массовые задачи. Админ, пришедший раньше, просто подождёт импорт.
+    owns — под супервизором: какие чаты обслуживает этот воркер.
+    """
+    started = time.monotonic()
+    await asyncio.to_thread(remnawave_client.warm_up)
+    # Общий клиент панели: один пул keep-alive соединений на весь процесс
+    init_sdk()
+    squad_catalog.start()
+    await user_index.start()
+    id_pool.start()
+    await restore_jobs(bot, owns)
+    # Модели SDK тоже живут до конца процесса — туда же, к замороженным
+    gc.freeze()
+    logger.info(f"Warm-up finished in {time.monotonic() - started:.2f}s")
+
+
+def create_bot() -> Bot:
+    bot = Bot(token=BOT_TOKEN)
+    setup_rate_limiter(bot)
+    # После лимитера: меряем сам Telegram, без ожидания в очереди
+    bot.session.middleware(TelegramMetricsMiddleware())
+    return bot
+
+
+async def start_services(bot: Bot, owns: Callable[[int], bool] | None = None) -> Callable[[], Awaitable]:
+    """
+    Метрики, аудит и прогрев панели — общее для бота и воркера супервизора.
+    Возвращает корутину-функцию остановки всего этого.
+    """
+    metrics_runner = None
+    if METRICS_PORT:
+        registry.collector("bot_send_queue", send_scheduler.stats)
+        registry.collector("remnawave_circuit", panel_breaker.stats)
+        registry.collector("user_index", user_index.stats)
+        registry.collector("audit", audit_log.stats)
+        registry.collector("id_pool", id_pool.stats)
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+    audit_log.start()
+    # Объекты aiogram (~250k) живут до конца процесса. Без freeze каждая полная сборка
+    # мусора обходит их заново — ~200 мс стоп-кадра посреди работы; после freeze GC
+    # смотрит только на новые объекты. Мусора после импорта нет, gc.collect() не нужен
+    gc.freeze()
+    # Панель и всё, что от неё зависит, — в фоне: апдейты начинаем принимать сразу
+    warming = asyncio.create_task(warm_up(bot, owns))
+
+    async def stop():
+        logger.info(f"Bot API send stats: {send_scheduler.stats()}")
+        if not warming.done():
+            warming.cancel()
+        await asyncio.gather(warming, return_exceptions=True)
+        await squad_catalog.stop()
+        await job_runner.stop()
+        await id_pool.stop()
+        await user_index.stop()
+        await close_sdk()
+        await audit_log.stop()
+        await logger.complete()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+
+    return stop
+
+
+@logger.catch
+async def main():
+    bot = create_bot()
+    dp = create_dispatcher()
+    stop_services = await start_services(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # Telegram не отдаёт getUpdates, пока висит webhook от прошлого режима
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await stop_services()
 
 
 if __name__ == "__main__":
@@ -113,4 +360,3 @@ if __name__ == "__main__":
         logger.error(f"The bot fell with a mistake: {e}")
     finally:
         logger.warning("Bot off")
-        asyncio.session.close()
\ No newline at end of file
@@ -0,0 +1,258 @@
+import asyncio
+import json
+import os
+import secrets
+import time
+from dataclasses import dataclass, field, asdict
+from typing import Callable
+
+import httpx
+from loguru import logger
+
+from config import BULK_ACTION_CHUNK, BULK_ACTION_CONCURRENCY, BULK_JOBS_DIR, BULK_JOB_TTL
+from pipeline import run_bounded
+import remnawave_client as panel
+from remnawave_client import get_sdk
+from resilience import NOT_SENT_ERRORS, PanelUnavailable
+
+ACTIONS = {
+    "extend": "⏳ Продлить",
+    "reset_traffic": "🔄 Сбросить трафик",
+    "squads": "👥 Сменить сквады",
+    "disable": "⛔ Отключить",
+    "enable": "✅ Включить",
+}
+
+# Повтор такого действия меняет результат (+30 дней дважды — это +60).
+# Если ответа панели не дождались, пачку не повторяем, а помечаем «неизвестно»
+NON_IDEMPOTENT = {"extend"}
+
+# Состояния пачки. Нет в job.chunks — ещё не запускалась
+CHUNK_DONE = "done"
+CHUNK_FAILED = "failed"  # панель точно не применила — можно повторить
+CHUNK_UNKNOWN = "unknown"  # запрос мог дойти — повторять нельзя
+
+
+@dataclass
+class BulkJob:
+    """Массовое действие над списком UUID. Сохраняется на диск после каждой пачки."""
+    id: str
+    action: str
+    params: dict
+    uuids: list[str]
+    chat_id: int
+    message_id: int
+    chunk_size: int = BULK_ACTION_CHUNK
+    chunks: dict[int, str] = field(default_factory=dict)
+    affected: int = 0
+    status: str = "running"  # running / paused / cancelled / done
+    error: str | None = None
+    created_at: float = field(default_factory=time.time)
+    finished_at: float | None = None
+
+    @property
+    def total_chunks(self) -> int:
+        return -(-len(self.uuids) // self.chunk_size)
+
+    def chunk(self, index: int) -> list[str]:
+        return self.uuids[index * self.chunk_size:(index + 1) * self.chunk_size]
+
+    def pending(self) -> list[int]:
+        """Пачки, которые ещё можно (до)выполнить: не запускались или точно не применились."""
+        return [i for i in range(self.total_chunks) if self.chunks.get(i) in (None, CHUNK_FAILED)]
+
+    def users_in(self, chunk_state: str) -> int:
+        return sum(len(self.chunk(i)) for i, s in self.chunks.items() if s == chunk_state)
+
+    @property
+    def resumable(self) -> bool:
+        return self.status in ("paused", "cancelled") and bool(self.pending())
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "BulkJob":
+        data = json.loads(raw)
+        # Ключи dict в JSON — строки
+        data["chunks"] = {int(i): s for i, s in data["chunks"].items()}
+        return cls(**data)
+
+
+async def apply_chunk(action: str, params: dict, uuids: list[str]) -> int:
+    """Один запрос к bulk-эндпоинту панели. Возвращает число затронутых пользователей."""
+    api = get_sdk().users_bulk_actions
+    if action == "extend":
+        body = panel.BulkExtendExpirationDateRequestDto(uuids=uuids, extend_days=params["days"])
+        response = await api.bulk_extend_expiration_date(body=body)
+    elif action == "reset_traffic":
+        response = await api.bulk_reset_user_traffic(body=panel.BulkResetTrafficUsersRequestDto(uuids=uuids))
+    elif action == "squads":
+        body = panel.BulkUpdateUsersSquadsRequestDto(uuids=uuids, active_internal_squads=params["squads"])
+        response = await api.bulk_update_users_internal_squads(body=body)
+    elif action in ("disable", "enable"):
+        status = panel.UserStatus.DISABLED if action == "disable" else panel.UserStatus.ACTIVE
+        body = panel.BulkUpdateUsersRequestDto(uuids=uuids, fields=panel.UpdateUserFields(status=status))
+        response = await api.bulk_update_users(body=body)
+    else:
+        raise ValueError(f"Unknown bulk action {action!r}")
+    return int(response.affected_rows)
+
+
+def _chunk_state_after(action: str, error: Exception) -> str:
+    # Отказ breaker'а или запрос, не ушедший в сеть — пачка точно не применилась
+    if isinstance(error, (PanelUnavailable, *NOT_SENT_ERRORS)):
+        return CHUNK_FAILED
+    if action in NON_IDEMPOTENT:
+        # 5xx (в том числе 502/504 от reverse proxy) приходит и тогда, когда панель уже
+        # применила запрос; точный отказ — только 4xx
+        if isinstance(error, panel.ApiError):
+            return CHUNK_UNKNOWN if (error.status_code or 0) >= 500 else CHUNK_FAILED
+        if isinstance(error, (httpx.TransportError, asyncio.TimeoutError)):
+            return CHUNK_UNKNOWN
+    return CHUNK_FAILED
+
+
+class JobRunner:
+    """
+    Фоновые массовые действия: пачки по chunk_size UUID, не больше concurrency запросов сразу.
+    Прогресс сохраняется в directory после каждой пачки, так что задачу, упавшую
+    или прерванную рестартом, можно продолжить с того места, где она остановилась.
+    """
+
+    def __init__(self, directory: str, concurrency: int, ttl: float):
+        self.directory = directory
+        self.concurrency = concurrency
+        self.ttl = ttl
+        self.jobs: dict[str, BulkJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._cancel: dict[str, asyncio.Event] = {}
+        self._save_lock = asyncio.Lock()
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _write(self, job_id: str, raw: str):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self._path(job_id) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(raw)
+        os.replace(tmp, self._path(job_id))
+
+    async def save(self, job: BulkJob):
+        async with self._save_lock:
+            if job.status == "done":
+                # Закончена — возобновлять нечего, файл больше не нужен
+                await asyncio.to_thread(self._remove, job.id)
+            else:
+                await asyncio.to_thread(self._write, job.id, job.to_json())
+
+    def _remove(self, job_id: str):
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def load(self, owns: Callable[[int], bool] | None = None) -> list[BulkJob]:
+        """
+        При старте: незаконченные задачи с диска. Те, что шли в момент остановки, — на паузе.
+        owns — под супервизором: берём только задачи чатов этого воркера, чужие файлы не трогаем.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        restored = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    job = BulkJob.from_json(f.read())
+            except (OSError, ValueError, TypeError) as e:
+                logger.warning(f"Skipping broken bulk job file {name}: {e}")
+                continue
+            if owns is not None and not owns(job.chat_id):
+                continue
+            if time.time() - job.created_at > self.ttl:
+                os.remove(path)
+                continue
+            if job.status == "running":
+                job.status = "paused"
+                job.error = "бот перезапускался"
+            self.jobs[job.id] = job
+            restored.append(job)
+        return restored
+
+    def create(self, action: str, params: dict, uuids: list[str], chat_id: int, message_id: int) -> BulkJob:
+        job = BulkJob(secrets.token_hex(4), action, params, uuids, chat_id, message_id)
+        self.jobs[job.id] = job
+        return job
+
+    def is_running(self, job_id: str) -> bool:
+        task = self._tasks.get(job_id)
+        return task is not None and not task.done()
+
+    def start(self, job: BulkJob) -> asyncio.Task:
+        if self.is_running(job.id):
+            return self._tasks[job.id]
+        self._cancel[job.id] = asyncio.Event()
+        task = asyncio.create_task(self._run(job))
+        self._tasks[job.id] = task
+        return task
+
+    def cancel(self, job_id: str) -> bool:
+        """Новые пачки не запускаются; те, что уже в полёте, доходят до конца."""
+        event = self._cancel.get(job_id)
+        if event is None or not self.is_running(job_id):
+            return False
+        event.set()
+        return True
+
+    async def _run(self, job: BulkJob):
+        cancel = self._cancel[job.id]
+        job.status, job.error = "running", None
+        await self.save(job)
+        started = time.monotonic()
+
+        async def worker(index: int):
+            if cancel.is_set():
+                return
+            try:
+                affected = await apply_chunk(job.action, job.params, job.chunk(index))
+                job.affected += affected
+                job.chunks[index] = CHUNK_DONE
+            except Exception as e:
+                job.chunks[index] = _chunk_state_after(job.action, e)
+                job.error = str(e) or type(e).__name__
+                logger.warning(f"Bulk job {job.id} chunk {index} {job.chunks[index]}: {job.error}")
+            await self.save(job)
+
+        try:
+            await run_bounded(job.pending(), worker, self.concurrency)
+        except asyncio.CancelledError:
+            job.status = "paused"
+            await self.save(job)
+            raise
+
+        if cancel.is_set():
+            job.status = "cancelled"
+        elif job.pending():
+            job.status = "paused"
+        else:
+            job.status = "done"
+            job.finished_at = time.time()
+        await self.save(job)
+        logger.info(
+            f"Bulk job {job.id} ({job.action}) {job.status}: {job.users_in(CHUNK_DONE)}/{len(job.uuids)} users "
+            f"in {time.monotonic() - started:.1f}s, failed {job.users_in(CHUNK_FAILED)}, "
+            f"unknown {job.users_in(CHUNK_UNKNOWN)}"
+        )
+
+    async def stop(self):
+        for task in self._tasks.values():
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+
+job_runner = JobRunner(BULK_JOBS_DIR, BULK_ACTION_CONCURRENCY, BULK_JOB_TTL)
@@ -0,0 +1,114 @@
+from typing import Awaitable, Callable
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.types import CallbackQuery
+from loguru import logger
+
+CallbackHandler = Callable[[CallbackQuery, FSMContext], Awaitable]
+
+# Маршрут, который работает в любом состоянии FSM
+ANY_STATE = "*"
+
+
+def parse_callback_data(data: str) -> tuple[str, str, str]:
+    """
+    "int_6ee7a7cd" -> ("int", "int_6ee7a7cd", "6ee7a7cd")
+    namespace — всё до первого "_", action — полная строка, arg — остаток.
+    """
+    namespace, _, arg = data.partition("_")
+    return namespace, data, arg
+
+
+def _state_key(state: State | str | None) -> str | None:
+    return state.state if isinstance(state, State) else state
+
+
+class CallbackRouter:
+    """
+    Один хендлер на все callback_query вместо цепочки фильтров aiogram.
+
+    callback_data разбирается один раз, дальше — поиск в двух dict:
+      1. точное совпадение action в текущем состоянии, потом в любом состоянии;
+      2. namespace (префикс до "_") в текущем состоянии, потом в любом.
+    Так "tr_next" и "tr_manual" больше не пересекаются с общим "tr_*".
+    Дубли маршрутов ловятся при регистрации, а не молча затеняют друг друга.
+    """
+
+    def __init__(self):
+        self._exact: dict[tuple[str | None, str], CallbackHandler] = {}
+        self._namespace: dict[tuple[str | None, str], CallbackHandler] = {}
+
+    def _add(self, table: dict, kind: str, key: tuple, handler: CallbackHandler):
+        if key in table and table[key] is not handler:
+            raise ValueError(
+                f"Ambiguous callback route {kind} {key[1]!r} in state {key[0]!r}: "
+                f"{table[key].__name__} vs {handler.__name__}"
+            )
+        table[key] = handler
+
+    def action(self, action: str, handler: CallbackHandler, state: State | str | None = ANY_STATE):
+        self._add(self._exact, "action", (_state_key(state), action), handler)
+
+    def namespace(self, namespace: str, handler: CallbackHandler, state: State | str | None = ANY_STATE):
+        if "_" in namespace:
+            raise ValueError(f"Namespace {namespace!r} must not contain '_'")
+        self._add(self._namespace, "namespace", (_state_key(state), namespace), handler)
+
+    def routes(self) -> list[tuple[str, str | None, str, CallbackHandler]]:
+        """(kind, state, key, handler) в порядке приоритета resolve — для сравнения в loadtest."""
+        exact = sorted(self._exact.items(), key=lambda item: item[0][0] == ANY_STATE)
+        namespace = sorted(self._namespace.items(), key=lambda item: item[0][0] == ANY_STATE)
+        return ([("action", state, key, handler) for (state, key), handler in exact]
+                + [("namespace", state, key, handler) for (state, key), handler in namespace])
+
+    def shadowed(self) -> list[str]:
+        """
+        Точные action, которые вне своего состояния попадают в чужой namespace:
+        "pr_run" только в confirm при "pr" в любом состоянии — устаревшее нажатие
+        «Создать» уйдёт в хендлер pr_*.
+        """
+        problems = []
+        for state, action in self._exact:
+            if state == ANY_STATE or (ANY_STATE, action) in self._exact:
+                continue
+            namespace = parse_callback_data(action)[0]
+            for (ns_state, ns), handler in self._namespace.items():
+                if ns != namespace or ns_state == state:
+                    continue
+                # В том состоянии у action свой маршрут — namespace туда не дотянется
+                if ns_state != ANY_STATE and (ns_state, action) in self._exact:
+                    continue
+                problems.append(
+                    f"action {action!r} (state {state!r}) falls into namespace {ns!r} "
+                    f"({handler.__name__}) in state {ns_state!r}"
+                )
+        return problems
+
+    def check(self):
+        """
+        Вызывается при старте: пустой роутер почти наверняка означает ошибку сборки,
+        а action, затенённый namespace в другом состоянии, — выбор неудачного префикса.
+        """
+        if not self._exact and not self._namespace:
+            raise ValueError("Callback router has no routes")
+        problems = self.shadowed()
+        if problems:
+            raise ValueError("Shadowed callback routes:\n" + "\n".join(problems))
+        logger.info(f"Callback router: {len(self._exact)} actions, {len(self._namespace)} namespaces")
+
+    def resolve(self, raw_state: str | None, data: str) -> CallbackHandler | None:
+        namespace, action, _ = parse_callback_data(data)
+        return (
+            self._exact.get((raw_state, action))
+            or self._exact.get((ANY_STATE, action))
+            or self._namespace.get((raw_state, namespace))
+            or self._namespace.get((ANY_STATE, namespace))
+        )
+
+    async def dispatch(self, call: CallbackQuery, state: FSMContext, raw_state: str | None = None):
+        handler = self.resolve(raw_state, call.data or "")
+        if handler is None:
+            # Кнопка из старого сообщения или другого шага — просто гасим «часики»
+            return call.answer()
+        return await handler(call, state)
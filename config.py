@@ -1,7 +1,9 @@
 import os
-from dotenv import load_dotenv
+from dotenv import find_dotenv, load_dotenv
 
-load_dotenv()
+# Путь запоминаем: список админов перечитывается из него без рестарта
+ENV_FILE = find_dotenv()
+load_dotenv(ENV_FILE)
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
@@ -9,6 +11,118 @@ REMNAWAVE_BASE_URL = os.getenv("REMNAWAVE_BASE_URL")
 REMNAWAVE_TOKEN = os.getenv("REMNAWAVE_TOKEN")
 EGAMES_COOKIE = os.getenv("EGAMES_COOKIE")
 
+# Telegram ID админов через запятую. Меняется в .env на лету, без рестарта
+ADMIN_IDS_RAW = os.getenv("ADMIN_IDS", "5610915553,1838230929")
+ADMIN_RELOAD_INTERVAL = float(os.getenv("ADMIN_RELOAD_INTERVAL", "5"))
+# Чужим отвечаем «нет доступа» не чаще раза в окно, остальное молча выкидываем
+ADMIN_DENY_REPLY_INTERVAL = float(os.getenv("ADMIN_DENY_REPLY_INTERVAL", "60"))
+
+# Приём апдейтов: polling или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+
+# Лимиты Bot API (запросов в секунду)
+TG_GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))
+TG_CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))
+TG_CHAT_BURST = float(os.getenv("TG_CHAT_BURST", "3"))
+TG_GROUP_RATE = float(os.getenv("TG_GROUP_RATE", str(20 / 60)))
+TG_MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "3"))
+
+# Сколько последних отрисованных сообщений помнить, чтобы не слать одинаковые правки
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "5000"))
+
+# Пул соединений к панели
+REMNAWAVE_POOL_SIZE = int(os.getenv("REMNAWAVE_POOL_SIZE", "20"))
+REMNAWAVE_KEEPALIVE = int(os.getenv("REMNAWAVE_KEEPALIVE", "10"))
+REMNAWAVE_KEEPALIVE_EXPIRY = float(os.getenv("REMNAWAVE_KEEPALIVE_EXPIRY", "60"))
+REMNAWAVE_TIMEOUT = float(os.getenv("REMNAWAVE_TIMEOUT", "15"))
+REMNAWAVE_CONNECT_TIMEOUT = float(os.getenv("REMNAWAVE_CONNECT_TIMEOUT", "5"))
+
+# Запросы к панели: deadline на вызов с повторами, повторы, circuit breaker
+REMNAWAVE_DEADLINE = float(os.getenv("REMNAWAVE_DEADLINE", "10"))
+REMNAWAVE_RETRIES = int(os.getenv("REMNAWAVE_RETRIES", "3"))
+REMNAWAVE_BACKOFF_BASE = float(os.getenv("REMNAWAVE_BACKOFF_BASE", "0.2"))
+REMNAWAVE_BACKOFF_MAX = float(os.getenv("REMNAWAVE_BACKOFF_MAX", "2"))
+REMNAWAVE_BREAKER_FAILURES = int(os.getenv("REMNAWAVE_BREAKER_FAILURES", "5"))
+REMNAWAVE_BREAKER_COOLDOWN = float(os.getenv("REMNAWAVE_BREAKER_COOLDOWN", "30"))
+
+# FSM storage: memory, sqlite (по умолчанию) или redis
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "data/fsm.sqlite3")
+FSM_REDIS_URL = os.getenv("FSM_REDIS_URL", "redis://localhost:6379/0")
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+
+# Каталог сквадов с панели
+SQUADS_TTL = float(os.getenv("SQUADS_TTL", "300"))
+SQUADS_RETRY_INTERVAL = float(os.getenv("SQUADS_RETRY_INTERVAL", "30"))
+
+# Локальный индекс пользователей для /find: полная выгрузка при старте, потом обновления
+USER_INDEX_PATH = os.getenv("USER_INDEX_PATH", "data/users.sqlite3")
+USER_INDEX_REFRESH = float(os.getenv("USER_INDEX_REFRESH", "600"))
+USER_INDEX_RETRY_INTERVAL = float(os.getenv("USER_INDEX_RETRY_INTERVAL", "60"))
+USER_INDEX_PAGE_SIZE = int(os.getenv("USER_INDEX_PAGE_SIZE", "1000"))
+# Под супервизором: как часто проверять, не изменил ли общую базу другой воркер
+USER_INDEX_FOLLOW_INTERVAL = float(os.getenv("USER_INDEX_FOLLOW_INTERVAL", "2"))
+
+# Запас заранее сгенерированных и проверенных по индексу username/short_uuid
+ID_POOL_SIZE = int(os.getenv("ID_POOL_SIZE", "256"))
+
+# Пресеты создания: хранятся в файле, меняются из бота; PRESET_MAX_COUNT — сколько
+# пользователей можно создать по пресету за раз
+PRESETS_PATH = os.getenv("PRESETS_PATH", "data/presets.json")
+PRESET_MAX_COUNT = int(os.getenv("PRESET_MAX_COUNT", "50"))
+
+# /users: пользователей на странице и сколько живёт страница в кэше
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "10"))
+USERS_PAGE_TTL = float(os.getenv("USERS_PAGE_TTL", "30"))
+
+# Массовое создание из файла
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "8"))
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "5000"))
+BULK_MAX_FILE_SIZE = int(os.getenv("BULK_MAX_FILE_SIZE", str(5 * 1024 * 1024)))
+BULK_PROGRESS_INTERVAL = float(os.getenv("BULK_PROGRESS_INTERVAL", "3"))
+
+# Массовые действия над существующими: пачки по BULK_ACTION_CHUNK (у панели максимум 500)
+BULK_ACTION_CHUNK = int(os.getenv("BULK_ACTION_CHUNK", "500"))
+BULK_ACTION_CONCURRENCY = int(os.getenv("BULK_ACTION_CONCURRENCY", "3"))
+BULK_JOBS_DIR = os.getenv("BULK_JOBS_DIR", "data/jobs")
+BULK_JOB_TTL = float(os.getenv("BULK_JOB_TTL", str(7 * 24 * 3600)))
+
+# /export: страницы стрима пишутся сразу в gzip-файл во временной папке
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "500"))
+EXPORT_TMP_DIR = os.getenv("EXPORT_TMP_DIR", "data/exports")
+
+# /stats: отчёт по всем пользователям пересчитывается не чаще раза в STATS_TTL секунд
+STATS_TTL = float(os.getenv("STATS_TTL", "300"))
+STATS_PAGE_SIZE = int(os.getenv("STATS_PAGE_SIZE", "1000"))
+STATS_TOP_N = int(os.getenv("STATS_TOP_N", "10"))
+
+# Аудит действий админов (JSONL): ротация по размеру, старые части — в .gz
+AUDIT_PATH = os.getenv("AUDIT_PATH", "logs/audit.jsonl")
+AUDIT_MAX_BYTES = int(os.getenv("AUDIT_MAX_BYTES", str(10 * 1024 * 1024)))
+AUDIT_BACKUPS = int(os.getenv("AUDIT_BACKUPS", "30"))
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+
+# Prometheus-метрики: http://METRICS_HOST:METRICS_PORT/metrics, 0 — выключено
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))
+
+# Лог бота; под супервизором у каждого воркера свой файл
+LOG_PATH = os.getenv("LOG_PATH", "logs/bot.log")
+
+# python supervisor.py: апдейты принимает один процесс и раздаёт по chat_id воркерам.
+# 0 — по числу ядер. Больше SUPERVISOR_MAX_PENDING необработанных апдейтов у воркера —
+# новые не забираем, Telegram подержит их у себя
+SUPERVISOR_WORKERS = int(os.getenv("SUPERVISOR_WORKERS", "0"))
+SUPERVISOR_MAX_PENDING = int(os.getenv("SUPERVISOR_MAX_PENDING", "1000"))
+# Апдейты, которые воркеры не успели начать до остановки, — их отдадим при следующем запуске
+SUPERVISOR_PENDING_PATH = os.getenv("SUPERVISOR_PENDING_PATH", "data/supervisor_pending.json")
+
 if not BOT_TOKEN:
     raise ValueError("BOT_TOKEN is not set in .env")
 
@@ -20,3 +134,48 @@ if not REMNAWAVE_TOKEN:
 
 if not EGAMES_COOKIE:
     raise ValueError("EGAMES_COOKIE is not set in .env")
+
+if not all(part.strip().isdigit() for part in ADMIN_IDS_RAW.split(",") if part.strip()):
+    raise ValueError("ADMIN_IDS must be a comma-separated list of Telegram IDs")
+
+if BOT_MODE not in ("polling", "webhook"):
+    raise ValueError("BOT_MODE must be 'polling' or 'webhook'")
+
+if FSM_STORAGE not in ("memory", "sqlite", "redis"):
+    raise ValueError("FSM_STORAGE must be 'memory', 'sqlite' or 'redis'")
+
+if BOT_MODE == "webhook" and not WEBHOOK_BASE_URL:
+    raise ValueError("WEBHOOK_BASE_URL is not set in .env")
+
+
+def check_config() -> list[str]:
+    """
+    Для `python bot.py --check-config`: то, что не мешает импорту config, но сломает
+    бота уже после запуска. Только stdlib — без aiogram и SDK панели.
+    """
+    import importlib.util
+
+    problems = []
+    if not ENV_FILE:
+        problems.append("warning: .env not found, settings come from the environment only")
+    if not ADMIN_IDS_RAW.strip(",").strip():
+        problems.append("warning: ADMIN_IDS is empty, nobody can use the bot")
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        problems.append("warning: WEBHOOK_SECRET is not set, anyone can post updates to the webhook")
+    if FSM_STORAGE == "redis" and importlib.util.find_spec("redis") is None:
+        problems.append("error: FSM_STORAGE=redis requires the 'redis' package")
+    if importlib.util.find_spec("numpy") is None:
+        problems.append("warning: 'numpy' is not installed, /stats will be unavailable")
+
+    # Папки, куда бот пишет: первая существующая родительская должна быть доступна на запись
+    files = [USER_INDEX_PATH, AUDIT_PATH, PRESETS_PATH, os.path.join(BULK_JOBS_DIR, "-"),
+             os.path.join(EXPORT_TMP_DIR, "-"), SUPERVISOR_PENDING_PATH]
+    if FSM_STORAGE == "sqlite":
+        files.append(FSM_SQLITE_PATH)
+    for path in files:
+        directory = os.path.dirname(os.path.abspath(path))
+        while not os.path.isdir(directory):
+            directory = os.path.dirname(directory)
+        if not os.access(directory, os.W_OK):
+            problems.append(f"error: {directory} is not writable (needed for {path})")
+    return problems
@@ -0,0 +1,80 @@
+from typing import Any
+
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import StateType
+
+# Отличает «состояние не трогали» от set_state(None)
+_UNSET = object()
+
+
+class StateTx:
+    """
+    Транзакция над FSMContext: одно чтение на входе, одна запись на выходе.
+
+        async with state_tx(state) as tx:
+            tx.update(username=username)
+            tx.set_state(CreateUserFlow.expire_select)
+
+    Внутри блока tx.data и tx.state — локальная копия, storage не трогается.
+    Изменения записываются, только если блок завершился без исключения.
+    """
+
+    def __init__(self, context: FSMContext):
+        self.context = context
+        self.state: str | None = None
+        self.data: dict[str, Any] = {}
+        self._new_state = _UNSET
+        self._data_changed = False
+
+    async def __aenter__(self) -> "StateTx":
+        storage, key = self.context.storage, self.context.key
+        get_record = getattr(storage, "get_record", None)
+        if get_record is not None:
+            self.state, self.data = await get_record(key)
+        else:
+            self.state = await storage.get_state(key)
+            self.data = await storage.get_data(key)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self.commit()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self.data.get(key, default)
+
+    def update(self, **kwargs: Any):
+        self.data.update(kwargs)
+        self._data_changed = True
+
+    def set_state(self, state: StateType = None):
+        self._new_state = state.state if isinstance(state, State) else state
+        self.state = self._new_state
+
+    def clear(self):
+        self.data = {}
+        self._data_changed = True
+        self.set_state(None)
+
+    async def commit(self):
+        state_changed = self._new_state is not _UNSET
+        if not state_changed and not self._data_changed:
+            return
+
+        storage, key = self.context.storage, self.context.key
+        set_record = getattr(storage, "set_record", None)
+        if set_record is not None:
+            await set_record(key, self.state, self.data)
+        else:
+            if state_changed:
+                await storage.set_state(key, self.state)
+            if self._data_changed:
+                await storage.set_data(key, self.data)
+
+        self._new_state = _UNSET
+        self._data_changed = False
+
+
+def state_tx(context: FSMContext) -> StateTx:
+    return StateTx(context)
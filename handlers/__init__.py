@@ -23,5 +23,51 @@ from .create_user import (
     internal_next,
     external_handler,
     confirm_create,
-    cancel_flow
+    noop_handler,
+    cancel_flow,
+    cancel_handler
+)
+from .find import cmd_find
+from .export import cmd_export
+from .stats import cmd_stats, stats_refresh
+from .audit import cmd_audit
+from .users import (
+    cmd_users,
+    users_open,
+    users_list,
+    users_next,
+    users_prev,
+    users_filters,
+    users_filter_set,
+    users_filter_reset,
+    users_close,
+    user_detail
+)
+from .bulk_actions import (
+    bulk_action_start,
+    bulk_action_pick,
+    bulk_days_pick,
+    bulk_days_text,
+    bulk_squad_toggle,
+    bulk_squads_next,
+    bulk_action_run,
+    bulk_job_cancel,
+    bulk_job_resume,
+    restore_jobs
+)
+from .bulk_create import (
+    bulk_start,
+    bulk_file,
+    bulk_run
+)
+from .presets import (
+    preset_pick,
+    preset_count,
+    confirm_overrides_text,
+    preset_run,
+    preset_save,
+    preset_back,
+    preset_name_text,
+    cmd_presets,
+    preset_delete
 )
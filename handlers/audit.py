@@ -0,0 +1,32 @@
+from aiogram.filters import CommandObject
+from aiogram.types import Message
+from aiogram.utils.markdown import hcode
+
+from audit import audit_log
+
+AUDIT_DEFAULT = 10
+AUDIT_MAX = 20
+
+
+def audit_line(entry: dict) -> str:
+    ts = entry.get("ts", "")[:19].replace("T", " ")
+    who = entry.get("username") or "—"
+    line = f"🕒 {ts} · 👮 {entry.get('admin_id')} · {hcode(str(who))}"
+    if entry.get("source"):
+        line += f" · {entry['source']}"
+    line += f" · {entry.get('latency_ms')} мс"
+    if entry.get("error"):
+        return f"❌ {line}\n     {hcode(entry['error'][:80])}"
+    return f"✅ {line}\n     {hcode(entry.get('uuid', ''))}"
+
+
+async def cmd_audit(message: Message, command: CommandObject):
+    arg = (command.args or "").strip()
+    count = int(arg) if arg.isdigit() else AUDIT_DEFAULT
+    count = max(1, min(count, AUDIT_MAX))
+
+    entries = await audit_log.recent(count)
+    if not entries:
+        return message.answer("📜 Журнал пока пуст.")
+    lines = [audit_line(entry) for entry in reversed(entries)]
+    return message.answer(f"📜 Последние {len(lines)} записей (новые сверху):\n\n" + "\n".join(lines), parse_mode="HTML")
@@ -0,0 +1,282 @@
+import asyncio
+import html
+from datetime import datetime, timezone
+from typing import Callable
+
+from aiogram import Bot
+from aiogram.types import CallbackQuery, Chat, Message
+from aiogram.fsm.context import FSMContext
+from loguru import logger
+
+from config import BULK_PROGRESS_INTERVAL
+from bulk_jobs import ACTIONS, CHUNK_DONE, CHUNK_FAILED, CHUNK_UNKNOWN, NON_IDEMPOTENT, BulkJob, job_runner
+from fsm_tx import state_tx
+from states import BulkActionFlow
+from keyboards import (
+    bulk_action_kb,
+    bulk_days_kb,
+    bulk_action_confirm_kb,
+    bulk_job_kb,
+    internal_squads_kb,
+)
+from squads import squad_catalog
+from user_index import UserFilter, user_index
+from .create_user import safe_edit_text
+from .users import browse_state, browse_filters, filters_text, INDEX_LOADING_TEXT
+
+MAX_EXTEND_DAYS = 9999
+SAMPLE_SIZE = 5
+
+# Держим ссылки на фоновые задачи, чтобы их не собрал GC
+_reporters: set[asyncio.Task] = set()
+
+
+# =========================
+# Texts
+# =========================
+
+def action_text(action: str, params: dict) -> str:
+    text = ACTIONS[action]
+    if action == "extend":
+        text += f" на {params['days']} дн."
+    elif action == "squads":
+        names = {uuid: name for name, uuid in squad_catalog.get().internal.values()}
+        text += ": " + (", ".join(names.get(uuid, uuid[:8]) for uuid in params["squads"]) or "без сквадов")
+    return text
+
+
+def job_text(job: BulkJob) -> str:
+    done, failed, unknown = job.users_in(CHUNK_DONE), job.users_in(CHUNK_FAILED), job.users_in(CHUNK_UNKNOWN)
+    lines = [
+        f"⚙️ {html.escape(action_text(job.action, job.params))}",
+        f"👥 Пользователей: {len(job.uuids)} · пачек: {len(job.chunks)}/{job.total_chunks}",
+        "",
+        f"✅ Применено: {done} (панель: {job.affected})",
+    ]
+    if failed:
+        lines.append(f"❌ Не применено: {failed}")
+    if unknown:
+        lines.append(f"⚠️ Результат неизвестен (не повторяем, проверь в панели): {unknown}")
+
+    if job_runner.is_running(job.id):
+        lines.append("\n⏳ Выполняется…")
+    elif job.status == "done":
+        elapsed = (job.finished_at or job.created_at) - job.created_at
+        lines.append(f"\n🏁 Готово за {elapsed:.0f} сек.")
+    elif job.status == "cancelled":
+        lines.append("\n⏹ Остановлено.")
+    else:
+        lines.append(f"\n⏸ Пауза: {html.escape(job.error or 'ошибка')}")
+    return "\n".join(lines)
+
+
+def job_kb(job: BulkJob):
+    return bulk_job_kb(job.id, job_runner.is_running(job.id), job.resumable)
+
+
+def _job_message(bot: Bot, job: BulkJob) -> Message:
+    # После рестарта объекта Message нет — хватает chat_id и message_id
+    chat = Chat(id=job.chat_id, type="private" if job.chat_id > 0 else "group")
+    return Message(message_id=job.message_id, date=datetime.now(tz=timezone.utc), chat=chat).as_(bot)
+
+
+# =========================
+# Job
+# =========================
+
+async def _report(bot: Bot, job: BulkJob, task: asyncio.Task):
+    """Одно сообщение с прогрессом, обновляется не чаще BULK_PROGRESS_INTERVAL."""
+    message = _job_message(bot, job)
+    while True:
+        await asyncio.wait({task}, timeout=BULK_PROGRESS_INTERVAL)
+        try:
+            await safe_edit_text(message, job_text(job), reply_markup=job_kb(job), parse_mode="HTML")
+        except Exception as e:
+            logger.warning(f"Bulk job {job.id} progress update failed: {e}")
+        if task.done():
+            break
+
+    if not task.cancelled() and task.exception() is not None:
+        logger.opt(exception=task.exception()).error(f"Bulk job {job.id} crashed")
+    if job.chunks:
+        # Индекс узнает о новых сроках/статусах сразу, а не через USER_INDEX_REFRESH
+        user_index.request_refresh()
+
+
+def launch(bot: Bot, job: BulkJob):
+    task = job_runner.start(job)
+    reporter = asyncio.create_task(_report(bot, job, task))
+    _reporters.add(reporter)
+    reporter.add_done_callback(_reporters.discard)
+
+
+async def restore_jobs(bot: Bot, owns: Callable[[int], bool] | None = None):
+    """При старте: незаконченные задачи получают кнопку «Продолжить» в своём сообщении."""
+    for job in job_runner.load(owns):
+        logger.info(f"Bulk job {job.id} restored: {job.status}, {len(job.pending())} chunks left")
+        try:
+            await safe_edit_text(_job_message(bot, job), job_text(job), reply_markup=job_kb(job), parse_mode="HTML")
+        except Exception as e:
+            logger.warning(f"Bulk job {job.id} message update failed: {e}")
+
+
+# =========================
+# Wizard
+# =========================
+
+async def bulk_action_start(call: CallbackQuery, state: FSMContext):
+    if not user_index.ready:
+        return call.answer(INDEX_LOADING_TEXT, show_alert=True)
+
+    async with state_tx(state) as tx:
+        # Цель — то, что сейчас отфильтровано в /users
+        browse = browse_state(tx.data)
+        filters = browse_filters(browse)
+        tx.clear()
+        tx.update(browse=browse, ba_filters=[filters.status, filters.tag, filters.squad])
+        tx.set_state(BulkActionFlow.action)
+
+    count = await user_index.count(filters)
+    await safe_edit_text(
+        call.message,
+        f"⚙️ Массовое действие\n\n🎯 Цель: {filters_text(filters)} — {count} польз.\n\nЧто делаем?",
+        reply_markup=bulk_action_kb(),
+        parse_mode="HTML",
+    )
+    return call.answer()
+
+
+async def bulk_action_pick(call: CallbackQuery, state: FSMContext):
+    action = call.data.split("_", 1)[1]
+    if action not in ACTIONS:
+        return call.answer("❌ Некорректное действие!", show_alert=True)
+
+    if action == "extend":
+        async with state_tx(state) as tx:
+            tx.update(ba_action=action)
+            tx.set_state(BulkActionFlow.days)
+        await safe_edit_text(call.message, "⏳ На сколько дней продлить? Выбери или пришли число:",
+                             reply_markup=bulk_days_kb())
+        return call.answer()
+
+    if action == "squads":
+        async with state_tx(state) as tx:
+            tx.update(ba_action=action, selected_internal=[])
+            tx.set_state(BulkActionFlow.squads)
+        catalog = squad_catalog.get()
+        await safe_edit_text(call.message, "👥 Какие внутренние сквады поставить всем (заменят текущие):",
+                             reply_markup=internal_squads_kb(catalog.internal, set(), catalog.version))
+        return call.answer()
+
+    await _confirm(call.message, state, action, {}, edit=True)
+    return call.answer()
+
+
+async def bulk_days_pick(call: CallbackQuery, state: FSMContext):
+    days = int(call.data.split("_", 1)[1])
+    await _confirm(call.message, state, "extend", {"days": days}, edit=True)
+    return call.answer()
+
+
+async def bulk_days_text(message: Message, state: FSMContext):
+    text = (message.text or "").strip()
+    if not text.isdigit() or not 1 <= int(text) <= MAX_EXTEND_DAYS:
+        return message.answer(f"❌ Нужно число дней от 1 до {MAX_EXTEND_DAYS}.", reply_markup=bulk_days_kb())
+    return await _confirm(message, state, "extend", {"days": int(text)}, edit=False)
+
+
+async def bulk_squad_toggle(call: CallbackQuery, state: FSMContext):
+    catalog = squad_catalog.get()
+    async with state_tx(state) as tx:
+        selected = set(tx.get("selected_internal", [])) & catalog.internal.keys()
+        if call.data == "int_reset":
+            selected = set()
+        else:
+            key = call.data.split("_", 1)[1]
+            if key in selected:
+                selected.remove(key)
+            elif key in catalog.internal:
+                selected.add(key)
+        if selected != set(tx.get("selected_internal", [])):
+            tx.update(selected_internal=list(selected))
+    kb = internal_squads_kb(catalog.internal, selected, catalog.version)
+    await safe_edit_text(call.message, "👥 Какие внутренние сквады поставить всем (заменят текущие):", reply_markup=kb)
+    return call.answer()
+
+
+async def bulk_squads_next(call: CallbackQuery, state: FSMContext):
+    catalog = squad_catalog.get()
+    async with state_tx(state) as tx:
+        selected = tx.get("selected_internal", [])
+    uuids = [catalog.internal[key][1] for key in selected if key in catalog.internal]
+    await _confirm(call.message, state, "squads", {"squads": uuids}, edit=True)
+    return call.answer()
+
+
+async def _confirm(message: Message, state: FSMContext, action: str, params: dict, edit: bool):
+    """Dry run: сколько пользователей попадёт под действие и кто они — до запуска."""
+    async with state_tx(state) as tx:
+        filters = UserFilter(*tx.get("ba_filters", [None, None, None]))
+        tx.update(ba_action=action, ba_params=params)
+        tx.set_state(BulkActionFlow.confirm)
+
+    count = await user_index.count(filters)
+    sample = await user_index.page(filters, None, SAMPLE_SIZE)
+    names = ", ".join(html.escape(user.username) for user in sample)
+    more = f" и ещё {count - len(sample)}" if count > len(sample) else ""
+    warning = ""
+    if action in NON_IDEMPOTENT:
+        warning = "\n\n⚠️ Если панель не ответит, такие пачки не повторяются — чтобы не продлить дважды."
+
+    text = (
+        f"⚙️ {html.escape(action_text(action, params))}\n"
+        f"🎯 Цель: {filters_text(filters)}\n\n"
+        f"Будет затронуто: {count}\n{names}{more}{warning}"
+    )
+    if count == 0:
+        text += "\n\nПод фильтр никто не попадает."
+    kb = bulk_action_confirm_kb(count)
+    if edit:
+        await safe_edit_text(message, text, reply_markup=kb, parse_mode="HTML")
+        return None
+    return message.answer(text, reply_markup=kb, parse_mode="HTML")
+
+
+async def bulk_action_run(call: CallbackQuery, state: FSMContext):
+    async with state_tx(state) as tx:
+        filters = UserFilter(*tx.get("ba_filters", [None, None, None]))
+        action, params = tx.get("ba_action"), tx.get("ba_params") or {}
+        browse = tx.get("browse")
+        tx.clear()
+        if browse:
+            tx.update(browse=browse)
+
+    if action not in ACTIONS:
+        return call.answer("❌ Нет данных, начни заново.", show_alert=True)
+
+    # Цель берём заново: за время подтверждения индекс мог обновиться
+    uuids = await user_index.uuids(filters)
+    if not uuids:
+        return call.answer("Под фильтр никто не попадает.", show_alert=True)
+
+    job = job_runner.create(action, params, uuids, call.message.chat.id, call.message.message_id)
+    logger.info(f"Bulk job {job.id}: {action} {params} for {len(uuids)} users")
+    await safe_edit_text(call.message, job_text(job), reply_markup=bulk_job_kb(job.id, True, False), parse_mode="HTML")
+    launch(call.bot, job)
+    return call.answer("🚀 Запущено")
+
+
+async def bulk_job_cancel(call: CallbackQuery, state: FSMContext):
+    job_id = call.data.split("_", 1)[1]
+    if not job_runner.cancel(job_id):
+        return call.answer("Задача уже не выполняется")
+    return call.answer("⏹ Останавливаю: пачки в полёте дойдут до конца")
+
+
+async def bulk_job_resume(call: CallbackQuery, state: FSMContext):
+    job = job_runner.jobs.get(call.data.split("_", 1)[1])
+    if job is None or not job.resumable or job_runner.is_running(job.id):
+        return call.answer("Продолжать нечего", show_alert=True)
+    launch(call.bot, job)
+    await safe_edit_text(call.message, job_text(job), reply_markup=bulk_job_kb(job.id, True, False), parse_mode="HTML")
+    return call.answer("🔁 Продолжаю")
@@ -0,0 +1,326 @@
+import asyncio
+import csv
+import io
+import json
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+from aiogram import Bot
+from aiogram.types import BufferedInputFile, CallbackQuery, Message
+from aiogram.fsm.context import FSMContext
+from pydantic import ValidationError
+from loguru import logger
+
+from config import BULK_CONCURRENCY, BULK_MAX_ROWS, BULK_MAX_FILE_SIZE, BULK_PROGRESS_INTERVAL
+from fsm_tx import state_tx
+from states import BulkCreateFlow
+from keyboards import bulk_upload_kb, bulk_confirm_kb, main_menu_kb
+from pipeline import run_bounded
+import remnawave_client as panel
+from remnawave_client import get_sdk
+from user_index import user_index
+from audit import audit_log, request_hash
+from utils import generate_shortid
+from .create_user import build_create_request, safe_edit_text
+
+# Колонки файла — те же поля, что заполняет пошаговый флоу
+FIELDS = {
+    "username",
+    "short_uuid",
+    "expire_at",
+    "expire_days",
+    "email",
+    "telegram_id",
+    "hwid_device_limit",
+    "tag",
+    "description",
+    "traffic_limit_bytes",
+    "traffic_limit_strategy",
+    "active_internal_squads",
+    "external_squad_uuid",
+}
+
+MAX_ERRORS_SHOWN = 15
+
+# Держим ссылки на фоновые задачи, чтобы их не собрал GC
+_running: set[asyncio.Task] = set()
+
+# Проверенный файл ждёт подтверждения: chat_id -> (message_id файла, строки).
+# До BULK_MAX_ROWS строк — не в FSM: иначе кэш storage держал бы их и переписывал при каждом сбросе.
+# В FSM — только message_id; апдейты чата под супервизором всегда попадают в один процесс
+_uploads: dict[int, tuple[int, list[dict]]] = {}
+
+
+# =========================
+# Parsing / validation
+# =========================
+
+def parse_rows(raw: bytes, filename: str) -> list[dict]:
+    text = raw.decode("utf-8-sig")
+
+    if filename.lower().endswith(".json"):
+        payload = json.loads(text)
+        if isinstance(payload, dict):
+            payload = payload.get("users")
+        if not isinstance(payload, list) or not all(isinstance(item, dict) for item in payload):
+            raise ValueError("JSON должен быть списком объектов (или {\"users\": [...]})")
+        return payload
+
+    # Разделитель определяем по заголовку: Excel часто сохраняет CSV через ";"
+    header = text.split("\n", 1)[0]
+    delimiter = max(",;\t", key=header.count)
+    return list(csv.DictReader(io.StringIO(text), delimiter=delimiter))
+
+
+def normalize_row(raw: dict) -> dict:
+    row = {}
+    for key, value in raw.items():
+        if key is None:
+            raise ValueError("лишние значения без заголовка колонки")
+        key = key.strip().lower()
+        if isinstance(value, str):
+            value = value.strip() or None
+        row[key] = value
+
+    unknown = set(row) - FIELDS
+    if unknown:
+        raise ValueError(f"неизвестные колонки: {', '.join(sorted(unknown))}")
+
+    row["username"] = row.get("username") or generate_shortid()
+    row["short_uuid"] = row.get("short_uuid") or generate_shortid()
+
+    squads = row.get("active_internal_squads")
+    if isinstance(squads, str):
+        row["active_internal_squads"] = [s for s in re.split(r"[;,\s]+", squads) if s]
+    elif squads is None:
+        row["active_internal_squads"] = []
+
+    days = row.pop("expire_days", None)
+    if row.get("expire_at") is None:
+        if days is None:
+            raise ValueError("нужен expire_at или expire_days")
+        expire_at = datetime.now(tz=timezone.utc) + timedelta(days=int(days))
+        row["expire_at"] = expire_at.isoformat()
+
+    return row
+
+
+def validate_rows(raw_rows: list[dict]) -> tuple[list[dict], list[str]]:
+    """Проверяет все строки заранее: ничего не создаём, пока файл не валиден целиком."""
+    rows, errors = [], []
+    seen = set()
+
+    for line, raw in enumerate(raw_rows, start=1):
+        try:
+            row = normalize_row(raw)
+            build_create_request(row)
+        except ValidationError as e:
+            err = e.errors()[0]
+            field = ".".join(str(part) for part in err["loc"])
+            errors.append(f"строка {line}: {field}: {err['msg']}")
+            continue
+        except Exception as e:
+            errors.append(f"строка {line}: {e}")
+            continue
+
+        if row["username"] in seen:
+            errors.append(f"строка {line}: username {row['username']} повторяется в файле")
+            continue
+        seen.add(row["username"])
+        rows.append(row)
+
+    return rows, errors
+
+
+def build_result_file(rows: list[dict], results: list) -> bytes:
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["username", "short_uuid", "uuid", "subscription_url", "error"])
+
+    for row, result in zip(rows, results):
+        if isinstance(result, BaseException):
+            writer.writerow([row["username"], row["short_uuid"], "", "", _error_text(result)])
+        else:
+            writer.writerow([result.username, result.short_uuid, result.uuid, result.subscription_url, ""])
+
+    return out.getvalue().encode("utf-8-sig")
+
+
+def _error_text(e: BaseException) -> str:
+    if isinstance(e, panel.ApiError):
+        return f"{e.error.code}: {e.error.message}"
+    return str(e)
+
+
+# =========================
+# Handlers
+# =========================
+
+async def bulk_start(call: CallbackQuery, state: FSMContext):
+    _uploads.pop(call.message.chat.id, None)
+    async with state_tx(state) as tx:
+        tx.clear()
+        tx.set_state(BulkCreateFlow.upload)
+    await safe_edit_text(
+        call.message,
+        "📥 Пришли CSV или JSON файл с пользователями.\n\n"
+        "Колонки: username, short_uuid, expire_at или expire_days, email, telegram_id, "
+        "hwid_device_limit, tag, description, traffic_limit_bytes, traffic_limit_strategy, "
+        "active_internal_squads (UUID через ;), external_squad_uuid.\n\n"
+        "Обязателен только срок — username сгенерируется, если пусто.",
+        reply_markup=bulk_upload_kb()
+    )
+    return call.answer()
+
+
+async def bulk_file(message: Message, state: FSMContext, bot: Bot):
+    document = message.document
+    filename = document.file_name or ""
+    if not filename.lower().endswith((".csv", ".json")):
+        return message.answer("❌ Нужен файл .csv или .json.")
+    if document.file_size and document.file_size > BULK_MAX_FILE_SIZE:
+        return message.answer(f"❌ Файл больше {BULK_MAX_FILE_SIZE // 1024} KB.")
+
+    raw = (await bot.download(document)).getvalue()
+
+    try:
+        raw_rows = await asyncio.to_thread(parse_rows, raw, filename)
+    except Exception as e:
+        return message.answer(f"❌ Не удалось прочитать файл:\n\n{e}")
+
+    if not raw_rows:
+        return message.answer("❌ В файле нет строк.")
+    if len(raw_rows) > BULK_MAX_ROWS:
+        return message.answer(f"❌ Слишком много строк: {len(raw_rows)} (максимум {BULK_MAX_ROWS}).")
+
+    rows, errors = await asyncio.to_thread(validate_rows, raw_rows)
+    # Занятые в панели username/short_uuid — сразу, а не ошибками посреди создания
+    taken = await user_index.taken([value for row in rows for value in (row["username"], row["short_uuid"])])
+    for row in rows:
+        for field in ("username", "short_uuid"):
+            if row[field] in taken:
+                errors.append(f"{field} {row[field]} уже есть в панели")
+    if errors:
+        shown = "\n".join(errors[:MAX_ERRORS_SHOWN])
+        more = f"\n… и ещё {len(errors) - MAX_ERRORS_SHOWN}" if len(errors) > MAX_ERRORS_SHOWN else ""
+        return message.answer(
+            f"❌ Ошибок в файле: {len(errors)}. Исправь и пришли заново:\n\n{shown}{more}",
+            reply_markup=bulk_upload_kb()
+        )
+
+    _uploads[message.chat.id] = (message.message_id, rows)
+    async with state_tx(state) as tx:
+        tx.update(bulk_upload=message.message_id)
+        tx.set_state(BulkCreateFlow.confirm)
+    return message.answer(f"✅ Файл проверен: {len(rows)} пользователей.\n\nЗапускаем?",
+                          reply_markup=bulk_confirm_kb(len(rows)))
+
+
+async def bulk_run(call: CallbackQuery, state: FSMContext):
+    async with state_tx(state) as tx:
+        upload = tx.get("bulk_upload")
+        tx.clear()
+    # Файла нет, если процесс перезапускался, или он не тот, что подтверждали
+    upload_id, rows = _uploads.pop(call.message.chat.id, (None, []))
+    if upload_id != upload:
+        rows = []
+
+    if not rows:
+        return call.answer("❌ Нет данных, загрузи файл заново.", show_alert=True)
+
+    await safe_edit_text(call.message, f"⏳ Создаю пользователей: 0/{len(rows)}")
+    await call.answer()
+    start_bulk(call.bot, call.message, rows, call.from_user.id)
+
+
+def start_bulk(bot: Bot, message: Message, rows: list[dict], admin_id: int, source: str = "bulk"):
+    """Создание строк rows в фоне; прогресс и итог — в message. source — пометка в аудите."""
+    # Долгую работу уводим в фон, чтобы не держать обработку апдейта
+    task = asyncio.create_task(_run_bulk(bot, message, rows, admin_id, source))
+    _running.add(task)
+    task.add_done_callback(_running.discard)
+
+
+# =========================
+# Pipeline
+# =========================
+
+async def _report_progress(message: Message, stats: dict, total: int, stop: asyncio.Event):
+    """Одно сообщение с прогрессом, обновляется не чаще BULK_PROGRESS_INTERVAL."""
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=BULK_PROGRESS_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        if stop.is_set():
+            return
+        try:
+            await safe_edit_text(
+                message,
+                f"⏳ Создаю пользователей: {stats['ok'] + stats['failed']}/{total}\n"
+                f"✅ {stats['ok']}  ❌ {stats['failed']}"
+            )
+        except Exception as e:
+            logger.warning(f"Bulk progress update failed: {e}")
+
+
+def _audit_row(admin_id: int, source: str, body, started: float, **fields):
+    audit_log.record(
+        "user_create",
+        admin_id=admin_id,
+        request_hash=request_hash(body),
+        latency_ms=round((time.monotonic() - started) * 1000),
+        source=source,
+        **fields,
+    )
+
+
+async def _run_bulk(bot: Bot, message: Message, rows: list[dict], admin_id: int, source: str):
+    sdk = get_sdk()
+    stats = {"ok": 0, "failed": 0}
+    started = time.monotonic()
+
+    async def create(row: dict):
+        body = build_create_request(row)
+        row_started = time.monotonic()
+        try:
+            user = await sdk.users.create_user(body=body)
+        except Exception as e:
+            _audit_row(admin_id, source, body, row_started, username=row["username"], error=_error_text(e))
+            raise
+        _audit_row(admin_id, source, body, row_started, uuid=str(user.uuid), username=user.username)
+        return user
+
+    def on_done(row: dict, result):
+        stats["failed" if isinstance(result, BaseException) else "ok"] += 1
+
+    stop = asyncio.Event()
+    reporter = asyncio.create_task(_report_progress(message, stats, len(rows), stop))
+    try:
+        results = await run_bounded(rows, create, BULK_CONCURRENCY, on_done)
+    except Exception as e:
+        logger.exception("Bulk create crashed")
+        await safe_edit_text(message, f"❌ Ошибка:\n\n{e}", reply_markup=main_menu_kb())
+        return
+    finally:
+        stop.set()
+        await reporter
+
+    elapsed = time.monotonic() - started
+    logger.info(f"Bulk create ({source}) finished: {stats['ok']} ok, {stats['failed']} failed in {elapsed:.1f}s")
+
+    created = [result for result in results if not isinstance(result, BaseException)]
+    try:
+        await user_index.upsert(created)
+    except Exception as e:
+        logger.warning(f"User index upsert failed: {e}")
+
+    await safe_edit_text(
+        message,
+        f"🏁 Готово за {elapsed:.0f} сек.\n\n✅ Создано: {stats['ok']}\n❌ Ошибок: {stats['failed']}",
+        reply_markup=main_menu_kb()
+    )
+    result_file = await asyncio.to_thread(build_result_file, rows, results)
+    filename = f"bulk_result_{datetime.now(tz=timezone.utc):%Y%m%d_%H%M%S}.csv"
+    await bot.send_document(message.chat.id, BufferedInputFile(result_file, filename=filename))
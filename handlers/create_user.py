@@ -1,15 +1,16 @@
-from datetime import datetime, timedelta
-import pytz
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+import httpx
 
 from aiogram.types import CallbackQuery, Message, InlineKeyboardMarkup
 from aiogram.fsm.context import FSMContext
 
-from remnawave.models import CreateUserRequestDto
-from remnawave.enums import TrafficLimitStrategy
-from remnawave.exceptions import ApiError
 from aiogram.utils.markdown import hcode, hbold
 from loguru import logger
 
+from config import RENDER_CACHE_SIZE
+from fsm_tx import state_tx
 from states import CreateUserFlow
 from keyboards import (
     username_kb,
@@ -20,25 +21,19 @@ from keyboards import (
     internal_squads_kb,
     external_squad_kb,
     confirm_kb,
+    confirm_retry_kb,
+    processing_kb,
     main_menu_kb
 )
-from utils import generate_shortid, format_datetime, bytes_to_gb
+from utils import generate_shortid, format_datetime, bytes_to_gb, LRUCache
+import remnawave_client as panel
 from remnawave_client import get_sdk
-
-# =========================
-# Сквады
-# =========================
-
-INTERNAL_SQUADS = {
-    "promo1": ("ПРОМО-1", "6ee7a7cd-cfe0-49f1-9e6d-898ad2c61cb2"),
-    "promo2": ("ПРОМО-2", "28c99966-6bd1-4eed-97c1-a230f31b015b"),
-}
-INTERNAL_SQUADS["default"] = ("СВОИ", "ec4dc856-dc75-474f-b2cb-e0e95fc76626")
-
-EXTERNAL_SQUADS = {
-    "both": ("Both", "77357f14-dd4e-4921-95e4-708fb56eaa02"),
-}
-EXTERNAL_SQUADS["whitelist"] = ("Whitelist", "3ed64469-d522-4ae2-87d6-4e0a562f357c")
+from resilience import PanelUnavailable
+from squads import squad_catalog
+from user_index import user_index
+from id_pool import id_pool
+from audit import audit_log, request_hash
+from pipeline import SingleFlight
 
 # =========================
 # Helpers
@@ -67,8 +62,66 @@ def summary_text(data: dict) -> str:
     )
 
 
-async def safe_edit_text(message, text: str, reply_markup: InlineKeyboardMarkup = None, **kwargs):
-    """Безопасный edit_text — игнорирует ошибку 'message is not modified'."""
+# Подсказка на экране подтверждения: поля меняются сообщением, без повторного прохода по шагам
+OVERRIDES_HINT = "✍️ Поменять поля — пришли key=value, по строке на поле (например days=30, tag=VIP, count=5)."
+
+
+def confirm_text(data: dict) -> str:
+    """Экран подтверждения: сводка, пресет и количество, если создаём по пресету."""
+    lines = []
+    if data.get("preset"):
+        lines.append(f"⚡ Пресет: {data['preset']}")
+    count = data.get("count", 1)
+    if count > 1:
+        username = data.get("username")
+        lines.append(f"🔢 Создать: {count} ({username}_1 … {username}_{count})")
+    extra = "\n" + "\n".join(lines) + "\n" if lines else ""
+    return f"{summary_text(data)}{extra}\n{OVERRIDES_HINT}"
+
+
+def build_create_request(data: dict) -> "panel.CreateUserRequestDto":
+    """Собирает запрос на создание из данных флоу (или строки массовой загрузки)."""
+    return panel.CreateUserRequestDto(
+        username=data["username"],
+        expire_at=data["expire_at"],
+        email=data.get("email"),
+        telegram_id=data.get("telegram_id"),
+        hwid_device_limit=data.get("hwid_device_limit", 2),
+        tag=data.get("tag"),
+        description=data.get("description"),
+        traffic_limit_bytes=data.get("traffic_limit_bytes"),
+        traffic_limit_strategy=data.get("traffic_limit_strategy") or panel.TrafficLimitStrategy.MONTH,
+        active_internal_squads=data.get("active_internal_squads", []),
+        external_squad_uuid=data.get("external_squad_uuid"),
+        short_uuid=data.get("short_uuid") or generate_shortid()
+    )
+
+
+# Идущие запросы на создание: short_uuid флоу -> задача create_user. Удачный результат
+# держим ещё CREATE_LINGER секунд: запоздавшее второе нажатие получит его, а не ошибку панели
+CREATE_LINGER = 30
+_creating = SingleFlight(linger=CREATE_LINGER)
+
+# Что сейчас показано в сообщении: (chat_id, message_id) -> отпечаток текста и клавиатуры
+_rendered = LRUCache(RENDER_CACHE_SIZE)
+# Сообщения, которые прямо сейчас редактируются -> последняя правка, пришедшая за это время
+_editing: dict[tuple[int, int], tuple | None] = {}
+
+
+def _markup_digest(reply_markup: InlineKeyboardMarkup | None):
+    if reply_markup is None:
+        return None
+    return tuple(
+        tuple((button.text, button.callback_data, button.url) for button in row)
+        for row in reply_markup.inline_keyboard
+    )
+
+
+def _render_digest(text: str, reply_markup: InlineKeyboardMarkup | None, kwargs: dict) -> int:
+    return hash((text, _markup_digest(reply_markup), tuple(sorted(kwargs.items()))))
+
+
+async def _edit_text(message, text: str, reply_markup: InlineKeyboardMarkup | None, kwargs: dict):
     try:
         await message.edit_text(text=text, reply_markup=reply_markup, **kwargs)
     except Exception as e:
@@ -78,10 +131,54 @@ async def safe_edit_text(message, text: str, reply_markup: InlineKeyboardMarkup
             raise
 
 
+async def safe_edit_text(message, text: str, reply_markup: InlineKeyboardMarkup = None, **kwargs):
+    """
+    Безопасный edit_text — игнорирует ошибку 'message is not modified'.
+
+    Если в сообщении уже показан тот же текст с той же клавиатурой, запрос в Telegram
+    не отправляется вовсе. Пока одна правка сообщения в полёте, новые не шлются
+    параллельно: запоминается только последняя, и она уходит следующей.
+    """
+    key = (message.chat.id, message.message_id)
+    digest = _render_digest(text, reply_markup, kwargs)
+    if key in _editing:
+        # Даже если совпадает с показанным: правка в полёте его заменит, так что и это
+        # запоминаем — цикл ниже сравнит с тем, что окажется на экране после неё
+        _editing[key] = (text, reply_markup, kwargs, digest)
+        return
+    if _rendered.get(key) == digest:
+        return
+
+    _editing[key] = None
+    try:
+        while True:
+            try:
+                await _edit_text(message, text, reply_markup, kwargs)
+            except Exception:
+                _rendered.pop(key)
+                raise
+            _rendered.set(key, digest)
+
+            pending = _editing[key]
+            if pending is None:
+                break
+            _editing[key] = None
+            text, reply_markup, kwargs, digest = pending
+            if _rendered.get(key) == digest:
+                break
+    finally:
+        _editing.pop(key, None)
+
+
 async def cancel_flow(state: FSMContext, call: CallbackQuery):
-    await state.clear()
+    async with state_tx(state) as tx:
+        tx.clear()
     await safe_edit_text(call.message, "❌ Отменено.", reply_markup=main_menu_kb())
-    await call.answer()
+    return call.answer()
+
+
+async def cancel_handler(call: CallbackQuery, state: FSMContext):
+    return await cancel_flow(state, call)
 
 
 # =========================
@@ -89,10 +186,11 @@ async def cancel_flow(state: FSMContext, call: CallbackQuery):
 # =========================
 
 async def start_create(call: CallbackQuery, state: FSMContext):
-    await state.clear()
-    await state.set_state(CreateUserFlow.username)
+    async with state_tx(state) as tx:
+        tx.clear()
+        tx.set_state(CreateUserFlow.username)
     await safe_edit_text(call.message, "Выбери username:", reply_markup=username_kb())
-    await call.answer()
+    return call.answer()
 
 
 # =========================
@@ -100,12 +198,12 @@ async def start_create(call: CallbackQuery, state: FSMContext):
 # =========================
 
 async def username_generate(call: CallbackQuery, state: FSMContext):
-    username = generate_shortid()
-    short_uuid = generate_shortid()
+    username = id_pool.take()
+    short_uuid = id_pool.take()
 
-    await state.update_data(username=username, short_uuid=short_uuid)
-    await state.set_state(CreateUserFlow.expire_select)
-    await state.update_data(expire_months=0, expire_days=0)
+    async with state_tx(state) as tx:
+        tx.update(username=username, short_uuid=short_uuid, expire_months=0, expire_days=0)
+        tx.set_state(CreateUserFlow.expire_select)
 
     await safe_edit_text(
         call.message,
@@ -113,27 +211,29 @@ async def username_generate(call: CallbackQuery, state: FSMContext):
         reply_markup=expire_kb(),
         parse_mode="Markdown"
     )
-    await call.answer()
+    return call.answer()
 
 
 async def username_manual(call: CallbackQuery, state: FSMContext):
     await safe_edit_text(call.message, "✍️ Введи username вручную (3-36 символов, буквы/цифры/_):",
                          reply_markup=skip_input_kb())
-    await call.answer()
+    return call.answer()
 
 
 async def username_text(message: Message, state: FSMContext):
     username = message.text.strip()
     if len(username) < 3 or len(username) > 36:
-        await message.answer("❌ Username должен быть от 3 до 36 символов.")
-        return
+        return message.answer("❌ Username должен быть от 3 до 36 символов.")
+    # Занятый username панель отклонила бы только на подтверждении, после всех шагов
+    if await user_index.taken([username]):
+        return message.answer("❌ Такой username уже есть в панели, введи другой.")
 
-    short_uuid = generate_shortid()
-    await state.update_data(username=username, short_uuid=short_uuid)
-    await state.set_state(CreateUserFlow.expire_select)
-    await state.update_data(expire_months=0, expire_days=0)
+    short_uuid = id_pool.take()
+    async with state_tx(state) as tx:
+        tx.update(username=username, short_uuid=short_uuid, expire_months=0, expire_days=0)
+        tx.set_state(CreateUserFlow.expire_select)
 
-    await message.answer(
+    return message.answer(
         f"✅ Username установлен: `{username}`\n\nВыбери срок подписки:",
         reply_markup=expire_kb(),
         parse_mode="Markdown"
@@ -145,18 +245,20 @@ async def username_text(message: Message, state: FSMContext):
 # =========================
 
 async def expire_buttons(call: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    months = data.get("expire_months", 0)
-    days = data.get("expire_days", 0)
-
-    if call.data == "exp_reset":
-        months, days = 0, 0
-    elif call.data == "exp_1": months, days = 1, 0
-    elif call.data == "exp_3": months, days = 3, 0
-    elif call.data == "exp_6": months, days = 6, 0
-    elif call.data == "exp_12": months, days = 12, 0
-
-    await state.update_data(expire_months=months, expire_days=days)
+    async with state_tx(state) as tx:
+        months = tx.get("expire_months", 0)
+        days = tx.get("expire_days", 0)
+
+        if call.data == "exp_reset":
+            months, days = 0, 0
+        elif call.data == "exp_1": months, days = 1, 0
+        elif call.data == "exp_3": months, days = 3, 0
+        elif call.data == "exp_6": months, days = 6, 0
+        elif call.data == "exp_12": months, days = 12, 0
+
+        # Повторное нажатие той же кнопки ничего не меняет — и писать нечего
+        if (months, days) != (tx.get("expire_months", 0), tx.get("expire_days", 0)):
+            tx.update(expire_months=months, expire_days=days)
     selected_str = f"{months} месяцев" if months else (f"{days} дней" if days else "НЕ ВЫБРАНО")
 
     await safe_edit_text(
@@ -165,13 +267,13 @@ async def expire_buttons(call: CallbackQuery, state: FSMContext):
         reply_markup=expire_kb(),
         parse_mode="Markdown"
     )
-    await call.answer()
+    return call.answer()
 
 
 async def expire_manual(call: CallbackQuery, state: FSMContext):
     await state.set_state(CreateUserFlow.expire_manual_days)
     await safe_edit_text(call.message, "✍️ Введи срок в днях (например 45):", reply_markup=skip_input_kb())
-    await call.answer()
+    return call.answer()
 
 
 async def expire_manual_text(message: Message, state: FSMContext):
@@ -180,28 +282,27 @@ async def expire_manual_text(message: Message, state: FSMContext):
         if days <= 0 or days > 3650:
             raise Exception()
     except:
-        await message.answer("❌ Введи число дней (1 - 3650).")
-        return
+        return message.answer("❌ Введи число дней (1 - 3650).")
 
-    await state.update_data(expire_days=days, expire_months=0)
-    await state.set_state(CreateUserFlow.expire_select)
-    await message.answer(f"✅ Срок установлен: {days} дней\n\nТеперь нажми ➡️ Продолжить или измени выбор:",
-                         reply_markup=expire_kb())
+    async with state_tx(state) as tx:
+        tx.update(expire_days=days, expire_months=0)
+        tx.set_state(CreateUserFlow.expire_select)
+    return message.answer(f"✅ Срок установлен: {days} дней\n\nТеперь нажми ➡️ Продолжить или измени выбор:",
+                          reply_markup=expire_kb())
 
 
 async def expire_next(call: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    months, days = data.get("expire_months", 0), data.get("expire_days", 0)
+    async with state_tx(state) as tx:
+        months, days = tx.get("expire_months", 0), tx.get("expire_days", 0)
 
-    if months <= 0 and days <= 0:
-        await call.answer("❌ Сначала выбери срок!", show_alert=True)
-        return
+        if months <= 0 and days <= 0:
+            return call.answer("❌ Сначала выбери срок!", show_alert=True)
 
-    expire_at = datetime.now(tz=pytz.UTC) + timedelta(days=30*months + days)
-    await state.update_data(expire_at=expire_at)
-    await state.set_state(CreateUserFlow.email)
+        expire_at = datetime.now(tz=timezone.utc) + timedelta(days=30*months + days)
+        tx.update(expire_at=expire_at)
+        tx.set_state(CreateUserFlow.email)
     await safe_edit_text(call.message, "📧 Введи Email (или пропусти):", reply_markup=skip_input_kb())
-    await call.answer()
+    return call.answer()
 
 
 # =========================
@@ -209,43 +310,47 @@ async def expire_next(call: CallbackQuery, state: FSMContext):
 # =========================
 
 async def skip_handler(call: CallbackQuery, state: FSMContext):
-    current = await state.get_state()
-
-    if current == CreateUserFlow.email.state:
-        await state.update_data(email=None)
-        await state.set_state(CreateUserFlow.telegram_id)
-        await safe_edit_text(call.message, "📱 Введи Telegram ID (или пропусти):", reply_markup=skip_input_kb())
-
-    elif current == CreateUserFlow.telegram_id.state:
-        await state.update_data(telegram_id=None)
-        await state.set_state(CreateUserFlow.hwid_limit)
-        await safe_edit_text(call.message, "📲 Введи HWID лимит (по умолчанию 2) или пропусти:", reply_markup=skip_input_kb())
-
-    elif current == CreateUserFlow.hwid_limit.state:
-        await state.update_data(hwid_device_limit=2)
-        await state.set_state(CreateUserFlow.tag)
-        await safe_edit_text(call.message, "📌 Введи TAG (или пропусти):", reply_markup=skip_input_kb())
+    async with state_tx(state) as tx:
+        current = tx.state
+
+        if current == CreateUserFlow.email.state:
+            tx.update(email=None)
+            tx.set_state(CreateUserFlow.telegram_id)
+            text, kb = "📱 Введи Telegram ID (или пропусти):", skip_input_kb()
+
+        elif current == CreateUserFlow.telegram_id.state:
+            tx.update(telegram_id=None)
+            tx.set_state(CreateUserFlow.hwid_limit)
+            text, kb = "📲 Введи HWID лимит (по умолчанию 2) или пропусти:", skip_input_kb()
+
+        elif current == CreateUserFlow.hwid_limit.state:
+            tx.update(hwid_device_limit=2)
+            tx.set_state(CreateUserFlow.tag)
+            text, kb = "📌 Введи TAG (или пропусти):", skip_input_kb()
+
+        elif current == CreateUserFlow.tag.state:
+            tx.update(tag=None)
+            tx.set_state(CreateUserFlow.description)
+            text, kb = "📝 Введи описание (или пропусти):", skip_input_kb()
+
+        elif current == CreateUserFlow.description.state:
+            tx.update(description=None, traffic_limit_bytes=None)
+            tx.set_state(CreateUserFlow.traffic_select)
+            text, kb = "📦 Выбери лимит трафика:", traffic_kb()
+
+        elif current == CreateUserFlow.expire_manual_days.state:
+            tx.set_state(CreateUserFlow.expire_select)
+            text, kb = "⏳ Выбери срок подписки:", expire_kb()
+
+        elif current == CreateUserFlow.traffic_manual_gb.state:
+            tx.set_state(CreateUserFlow.traffic_select)
+            text, kb = "📦 Выбери лимит трафика:", traffic_kb()
 
-    elif current == CreateUserFlow.tag.state:
-        await state.update_data(tag=None)
-        await state.set_state(CreateUserFlow.description)
-        await safe_edit_text(call.message, "📝 Введи описание (или пропусти):", reply_markup=skip_input_kb())
-
-    elif current == CreateUserFlow.description.state:
-        await state.update_data(description=None)
-        await state.set_state(CreateUserFlow.traffic_select)
-        await state.update_data(traffic_limit_bytes=None)
-        await safe_edit_text(call.message, "📦 Выбери лимит трафика:", reply_markup=traffic_kb())
-
-    elif current == CreateUserFlow.expire_manual_days.state:
-        await state.set_state(CreateUserFlow.expire_select)
-        await safe_edit_text(call.message, "⏳ Выбери срок подписки:", reply_markup=expire_kb())
-
-    elif current == CreateUserFlow.traffic_manual_gb.state:
-        await state.set_state(CreateUserFlow.traffic_select)
-        await safe_edit_text(call.message, "📦 Выбери лимит трафика:", reply_markup=traffic_kb())
+        else:
+            return call.answer()
 
-    await call.answer()
+    await safe_edit_text(call.message, text, reply_markup=kb)
+    return call.answer()
 
 
 # =========================
@@ -253,21 +358,22 @@ async def skip_handler(call: CallbackQuery, state: FSMContext):
 # =========================
 
 async def email_text(message: Message, state: FSMContext):
-    await state.update_data(email=message.text.strip())
-    await state.set_state(CreateUserFlow.telegram_id)
-    await message.answer("📱 Введи Telegram ID (или пропусти):", reply_markup=skip_input_kb())
+    async with state_tx(state) as tx:
+        tx.update(email=message.text.strip())
+        tx.set_state(CreateUserFlow.telegram_id)
+    return message.answer("📱 Введи Telegram ID (или пропусти):", reply_markup=skip_input_kb())
 
 
 async def telegram_text(message: Message, state: FSMContext):
     try:
         tg_id = int(message.text.strip())
     except:
-        await message.answer("❌ Telegram ID должен быть числом.")
-        return
+        return message.answer("❌ Telegram ID должен быть числом.")
 
-    await state.update_data(telegram_id=tg_id)
-    await state.set_state(CreateUserFlow.hwid_limit)
-    await message.answer("📲 Введи HWID лимит (по умолчанию 2) или пропусти:", reply_markup=skip_input_kb())
+    async with state_tx(state) as tx:
+        tx.update(telegram_id=tg_id)
+        tx.set_state(CreateUserFlow.hwid_limit)
+    return message.answer("📲 Введи HWID лимит (по умолчанию 2) или пропусти:", reply_markup=skip_input_kb())
 
 
 async def hwid_text(message: Message, state: FSMContext):
@@ -276,25 +382,26 @@ async def hwid_text(message: Message, state: FSMContext):
         if hwid < 0 or hwid > 100:
             raise Exception()
     except:
-        await message.answer("❌ HWID должен быть числом (0-100).")
-        return
+        return message.answer("❌ HWID должен быть числом (0-100).")
 
-    await state.update_data(hwid_device_limit=hwid)
-    await state.set_state(CreateUserFlow.tag)
-    await message.answer("📌 Введи TAG (или пропусти):", reply_markup=skip_input_kb())
+    async with state_tx(state) as tx:
+        tx.update(hwid_device_limit=hwid)
+        tx.set_state(CreateUserFlow.tag)
+    return message.answer("📌 Введи TAG (или пропусти):", reply_markup=skip_input_kb())
 
 
 async def tag_text(message: Message, state: FSMContext):
-    await state.update_data(tag=message.text.strip())
-    await state.set_state(CreateUserFlow.description)
-    await message.answer("📝 Введи описание (или пропусти):", reply_markup=skip_input_kb())
+    async with state_tx(state) as tx:
+        tx.update(tag=message.text.strip())
+        tx.set_state(CreateUserFlow.description)
+    return message.answer("📝 Введи описание (или пропусти):", reply_markup=skip_input_kb())
 
 
 async def description_text(message: Message, state: FSMContext):
-    await state.update_data(description=message.text.strip())
-    await state.set_state(CreateUserFlow.traffic_select)
-    await state.update_data(traffic_limit_bytes=None)
-    await message.answer("📦 Выбери лимит трафика:", reply_markup=traffic_kb())
+    async with state_tx(state) as tx:
+        tx.update(description=message.text.strip(), traffic_limit_bytes=None)
+        tx.set_state(CreateUserFlow.traffic_select)
+    return message.answer("📦 Выбери лимит трафика:", reply_markup=traffic_kb())
 
 
 # =========================
@@ -304,36 +411,34 @@ async def description_text(message: Message, state: FSMContext):
 async def traffic_buttons(call: CallbackQuery, state: FSMContext):
     data = call.data
 
-    if data == "tr_reset":
-        await state.update_data(traffic_limit_bytes=None)
+    async with state_tx(state) as tx:
+        if data == "tr_reset":
+            traffic = None
 
-    elif data == "tr_unlim":
-        await state.update_data(traffic_limit_bytes=0)
+        elif data == "tr_unlim":
+            traffic = 0
 
-    elif data.startswith("tr_") and data.split("_")[1].isdigit():
-        gb = int(data.split("_")[1])
-        await state.update_data(traffic_limit_bytes=gb * 1024**3)
+        elif data.startswith("tr_") and data.split("_")[1].isdigit():
+            gb = int(data.split("_")[1])
+            traffic = gb * 1024**3
 
-    elif data == "tr_next":
-        current_data = await state.get_data()
-        traffic = current_data.get("traffic_limit_bytes")
-        if traffic is None:
-            await call.answer("❌ Сначала выбери трафик!", show_alert=True)
-            return
-        await state.set_state(CreateUserFlow.traffic_strategy)
-        await safe_edit_text(call.message, "🔄 Выбери стратегию сброса трафика (или пропусти):",
-                             reply_markup=traffic_strategy_kb())
-        await call.answer()
-        return
-    else:
-        await call.answer()
-        return
+        elif data == "tr_next":
+            if tx.get("traffic_limit_bytes") is None:
+                return call.answer("❌ Сначала выбери трафик!", show_alert=True)
+            tx.set_state(CreateUserFlow.traffic_strategy)
+            await safe_edit_text(call.message, "🔄 Выбери стратегию сброса трафика (или пропусти):",
+                                 reply_markup=traffic_strategy_kb())
+            return call.answer()
+        else:
+            return call.answer()
+
+        if "traffic_limit_bytes" not in tx.data or tx.get("traffic_limit_bytes") != traffic:
+            tx.update(traffic_limit_bytes=traffic)
 
-    current_data = await state.get_data()
-    traffic_str = bytes_to_gb(current_data.get("traffic_limit_bytes"))
+    traffic_str = bytes_to_gb(traffic)
     await safe_edit_text(call.message, f"📦 Трафик выбран: *{traffic_str}*\n\nМожно менять сколько угодно:",
                          reply_markup=traffic_kb(), parse_mode="Markdown")
-    await call.answer()
+    return call.answer()
 
 
 async def traffic_manual(call: CallbackQuery, state: FSMContext):
@@ -341,7 +446,7 @@ async def traffic_manual(call: CallbackQuery, state: FSMContext):
     await safe_edit_text(call.message,
                          "✍️ Введи лимит трафика в GB (например 37)\nЕсли хочешь безлимит — нажми ♾ Безлимит.",
                          reply_markup=skip_input_kb())
-    await call.answer()
+    return call.answer()
 
 
 async def traffic_manual_text(message: Message, state: FSMContext):
@@ -350,25 +455,23 @@ async def traffic_manual_text(message: Message, state: FSMContext):
         if gb < 1 or gb > 100000:
             raise Exception()
     except:
-        await message.answer("❌ Введи число GB (1 - 100000).")
-        return
+        return message.answer("❌ Введи число GB (1 - 100000).")
 
-    await state.update_data(traffic_limit_bytes=gb * 1024**3)
-    await state.set_state(CreateUserFlow.traffic_select)
-    await message.answer(f"✅ Трафик установлен: {gb} GB\n\nТеперь нажми ➡️ Продолжить или измени выбор:",
-                         reply_markup=traffic_kb())
+    async with state_tx(state) as tx:
+        tx.update(traffic_limit_bytes=gb * 1024**3)
+        tx.set_state(CreateUserFlow.traffic_select)
+    return message.answer(f"✅ Трафик установлен: {gb} GB\n\nТеперь нажми ➡️ Продолжить или измени выбор:",
+                          reply_markup=traffic_kb())
 
 
 async def traffic_next(call: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    traffic = data.get("traffic_limit_bytes")
-    if traffic is None:
-        await call.answer("❌ Сначала выбери трафик!", show_alert=True)
-        return
-    await state.set_state(CreateUserFlow.traffic_strategy)
+    async with state_tx(state) as tx:
+        if tx.get("traffic_limit_bytes") is None:
+            return call.answer("❌ Сначала выбери трафик!", show_alert=True)
+        tx.set_state(CreateUserFlow.traffic_strategy)
     await safe_edit_text(call.message, "🔄 Выбери стратегию сброса трафика (или пропусти):",
                          reply_markup=traffic_strategy_kb())
-    await call.answer()
+    return call.answer()
 
 
 # =========================
@@ -377,22 +480,23 @@ async def traffic_next(call: CallbackQuery, state: FSMContext):
 
 async def strategy_handler(call: CallbackQuery, state: FSMContext):
     if call.data == "str_skip":
-        strategy = TrafficLimitStrategy.MONTH
+        strategy = panel.TrafficLimitStrategy.MONTH
     else:
         strategy_name = call.data.split("_", 1)[1]
-        if not hasattr(TrafficLimitStrategy, strategy_name):
-            await call.answer("❌ Некорректная стратегия!", show_alert=True)
-            return
-        strategy = getattr(TrafficLimitStrategy, strategy_name)
+        if not hasattr(panel.TrafficLimitStrategy, strategy_name):
+            return call.answer("❌ Некорректная стратегия!", show_alert=True)
+        strategy = getattr(panel.TrafficLimitStrategy, strategy_name)
 
-    await state.update_data(traffic_limit_strategy=strategy)
-    await state.set_state(CreateUserFlow.internal_squads)
-    await state.update_data(selected_internal=[])
+    async with state_tx(state) as tx:
+        tx.update(traffic_limit_strategy=strategy, selected_internal=[])
+        tx.set_state(CreateUserFlow.internal_squads)
 
+    # Каталог берём из кэша: если он устарел, обновится в фоне, а не здесь
+    catalog = squad_catalog.get()
     text = "👥 Выбери внутренние сквады (можно несколько):"
-    kb = internal_squads_kb(INTERNAL_SQUADS, set())
+    kb = internal_squads_kb(catalog.internal, set(), catalog.version)
     await safe_edit_text(call.message, text=text, reply_markup=kb)
-    await call.answer()
+    return call.answer()
 
 
 # =========================
@@ -400,33 +504,38 @@ async def strategy_handler(call: CallbackQuery, state: FSMContext):
 # =========================
 
 async def internal_squad_handler(call: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    selected = set(data.get("selected_internal", []))
-
-    if call.data == "int_reset":
-        selected = set()
-    elif call.data.startswith("int_"):
-        key = call.data.split("_", 1)[1]
-        if key in selected:
-            selected.remove(key)
-        else:
-            selected.add(key)
-
-    await state.update_data(selected_internal=list(selected))
-    kb = internal_squads_kb(INTERNAL_SQUADS, selected)
+    catalog = squad_catalog.get()
+    async with state_tx(state) as tx:
+        # Сквады, пропавшие из каталога после обновления, из выбора выкидываем
+        selected = set(tx.get("selected_internal", [])) & catalog.internal.keys()
+
+        if call.data == "int_reset":
+            selected = set()
+        elif call.data.startswith("int_"):
+            key = call.data.split("_", 1)[1]
+            if key in selected:
+                selected.remove(key)
+            elif key in catalog.internal:
+                selected.add(key)
+
+        if selected != set(tx.get("selected_internal", [])):
+            tx.update(selected_internal=list(selected))
+    kb = internal_squads_kb(catalog.internal, selected, catalog.version)
     await safe_edit_text(call.message, "👥 Выбери внутренние сквады (можно несколько):", reply_markup=kb)
-    await call.answer()
+    return call.answer()
 
 
 async def internal_next(call: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
-    selected = data.get("selected_internal", [])
-    uuids = [INTERNAL_SQUADS[key][1] for key in selected if key in INTERNAL_SQUADS]
-    await state.update_data(active_internal_squads=uuids)
+    catalog = squad_catalog.get()
+    async with state_tx(state) as tx:
+        selected = tx.get("selected_internal", [])
+        uuids = [catalog.internal[key][1] for key in selected if key in catalog.internal]
+        tx.update(active_internal_squads=uuids)
+        tx.set_state(CreateUserFlow.external_squad)
 
-    await state.set_state(CreateUserFlow.external_squad)
-    await safe_edit_text(call.message, "🌍 Выбери внешний сквад (или пропусти):", reply_markup=external_squad_kb(EXTERNAL_SQUADS))
-    await call.answer()
+    await safe_edit_text(call.message, "🌍 Выбери внешний сквад (или пропусти):",
+                         reply_markup=external_squad_kb(catalog.external, catalog.version))
+    return call.answer()
 
 
 # =========================
@@ -434,16 +543,23 @@ async def internal_next(call: CallbackQuery, state: FSMContext):
 # =========================
 
 async def external_handler(call: CallbackQuery, state: FSMContext):
-    if call.data == "ext_skip":
-        await state.update_data(external_squad_uuid=None)
-    else:
-        key = call.data.split("_", 1)[1]
-        await state.update_data(external_squad_uuid=EXTERNAL_SQUADS[key][1])
+    async with state_tx(state) as tx:
+        if call.data == "ext_skip":
+            tx.update(external_squad_uuid=None)
+        else:
+            catalog = squad_catalog.get()
+            key = call.data.split("_", 1)[1]
+            if key not in catalog.external:
+                await safe_edit_text(call.message, "🌍 Список сквадов обновился, выбери ещё раз:",
+                                     reply_markup=external_squad_kb(catalog.external, catalog.version))
+                return call.answer()
+            tx.update(external_squad_uuid=catalog.external[key][1])
+
+        tx.set_state(CreateUserFlow.confirm)
+        data = tx.data
 
-    data = await state.get_data()
-    await state.set_state(CreateUserFlow.confirm)
-    await safe_edit_text(call.message, summary_text(data), reply_markup=confirm_kb())
-    await call.answer()
+    await safe_edit_text(call.message, confirm_text(data), reply_markup=confirm_kb())
+    return call.answer()
 
 
 # =========================
@@ -451,53 +567,83 @@ async def external_handler(call: CallbackQuery, state: FSMContext):
 # =========================
 
 async def confirm_create(call: CallbackQuery, state: FSMContext):
-    data = await state.get_data()
+    async with state_tx(state) as tx:
+        data = tx.data
+        # Двойное нажатие: второй колбэк подключается к уже идущему запросу, а не шлёт свой
+        key = data.get("short_uuid") or data.get("username")
+        started = time.monotonic()
+        create_request = None
+
+        async def create():
+            nonlocal create_request
+            create_request = build_create_request(data)
+            return await get_sdk().users.create_user(body=create_request)
+
+        # Запрос регистрируется до первого await: нажатие, пришедшее, пока правим сообщение, его застанет
+        task, shared = _creating.start(key, create)
+        if not shared:
+            await safe_edit_text(call.message, summary_text(data), reply_markup=processing_kb())
+        await call.answer("⏳ Создаю…")
+
+        try:
+            user = await asyncio.shield(task)
+        except PanelUnavailable:
+            error_text = "⚠️ Панель сейчас недоступна. Данные сохранены — повтори чуть позже."
+            logger.warning("Create user rejected: panel circuit breaker is open")
+        except httpx.TimeoutException as e:
+            error_text = ("⏱ Панель не ответила вовремя. Пользователь мог успеть создаться — "
+                          "проверь в панели, прежде чем повторять.")
+            logger.error(f"Create user timed out: {e}")
+        except panel.ApiError as e:
+            error_text = f"❌ API Error:\n\nCode: {e.error.code}\nMessage: {e.error.message}"
+            logger.error(f"API Error: Code - {e.error.code}; Message: {e.error.message}")
+        except Exception as e:
+            error_text = f"❌ Ошибка:\n\n{str(e)}"
+            logger.error(f"Error: {str(e)}")
+        else:
+            # Флоу закончен — состояние сбросится одной записью на выходе
+            tx.clear()
+            await safe_edit_text(
+                call.message,
+                f"✅ Пользователь создан!\n\n"
+                f"👤 Username: {user.username}\n"
+                f"🆔 UUID: {user.uuid}\n"
+                f"🔗 Subscription:\n{user.subscription_url}\n\n"
+                f"⏳ Expire: {user.expire_at}",
+                reply_markup=main_menu_kb()
+            )
+            if not shared:
+                logger.info(f"New user created: {user.username} ({user.uuid})")
+                _audit_create(call, create_request or data, started, uuid=str(user.uuid), username=user.username)
+                await _index_created(user)
+            return
+
+        if not shared:
+            # Один запрос к панели — одна запись в аудите, сколько бы нажатий к нему ни подключилось
+            _audit_create(call, create_request or data, started, username=data.get("username"), error=error_text)
+
+    # Состояние не сбрасываем: админ может повторить с того же экрана
+    await safe_edit_text(call.message, f"{error_text}\n\n{summary_text(data)}", reply_markup=confirm_retry_kb())
+
+
+def _audit_create(call: CallbackQuery, body, started: float, **fields):
+    audit_log.record(
+        "user_create",
+        admin_id=call.from_user.id,
+        request_hash=request_hash(body),
+        latency_ms=round((time.monotonic() - started) * 1000),
+        **fields,
+    )
+
+
+async def _index_created(user):
+    # Чтобы /find сразу видел нового пользователя; если не вышло — подтянет плановое обновление
     try:
-        sdk = get_sdk()
-        create_request = CreateUserRequestDto(
-            username=data["username"],
-            expire_at=data["expire_at"],
-            email=data.get("email"),
-            telegram_id=data.get("telegram_id"),
-            hwid_device_limit=data.get("hwid_device_limit", 2),
-            tag=data.get("tag"),
-            description=data.get("description"),
-            traffic_limit_bytes=data.get("traffic_limit_bytes"),
-            traffic_limit_strategy=data.get("traffic_limit_strategy", TrafficLimitStrategy.MONTH),
-            active_internal_squads=data.get("active_internal_squads", []),
-            external_squad_uuid=data.get("external_squad_uuid"),
-            short_uuid=data.get("short_uuid") or generate_shortid()
-        )
-        user = await sdk.users.create_user(body=create_request)
-        await state.clear()
-
-        await safe_edit_text(
-            call.message,
-            f"✅ Пользователь создан!\n\n"
-            f"👤 Username: {user.username}\n"
-            f"🆔 UUID: {user.uuid}\n"
-            f"🔗 Subscription:\n{user.subscription_url}\n\n"
-            f"⏳ Expire: {user.expire_at}",
-            reply_markup=main_menu_kb()
-        )
-        logger.info(f"New user created!")
-        await call.answer()
-
-    except ApiError as e:
-        await state.clear()
-        await safe_edit_text(
-            call.message,
-            f"❌ API Error:\n\nCode: {e.error.code}\nMessage: {e.error.message}",
-            reply_markup=main_menu_kb()
-        )
-        await call.answer()
-        logger.error(f"API Error: Code - {e.error.code}; Message: {e.error.message}")
+        await user_index.upsert([user])
     except Exception as e:
-        await state.clear()
-        await safe_edit_text(
-            call.message,
-            f"❌ Ошибка:\n\n{str(e)}",
-            reply_markup=main_menu_kb()
-        )
-        await call.answer()
-        logger.error(f"Error: {str(e)}")
+        logger.warning(f"User index upsert failed: {e}")
+
+
+async def noop_handler(call: CallbackQuery, state: FSMContext):
+    """Кнопка-индикатор («⏳ Создаю…») — просто гасим «часики»."""
+    return call.answer()
@@ -0,0 +1,220 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from aiogram import Bot
+from aiogram.filters import CommandObject
+from aiogram.types import FSInputFile, Message
+from loguru import logger
+
+from config import EXPORT_PAGE_SIZE, EXPORT_TMP_DIR, BULK_PROGRESS_INTERVAL
+import remnawave_client as panel
+from remnawave_client import get_sdk
+from resilience import PanelUnavailable
+from .create_user import safe_edit_text
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+# Те же поля, что в summary_text, плюс то, без чего выгрузка бесполезна (uuid, статус, трафик)
+EXPORT_COLUMNS = (
+    "uuid",
+    "username",
+    "short_uuid",
+    "status",
+    "expire_at",
+    "email",
+    "telegram_id",
+    "tag",
+    "description",
+    "hwid_device_limit",
+    "traffic_limit_bytes",
+    "traffic_limit_strategy",
+    "used_traffic_bytes",
+    "active_internal_squads",
+    "external_squad_uuid",
+    "created_at",
+)
+
+# У Telegram лимит на документ от бота — 50 МБ
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+
+EXPORT_HELP = (
+    "📤 Выгрузка всех пользователей: /export [csv|jsonl]\n\n"
+    "Файл сжат gzip, по умолчанию csv."
+)
+
+# Выгрузка на чат одна: вторая параллельная только удвоит нагрузку на панель
+_exports: dict[int, asyncio.Task] = {}
+
+
+# =========================
+# File
+# =========================
+
+def export_row(user) -> dict:
+    """UserResponseDto -> плоская строка выгрузки."""
+    return {
+        "uuid": str(user.uuid),
+        "username": user.username,
+        "short_uuid": user.short_uuid,
+        "status": str(user.status),
+        "expire_at": user.expire_at.isoformat() if user.expire_at else None,
+        "email": user.email,
+        "telegram_id": user.telegram_id,
+        "tag": user.tag,
+        "description": user.description,
+        "hwid_device_limit": user.hwid_device_limit,
+        "traffic_limit_bytes": int(user.traffic_limit_bytes or 0),
+        "traffic_limit_strategy": str(user.traffic_limit_strategy) if user.traffic_limit_strategy else None,
+        "used_traffic_bytes": int(user.used_traffic_bytes or 0),
+        "active_internal_squads": [str(squad.uuid) for squad in user.active_internal_squads],
+        "external_squad_uuid": str(user.external_squad_uuid) if user.external_squad_uuid else None,
+        "created_at": user.created_at.isoformat() if user.created_at else None,
+    }
+
+
+class ExportFile:
+    """
+    gzip-файл во временной папке, куда страницы дописываются по мере выгрузки.
+    Все операции с диском и сжатие — блокирующие, их вызывают через asyncio.to_thread.
+    """
+
+    def __init__(self, fmt: str):
+        self.fmt = fmt
+        self.rows = 0
+        os.makedirs(EXPORT_TMP_DIR, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(prefix="export_", suffix=f".{fmt}.gz", dir=EXPORT_TMP_DIR)
+        os.close(fd)
+        self._file = gzip.open(self.path, "wt", encoding="utf-8", newline="")
+        if fmt == "csv":
+            self._csv = csv.DictWriter(self._file, fieldnames=EXPORT_COLUMNS)
+            self._csv.writeheader()
+
+    def write(self, users: list):
+        if self.fmt == "csv":
+            for user in users:
+                row = export_row(user)
+                row["active_internal_squads"] = ",".join(row["active_internal_squads"])
+                self._csv.writerow(row)
+        else:
+            # Страница собирается в строку и пишется одним вызовом
+            out = io.StringIO()
+            for user in users:
+                out.write(json.dumps(export_row(user), ensure_ascii=False))
+                out.write("\n")
+            self._file.write(out.getvalue())
+        self.rows += len(users)
+
+    def close(self) -> int:
+        self._file.close()
+        return os.path.getsize(self.path)
+
+    def remove(self):
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+async def export_users(fmt: str, progress: dict) -> ExportFile:
+    """
+    Проходит get_users_stream страница за страницей и сразу пишет её в файл:
+    в памяти одновременно не больше одной страницы, весь список не собирается никогда.
+    """
+    sdk = get_sdk()
+    export = await asyncio.to_thread(ExportFile, fmt)
+    try:
+        cursor = None
+        while True:
+            page = await sdk.users.get_users_stream(size=EXPORT_PAGE_SIZE, cursor=cursor)
+            await asyncio.to_thread(export.write, page.users)
+            progress["rows"] = export.rows
+            if not page.has_more or not page.next_cursor:
+                break
+            cursor = page.next_cursor
+        progress["size"] = await asyncio.to_thread(export.close)
+    except BaseException:
+        await asyncio.to_thread(export.remove)
+        raise
+    return export
+
+
+# =========================
+# Handler
+# =========================
+
+async def _report_progress(message: Message, progress: dict, stop: asyncio.Event):
+    while not stop.is_set():
+        try:
+            await asyncio.wait_for(stop.wait(), BULK_PROGRESS_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        if stop.is_set():
+            break
+        try:
+            await safe_edit_text(message, f"📤 Выгружаю пользователей… {progress['rows']}")
+        except Exception as e:
+            logger.warning(f"Export progress update failed: {e}")
+
+
+async def _run_export(bot: Bot, message: Message, fmt: str):
+    progress = {"rows": 0, "size": 0}
+    started = time.monotonic()
+    stop = asyncio.Event()
+    reporter = asyncio.create_task(_report_progress(message, progress, stop))
+    try:
+        export = await export_users(fmt, progress)
+    except PanelUnavailable:
+        await safe_edit_text(message, "⚠️ Панель сейчас недоступна, повтори чуть позже")
+        return
+    except panel.ApiError as e:
+        logger.error(f"Export: Code - {e.error.code}; Message: {e.error.message}")
+        await safe_edit_text(message, f"❌ Ошибка выгрузки:\n\n{e.error.message}")
+        return
+    except Exception as e:
+        logger.exception("Export crashed")
+        await safe_edit_text(message, f"❌ Ошибка выгрузки:\n\n{e}")
+        return
+    finally:
+        stop.set()
+        await reporter
+
+    elapsed = time.monotonic() - started
+    logger.info(f"Export finished: {export.rows} users, {progress['size']} bytes ({fmt}.gz) in {elapsed:.1f}s")
+    try:
+        if progress["size"] > MAX_DOCUMENT_SIZE:
+            await safe_edit_text(
+                message,
+                f"❌ Файл получился {progress['size'] / 1024**2:.0f} МБ — Telegram не примет больше 50 МБ."
+            )
+            return
+        await safe_edit_text(message, f"🏁 Выгружено {export.rows} польз. за {elapsed:.0f} сек.")
+        filename = f"users_{datetime.now(tz=timezone.utc):%Y%m%d_%H%M%S}.{fmt}.gz"
+        await bot.send_document(message.chat.id, FSInputFile(export.path, filename=filename))
+    finally:
+        await asyncio.to_thread(export.remove)
+
+
+async def cmd_export(message: Message, command: CommandObject):
+    fmt = (command.args or "csv").strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        return message.answer(EXPORT_HELP)
+
+    running = _exports.get(message.chat.id)
+    if running is not None and not running.done():
+        return message.answer("⏳ Выгрузка уже идёт — дождись файла.")
+
+    status = await message.answer("📤 Выгружаю пользователей…")
+    # Выгрузка идёт в фоне: хендлер сразу освобождается, остальные апдейты не ждут
+    task = asyncio.create_task(_run_export(message.bot, status, fmt))
+    _exports[message.chat.id] = task
+    task.add_done_callback(lambda _: _exports.pop(message.chat.id, None))
+    return None
@@ -0,0 +1,50 @@
+import html
+import time
+
+from aiogram.filters import CommandObject
+from aiogram.types import Message
+from aiogram.utils.markdown import hbold, hcode
+
+from keyboards import STATUS_ICONS
+from user_index import user_index
+
+FIND_LIMIT = 20
+
+FIND_HELP = (
+    "🔎 Поиск пользователя: /find <запрос>\n\n"
+    "Без префикса ищет по username (начало), short UUID, тегу, email, Telegram ID и UUID, "
+    "а от 3 символов — и по подстроке.\n\n"
+    "Точнее: tag:VIP, #VIP, email:ivan@, tg:123456, uuid:6ee7a7cd, user:ivan"
+)
+
+
+def format_user_line(user) -> str:
+    parts = [f"{STATUS_ICONS.get(user.status, '▫️')} {hbold(user.username)}"]
+    if user.tag:
+        parts.append(html.escape(user.tag))
+    if user.expire_at:
+        parts.append(f"до {user.expire_at[:10]}")
+    return " · ".join(parts) + f"\n     {hcode(user.uuid)}"
+
+
+async def cmd_find(message: Message, command: CommandObject):
+    query = (command.args or "").strip()
+    if not query:
+        return message.answer(FIND_HELP)
+    if not user_index.ready:
+        return message.answer("⏳ Список пользователей ещё загружается с панели, попробуй через минуту.")
+
+    started = time.perf_counter()
+    users = await user_index.search(query, limit=FIND_LIMIT + 1)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    if not users:
+        return message.answer(f"🔎 По запросу {hcode(query)} никого не нашёл.", parse_mode="HTML")
+
+    more = len(users) > FIND_LIMIT
+    lines = [format_user_line(user) for user in users[:FIND_LIMIT]]
+    footer = f"Показаны первые {FIND_LIMIT} — уточни запрос." if more else f"Найдено: {len(lines)}"
+    return message.answer(
+        "\n".join(lines) + f"\n\n{footer} ({elapsed_ms:.0f} мс, в индексе {len(user_index)})",
+        parse_mode="HTML",
+    )
@@ -0,0 +1,284 @@
+import html
+from datetime import datetime, timedelta, timezone
+
+from aiogram.types import CallbackQuery, Message
+from aiogram.fsm.context import FSMContext
+from aiogram.utils.markdown import hbold
+
+from config import PRESET_MAX_COUNT
+from fsm_tx import state_tx
+from states import CreateUserFlow
+from keyboards import confirm_kb, preset_name_kb, presets_kb, main_menu_kb
+from presets import MAX_NAME_LENGTH, Preset, preset_store
+from utils import bytes_to_gb
+import remnawave_client as panel
+from user_index import user_index
+from id_pool import id_pool
+from .create_user import confirm_text, safe_edit_text
+from .bulk_create import start_bulk
+
+OVERRIDES_HELP = (
+    "Поля: username, email, telegram_id, tag, description, hwid (0-100), days, "
+    "traffic (GB, 0 — безлимит), strategy (NO_RESET/DAY/WEEK/MONTH), "
+    f"count (1-{PRESET_MAX_COUNT}). «-» очищает email, telegram_id, tag и description."
+)
+
+PRESETS_EMPTY_TEXT = (
+    "⚡ Пресетов пока нет.\n\n"
+    "Пройди создание до экрана подтверждения и нажми «💾 Сохранить как пресет» — "
+    "он появится кнопкой в главном меню."
+)
+
+# Поля, которые переносятся из флоу в каждого из K пользователей
+_ROW_FIELDS = (
+    "expire_at",
+    "email",
+    "telegram_id",
+    "hwid_device_limit",
+    "tag",
+    "description",
+    "traffic_limit_bytes",
+    "traffic_limit_strategy",
+    "active_internal_squads",
+    "external_squad_uuid",
+)
+
+
+# Экраны подтверждения, по которым прямо сейчас запускается создание K пользователей
+_starting: set[tuple[int, int]] = set()
+
+
+# =========================
+# Helpers
+# =========================
+
+def _number(value: str, low: int, high: int) -> int:
+    if not value.isdigit() or not low <= int(value) <= high:
+        raise ValueError(f"нужно число от {low} до {high}")
+    return int(value)
+
+
+async def apply_overrides(data: dict, text: str) -> list[str]:
+    """
+    Строки key=value с экрана подтверждения -> правки data на месте.
+    Возвращает ошибки; если они есть, data не меняется.
+    """
+    changes, errors = {}, []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        key, sep, value = line.partition("=")
+        key, value = key.strip().lower(), value.strip()
+        if not sep:
+            errors.append(f"«{line.strip()}»: нужен формат key=value")
+            continue
+        clear = value in ("", "-")
+        try:
+            if key == "username":
+                if not 3 <= len(value) <= 36:
+                    raise ValueError("от 3 до 36 символов")
+                changes["username"] = value
+            elif key in ("email", "tag", "description"):
+                changes[key] = None if clear else value
+            elif key == "telegram_id":
+                changes["telegram_id"] = None if clear else _number(value, 1, 10**15)
+            elif key == "hwid":
+                changes["hwid_device_limit"] = _number(value, 0, 100)
+            elif key == "days":
+                changes["expire_at"] = datetime.now(tz=timezone.utc) + timedelta(days=_number(value, 1, 3650))
+            elif key == "traffic":
+                changes["traffic_limit_bytes"] = _number(value, 0, 100_000) * 1024**3
+            elif key == "strategy":
+                if value.upper() not in panel.TrafficLimitStrategy.__members__:
+                    raise ValueError("NO_RESET, DAY, WEEK, MONTH или MONTH_ROLLING")
+                changes["traffic_limit_strategy"] = panel.TrafficLimitStrategy[value.upper()]
+            elif key == "count":
+                changes["count"] = _number(value, 1, PRESET_MAX_COUNT)
+            else:
+                raise ValueError("неизвестное поле")
+        except ValueError as e:
+            errors.append(f"{key}: {e}")
+
+    if "username" in changes and await user_index.taken([changes["username"]]):
+        errors.append(f"username: {changes['username']} уже есть в панели")
+    if not errors:
+        data.update(changes)
+    return errors
+
+
+def preset_usernames(data: dict, count: int) -> list[str]:
+    return [f"{data['username']}_{i}" for i in range(1, count + 1)]
+
+
+def preset_rows(data: dict, usernames: list[str]) -> list[dict]:
+    """Строки для массового создания по уже проверенным username; short_uuid — из пула."""
+    base = {field: data[field] for field in _ROW_FIELDS if data.get(field) is not None}
+    return [{**base, "username": username, "short_uuid": id_pool.take()} for username in usernames]
+
+
+def presets_text(presets: dict[str, Preset]) -> str:
+    lines = [f"⚡ {hbold('Пресеты')} · {len(presets)}", ""]
+    for preset in presets.values():
+        lines.append(
+            f"{hbold(html.escape(preset.name))} — {preset.expire_days} дн., "
+            f"{bytes_to_gb(preset.traffic_limit_bytes)}, {preset.traffic_limit_strategy}, "
+            f"сквадов: {len(preset.active_internal_squads)}"
+        )
+    lines += ["", "Нажми на пресет, чтобы удалить его:"]
+    return "\n".join(lines)
+
+
+async def _show_confirm(call: CallbackQuery, data: dict):
+    await safe_edit_text(call.message, confirm_text(data), reply_markup=confirm_kb(data.get("count", 1)))
+    return call.answer()
+
+
+# =========================
+# Pick / count / overrides
+# =========================
+
+async def preset_pick(call: CallbackQuery, state: FSMContext):
+    """Кнопка пресета в главном меню: сразу экран подтверждения с новым username."""
+    preset = preset_store.get(call.data.split("_", 1)[1])
+    if preset is None:
+        await safe_edit_text(call.message, "⚡ Пресет не найден — меню обновлено.", reply_markup=main_menu_kb())
+        return call.answer()
+
+    async with state_tx(state) as tx:
+        tx.clear()
+        tx.update(**preset.flow_data(), username=id_pool.take(), short_uuid=id_pool.take(),
+                  preset=preset.name, count=1)
+        tx.set_state(CreateUserFlow.confirm)
+        data = tx.data
+    return await _show_confirm(call, data)
+
+
+async def preset_count(call: CallbackQuery, state: FSMContext):
+    count = int(call.data.split("_", 1)[1])
+    async with state_tx(state) as tx:
+        if tx.get("count", 1) != count:
+            tx.update(count=count)
+        data = tx.data
+    return await _show_confirm(call, data)
+
+
+async def confirm_overrides_text(message: Message, state: FSMContext):
+    if not message.text:
+        return message.answer(OVERRIDES_HELP)
+
+    async with state_tx(state) as tx:
+        data = dict(tx.data)
+        errors = await apply_overrides(data, message.text)
+        if not errors:
+            tx.update(**data)
+
+    if errors:
+        return message.answer("❌ " + "\n❌ ".join(errors) + f"\n\n{OVERRIDES_HELP}")
+    return message.answer(confirm_text(data), reply_markup=confirm_kb(data.get("count", 1)))
+
+
+# =========================
+# Run K users
+# =========================
+
+async def preset_run(call: CallbackQuery, state: FSMContext):
+    # Отметка — до первого await: второе нажатие, пока первое читает состояние и проверяет
+    # username, иначе запустило бы второе такое же создание
+    screen = (call.message.chat.id, call.message.message_id)
+    if screen in _starting:
+        return call.answer("⏳ Уже создаю…")
+    _starting.add(screen)
+    try:
+        return await _preset_run(call, state)
+    finally:
+        _starting.discard(screen)
+
+
+async def _preset_run(call: CallbackQuery, state: FSMContext):
+    async with state_tx(state) as tx:
+        if tx.state != CreateUserFlow.confirm.state:
+            # Первое нажатие уже всё запустило и сбросило состояние
+            return call.answer()
+        data = tx.data
+        count = data.get("count", 1)
+        if len(f"{data['username']}_{count}") > 36:
+            return call.answer("❌ Username с номером длиннее 36 символов — укороти его (username=...)",
+                               show_alert=True)
+
+        # Сначала username: id из пула берём, только когда создание точно пойдёт,
+        # иначе каждая неудачная попытка расходовала бы проверенные short_uuid
+        usernames = preset_usernames(data, count)
+        taken = await user_index.taken(usernames)
+        if taken:
+            shown = ", ".join(sorted(taken)[:3])
+            return call.answer(f"❌ Уже есть в панели: {shown}. Поменяй username.", show_alert=True)
+        rows = preset_rows(data, usernames)
+        tx.clear()
+
+    await safe_edit_text(call.message, f"⏳ Создаю пользователей: 0/{count}")
+    await call.answer()
+    start_bulk(call.bot, call.message, rows, call.from_user.id, source="preset")
+    return None
+
+
+# =========================
+# Save / manage
+# =========================
+
+async def preset_save(call: CallbackQuery, state: FSMContext):
+    await state.set_state(CreateUserFlow.preset_name)
+    await safe_edit_text(
+        call.message,
+        f"💾 Введи название пресета (до {MAX_NAME_LENGTH} символов).\n"
+        "Пресет с тем же названием перезапишется.",
+        reply_markup=preset_name_kb()
+    )
+    return call.answer()
+
+
+async def preset_back(call: CallbackQuery, state: FSMContext):
+    async with state_tx(state) as tx:
+        tx.set_state(CreateUserFlow.confirm)
+        data = tx.data
+    return await _show_confirm(call, data)
+
+
+async def preset_name_text(message: Message, state: FSMContext):
+    name = (message.text or "").strip()
+    if not 1 <= len(name) <= MAX_NAME_LENGTH:
+        return message.answer(f"❌ Название — от 1 до {MAX_NAME_LENGTH} символов.")
+
+    async with state_tx(state) as tx:
+        try:
+            await preset_store.save(Preset.from_flow(name, tx.data))
+        except ValueError as e:
+            return message.answer(f"❌ Не сохранил: {e}", reply_markup=preset_name_kb())
+        tx.update(preset=name)
+        tx.set_state(CreateUserFlow.confirm)
+        data = tx.data
+
+    return message.answer(
+        f"💾 Пресет «{name}» сохранён — он в главном меню.\n\n{confirm_text(data)}",
+        reply_markup=confirm_kb(data.get("count", 1))
+    )
+
+
+async def cmd_presets(message: Message):
+    presets = preset_store.all()
+    if not presets:
+        return message.answer(PRESETS_EMPTY_TEXT)
+    return message.answer(presets_text(presets), reply_markup=presets_kb(presets), parse_mode="HTML")
+
+
+async def preset_delete(call: CallbackQuery, state: FSMContext):
+    key = call.data.split("_", 1)[1]
+    preset = await preset_store.delete(key)
+    if preset is None:
+        return call.answer("Уже удалён")
+
+    presets = preset_store.all()
+    if presets:
+        await safe_edit_text(call.message, presets_text(presets), reply_markup=presets_kb(presets), parse_mode="HTML")
+    else:
+        await safe_edit_text(call.message, PRESETS_EMPTY_TEXT)
+    return call.answer(f"🗑 «{preset.name}» удалён")
@@ -1,9 +1,12 @@
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
 
+from fsm_tx import state_tx
 from keyboards import main_menu_kb
 
 
 async def cmd_start(message: Message, state: FSMContext):
-    await state.clear()
-    await message.answer("⚡ Remnawave Admin Bot", reply_markup=main_menu_kb())
+    # state.clear() — это set_state и set_data, две записи; транзакция пишет одну
+    async with state_tx(state) as tx:
+        tx.clear()
+    return message.answer("⚡ Remnawave Admin Bot", reply_markup=main_menu_kb())
@@ -0,0 +1,100 @@
+import html
+import time
+
+from aiogram.types import CallbackQuery, Message
+from aiogram.fsm.context import FSMContext
+from aiogram.utils.markdown import hbold
+from loguru import logger
+
+from keyboards import STATUS_ICONS, stats_kb
+import remnawave_client as panel
+from resilience import PanelUnavailable
+from squads import squad_catalog
+from stats import StatsReport, user_stats
+from .create_user import safe_edit_text
+
+# Сквадов бывает много — длинный хвост сворачиваем, чтобы влезть в сообщение
+MAX_SQUAD_LINES = 15
+
+STATS_LOADING_TEXT = "📊 Считаю статистику по всем пользователям…"
+
+
+def _gb(value: int) -> str:
+    return f"{value / 1024**3:.2f} GB"
+
+
+def _share(count: int, total: int) -> str:
+    return f"{count} ({count * 100 / total:.0f}%)" if total else str(count)
+
+
+def _age(seconds: float) -> str:
+    if seconds < 60:
+        return "только что"
+    return f"{seconds / 60:.0f} мин назад"
+
+
+def stats_text(report: StatsReport) -> str:
+    total = report.total
+    lines = [
+        f"📊 {hbold('Статистика')} · {total} польз.",
+        f"Посчитано {_age(time.time() - report.computed_at)} за {report.seconds:.1f} сек.",
+        "",
+        hbold("По статусам:"),
+    ]
+    for status, count in sorted(report.by_status.items(), key=lambda item: -item[1]):
+        lines.append(f"{STATUS_ICONS.get(status, '▫️')} {status} — {_share(count, total)}")
+
+    lines += ["", hbold("Сброс трафика:")]
+    for strategy, count in sorted(report.by_strategy.items(), key=lambda item: -item[1]):
+        lines.append(f"🔄 {strategy} — {_share(count, total)}")
+
+    lines += ["", hbold("По сквадам:")]
+    names = {uuid: name for name, uuid in squad_catalog.get().internal.values()}
+    squads = sorted(report.by_squad.items(), key=lambda item: -item[1])
+    for uuid, count in squads[:MAX_SQUAD_LINES]:
+        lines.append(f"👥 {html.escape(names.get(uuid, uuid[:8]))} — {_share(count, total)}")
+    if len(squads) > MAX_SQUAD_LINES:
+        lines.append(f"… и ещё {len(squads) - MAX_SQUAD_LINES}")
+    lines.append(f"🚫 без сквада — {_share(report.no_squad, total)}")
+
+    lines += ["", hbold("Истекают:")]
+    lines.append(" · ".join(f"{days} дн. — {count}" for days, count in report.expiring.items()))
+
+    lines += ["", hbold(f"Топ-{len(report.top_traffic)} по трафику:")]
+    for place, (username, used) in enumerate(report.top_traffic, 1):
+        lines.append(f"{place}. {html.escape(username)} — {_gb(used)}")
+    lines.append(f"\nВсего использовано: {_gb(report.used_traffic_bytes)}")
+    return "\n".join(lines)
+
+
+async def _compute(force: bool) -> str:
+    try:
+        return stats_text(await user_stats.get(force))
+    except PanelUnavailable:
+        return "⚠️ Панель сейчас недоступна, повтори чуть позже"
+    except panel.ApiError as e:
+        logger.error(f"Stats: Code - {e.error.code}; Message: {e.error.message}")
+        return f"❌ Ошибка:\n\n{html.escape(e.error.message)}"
+    except Exception as e:
+        logger.exception("Stats crashed")
+        return f"❌ Не удалось посчитать статистику: {html.escape(str(e))}"
+
+
+async def cmd_stats(message: Message):
+    report = user_stats.cached()
+    if report is not None:
+        return message.answer(stats_text(report), reply_markup=stats_kb(), parse_mode="HTML")
+
+    status = await message.answer(STATS_LOADING_TEXT)
+    text = await _compute(force=False)
+    await safe_edit_text(status, text, reply_markup=stats_kb(), parse_mode="HTML")
+    return None
+
+
+async def stats_refresh(call: CallbackQuery, state: FSMContext):
+    if user_stats.computing:
+        return call.answer("⏳ Уже считаю, подожди пару секунд")
+    await call.answer("🔄 Пересчитываю…")
+    text = await _compute(force=True)
+    await safe_edit_text(call.message, text, reply_markup=stats_kb(), parse_mode="HTML")
+    return None
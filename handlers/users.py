@@ -0,0 +1,318 @@
+import asyncio
+import html
+from dataclasses import dataclass
+
+from aiogram.types import CallbackQuery, Message
+from aiogram.fsm.context import FSMContext
+from aiogram.utils.markdown import hbold, hcode
+from loguru import logger
+
+from config import USERS_PAGE_SIZE, USERS_PAGE_TTL
+from fsm_tx import state_tx
+from keyboards import STATUS_ICONS, users_page_kb, users_filter_kb, user_detail_kb, main_menu_kb
+from pipeline import SingleFlight
+import remnawave_client as panel
+from remnawave_client import get_sdk
+from resilience import PanelUnavailable
+from squads import squad_catalog
+from user_index import IndexedUser, UserFilter, user_index
+from utils import TTLCache, format_datetime, bytes_to_gb
+from .create_user import safe_edit_text
+from .find import format_user_line
+
+# Страницы и карточки живут недолго: списки обновляются в индексе, карточка — на панели
+_pages = TTLCache(512, USERS_PAGE_TTL)
+_details = TTLCache(256, USERS_PAGE_TTL)
+# Страница, которую уже грузит префетч, второй раз не запрашивается — ждём тот же результат
+_loading = SingleFlight()
+# Держим ссылки на фоновые задачи, чтобы их не собрал GC
+_prefetching: set[asyncio.Task] = set()
+
+INDEX_LOADING_TEXT = "⏳ Список пользователей ещё загружается с панели, попробуй через минуту."
+
+
+@dataclass(frozen=True)
+class Page:
+    users: tuple[IndexedUser, ...]
+    has_next: bool
+    total: int
+
+    @property
+    def next_cursor(self) -> tuple[str, str] | None:
+        if not self.has_next:
+            return None
+        last = self.users[-1]
+        return last.username, last.uuid
+
+
+# =========================
+# Pages
+# =========================
+
+async def _load_page(key: tuple, filters: UserFilter, after: tuple | None) -> Page:
+    users, total = await asyncio.gather(
+        user_index.page(filters, after, USERS_PAGE_SIZE + 1),
+        user_index.count(filters),
+    )
+    page = Page(tuple(users[:USERS_PAGE_SIZE]), len(users) > USERS_PAGE_SIZE, total)
+    _pages.set(key, page)
+    return page
+
+
+async def get_page(filters: UserFilter, after: tuple | None) -> Page:
+    # Версия индекса в ключе: после обновления данных старые страницы просто не находятся
+    key = (user_index.version, filters, after)
+    page = _pages.get(key)
+    if page is None:
+        page, _ = await _loading.do(key, lambda: _load_page(key, filters, after))
+    return page
+
+
+def _prefetch(filters: UserFilter, after: tuple):
+    """Следующая страница грузится в фоне, пока админ читает текущую."""
+    if (user_index.version, filters, after) in _pages:
+        return
+    task = asyncio.create_task(get_page(filters, after))
+    _prefetching.add(task)
+    task.add_done_callback(_prefetched)
+
+
+def _prefetched(task: asyncio.Task):
+    _prefetching.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"Users page prefetch failed: {task.exception()}")
+
+
+# =========================
+# Render
+# =========================
+
+def browse_state(data: dict) -> dict:
+    return data.get("browse") or {"status": None, "tag": None, "squad": None, "cursors": [None]}
+
+
+def browse_filters(browse: dict) -> UserFilter:
+    return UserFilter(status=browse["status"], tag=browse["tag"], squad=browse["squad"])
+
+
+def _cursor(value) -> tuple[str, str] | None:
+    # В FSM курсор лежит списком (JSON), в ключах кэша нужен кортеж
+    return tuple(value) if value else None
+
+
+def filters_text(filters: UserFilter) -> str:
+    parts = []
+    if filters.status:
+        parts.append(f"статус {filters.status}")
+    if filters.tag:
+        parts.append(f"тег {html.escape(filters.tag)}")
+    if filters.squad:
+        catalog = squad_catalog.get()
+        names = {uuid: name for name, uuid in (*catalog.internal.values(), *catalog.external.values())}
+        parts.append(f"сквад {html.escape(names.get(filters.squad, filters.squad[:8]))}")
+    return ", ".join(parts) if parts else "все"
+
+
+async def render_page(browse: dict) -> tuple[str, object]:
+    filters = browse_filters(browse)
+    after = _cursor(browse["cursors"][-1])
+    page = await get_page(filters, after)
+    if page.has_next:
+        _prefetch(filters, page.next_cursor)
+
+    number = len(browse["cursors"])
+    pages = max(1, -(-page.total // USERS_PAGE_SIZE))
+    header = f"👥 Пользователи · {filters_text(filters)}\nСтраница {number} из {pages} · всего {page.total}"
+    if not page.users:
+        body = "Никого не нашёл — поменяй фильтры."
+    else:
+        body = "\n".join(format_user_line(user) for user in page.users)
+
+    kb = users_page_kb(
+        tuple((user.uuid, user.username, user.status) for user in page.users),
+        has_prev=number > 1,
+        has_next=page.has_next,
+    )
+    return f"{header}\n\n{body}", kb
+
+
+async def _show(call: CallbackQuery, state: FSMContext, change=None):
+    """Меняет состояние браузера (change(browse) -> None) и перерисовывает страницу."""
+    if not user_index.ready:
+        return call.answer(INDEX_LOADING_TEXT, show_alert=True)
+
+    async with state_tx(state) as tx:
+        browse = browse_state(tx.data)
+        if change is not None:
+            browse = {**browse, "cursors": list(browse["cursors"])}
+            change(browse)
+            tx.update(browse=browse)
+        elif "browse" not in tx.data:
+            tx.update(browse=browse)
+
+    text, kb = await render_page(browse)
+    await safe_edit_text(call.message, text, reply_markup=kb, parse_mode="HTML")
+    return call.answer()
+
+
+# =========================
+# Handlers
+# =========================
+
+async def cmd_users(message: Message, state: FSMContext):
+    if not user_index.ready:
+        return message.answer(INDEX_LOADING_TEXT)
+    browse = browse_state({})
+    async with state_tx(state) as tx:
+        tx.update(browse=browse)
+    text, kb = await render_page(browse)
+    return message.answer(text, reply_markup=kb, parse_mode="HTML")
+
+
+async def users_open(call: CallbackQuery, state: FSMContext):
+    def reset(browse: dict):
+        browse.update(browse_state({}))
+    return await _show(call, state, reset)
+
+
+async def users_list(call: CallbackQuery, state: FSMContext):
+    return await _show(call, state)
+
+
+async def users_next(call: CallbackQuery, state: FSMContext):
+    if not user_index.ready:
+        return call.answer(INDEX_LOADING_TEXT, show_alert=True)
+    async with state_tx(state) as tx:
+        browse = browse_state(tx.data)
+    # Обычно это страница из кэша — та же, что сейчас видит админ
+    page = await get_page(browse_filters(browse), _cursor(browse["cursors"][-1]))
+
+    def forward(browse: dict):
+        if page.has_next:
+            browse["cursors"].append(list(page.next_cursor))
+    return await _show(call, state, forward)
+
+
+async def users_prev(call: CallbackQuery, state: FSMContext):
+    def back(browse: dict):
+        if len(browse["cursors"]) > 1:
+            browse["cursors"].pop()
+    return await _show(call, state, back)
+
+
+async def users_filters(call: CallbackQuery, state: FSMContext):
+    if not user_index.ready:
+        return call.answer(INDEX_LOADING_TEXT, show_alert=True)
+    async with state_tx(state) as tx:
+        filters = browse_filters(browse_state(tx.data))
+
+    catalog = squad_catalog.get()
+    squads = tuple((key, name) for key, (name, _) in (*catalog.internal.items(), *catalog.external.items()))
+    tags_key = ("tags", user_index.version)
+    tags = _pages.get(tags_key)
+    if tags is None:
+        tags = tuple(await user_index.tags())
+        _pages.set(tags_key, tags)
+    kb = users_filter_kb(tags, squads, catalog.version)
+    await safe_edit_text(call.message, f"🔎 Фильтры списка\n\nСейчас: {filters_text(filters)}",
+                         reply_markup=kb, parse_mode="HTML")
+    return call.answer()
+
+
+async def users_filter_set(call: CallbackQuery, state: FSMContext):
+    """ubs_<status> / ubt_<tag> / ubq_<squad key>; *_all снимает фильтр."""
+    namespace, _, value = call.data.partition("_")
+    value = None if value == "all" else value
+    if namespace == "ubq" and value is not None:
+        catalog = squad_catalog.get()
+        squad = catalog.internal.get(value) or catalog.external.get(value)
+        if squad is None:
+            return call.answer("Список сквадов обновился, выбери ещё раз", show_alert=True)
+        value = squad[1]
+    field = {"ubs": "status", "ubt": "tag", "ubq": "squad"}[namespace]
+
+    def apply(browse: dict):
+        browse[field] = value
+        browse["cursors"] = [None]
+    return await _show(call, state, apply)
+
+
+async def users_filter_reset(call: CallbackQuery, state: FSMContext):
+    def reset(browse: dict):
+        browse.update(status=None, tag=None, squad=None, cursors=[None])
+    return await _show(call, state, reset)
+
+
+async def users_close(call: CallbackQuery, state: FSMContext):
+    await safe_edit_text(call.message, "⚡ Remnawave Admin Bot", reply_markup=main_menu_kb())
+    return call.answer()
+
+
+# =========================
+# Detail
+# =========================
+
+def _gb(value: float | None) -> str:
+    return f"{(value or 0) / 1024**3:.2f} GB"
+
+
+def detail_text(user) -> str:
+    squads = ", ".join(s.name for s in user.active_internal_squads) or "—"
+    external = "—"
+    if user.external_squad_uuid:
+        names = {uuid: name for name, uuid in squad_catalog.get().external.values()}
+        external = names.get(str(user.external_squad_uuid), str(user.external_squad_uuid))
+
+    lines = [
+        f"{STATUS_ICONS.get(str(user.status), '▫️')} {hbold(user.username)} · {user.status}",
+        f"🆔 UUID: {hcode(str(user.uuid))}",
+        f"🔑 Short UUID: {hcode(user.short_uuid)}",
+        f"⏳ Истекает: {format_datetime(user.expire_at)}",
+        f"📊 Трафик: {_gb(user.used_traffic_bytes)} из {bytes_to_gb(int(user.traffic_limit_bytes or 0))} "
+        f"({user.traffic_limit_strategy})",
+        f"👥 Сквады: {html.escape(squads)}",
+        f"🌍 Внешний сквад: {html.escape(external)}",
+    ]
+    if user.tag:
+        lines.append(f"🏷 Тег: {html.escape(user.tag)}")
+    if user.email:
+        lines.append(f"📧 Email: {html.escape(user.email)}")
+    if user.telegram_id:
+        lines.append(f"📱 Telegram ID: {hcode(str(user.telegram_id))}")
+    if user.hwid_device_limit is not None:
+        lines.append(f"💻 HWID лимит: {user.hwid_device_limit}")
+    if user.description:
+        lines.append(f"📝 {html.escape(user.description)}")
+    lines.append(f"🕒 Онлайн: {format_datetime(user.online_at) if user.online_at else 'ни разу'}")
+    lines.append(f"🔗 {html.escape(user.subscription_url)}")
+    return "\n".join(lines)
+
+
+async def _load_user(uuid: str):
+    user = await get_sdk().users.get_user_by_uuid(uuid)
+    _details.set(uuid, user)
+    # Заодно освежаем индекс: список покажет то же, что и карточка
+    await user_index.upsert([user])
+    return user
+
+
+async def user_detail(call: CallbackQuery, state: FSMContext):
+    uuid = call.data.split("_", 1)[1]
+    user = _details.get(uuid)
+    if user is None:
+        try:
+            user, _ = await _loading.do(("user", uuid), lambda: _load_user(uuid))
+        except panel.NotFoundError:
+            await user_index.remove([uuid])
+            return call.answer("Пользователь уже удалён с панели", show_alert=True)
+        except PanelUnavailable:
+            return call.answer("⚠️ Панель сейчас недоступна, повтори чуть позже", show_alert=True)
+        except panel.ApiError as e:
+            logger.error(f"Get user {uuid}: Code - {e.error.code}; Message: {e.error.message}")
+            return call.answer(f"❌ {e.error.message}", show_alert=True)
+        except Exception as e:
+            logger.error(f"Get user {uuid}: {e}")
+            return call.answer("❌ Не удалось загрузить пользователя", show_alert=True)
+
+    await safe_edit_text(call.message, detail_text(user), reply_markup=user_detail_kb(), parse_mode="HTML")
+    return call.answer()
@@ -0,0 +1,76 @@
+import asyncio
+from collections import deque
+
+from loguru import logger
+
+from config import ID_POOL_SIZE
+from user_index import user_index
+from utils import generate_ids, generate_shortid
+
+
+class IdPool:
+    """
+    Запас готовых ID для username и short_uuid. Пополняется в фоне пачками
+    (utils.generate_ids), и каждая пачка сверяется с индексом пользователей:
+    занятый в панели ID в запас не попадает и не всплывёт ошибкой на подтверждении.
+    take() — popleft из deque: без генерации и без запросов в хендлере.
+    """
+
+    def __init__(self, size: int, length: int = 16):
+        self.size = size
+        self.length = length
+        # Пополняем, когда осталось меньше четверти
+        self.low = max(1, size // 4)
+        self.generated = 0
+        self.rejected = 0
+        self.fallbacks = 0
+        self._ids: deque[str] = deque()
+        self._refilling: asyncio.Task | None = None
+
+    def take(self) -> str:
+        try:
+            value = self._ids.popleft()
+        except IndexError:
+            # Запас ещё не наполнен (первые секунды после старта) — свежий ID без сверки
+            self.fallbacks += 1
+            value = generate_shortid(self.length)
+        if len(self._ids) < self.low:
+            self._schedule_refill()
+        return value
+
+    def _schedule_refill(self):
+        if self._refilling is None or self._refilling.done():
+            self._refilling = asyncio.create_task(self._refill())
+
+    async def _refill(self):
+        # Один проход: отброшенные не догенерируем — недостачу покроет следующее пополнение
+        try:
+            # 256 ID — доли миллисекунды, поток не нужен; сверка с SQLite — в потоке индекса
+            batch = list(dict.fromkeys(generate_ids(self.size - len(self._ids), self.length)))
+            taken = await user_index.taken(batch)
+            if taken:
+                self.rejected += len(taken)
+                logger.warning(f"ID pool: {len(taken)} generated IDs already exist in the panel")
+            self._ids.extend(value for value in batch if value not in taken)
+            self.generated += len(batch) - len(taken)
+        except Exception as e:
+            logger.warning(f"ID pool refill failed: {e}")
+
+    def start(self):
+        self._schedule_refill()
+
+    async def stop(self):
+        if self._refilling is not None and not self._refilling.done():
+            self._refilling.cancel()
+            await asyncio.gather(self._refilling, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._ids),
+            "generated": self.generated,
+            "rejected": self.rejected,
+            "fallbacks": self.fallbacks,
+        }
+
+
+id_pool = IdPool(ID_POOL_SIZE)
@@ -1,14 +1,59 @@
+from functools import cache
+
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 
+from config import PRESET_MAX_COUNT
+from presets import preset_store
+from utils import LRUCache
+
+# Статичные клавиатуры собираются один раз (@cache) и дальше переиспользуются —
+# сборка через InlineKeyboardBuilder + валидация pydantic стоит ~0.2-1.5 мс на вызов.
+# Готовые разметки общие для всех хендлеров, менять их на месте нельзя.
+
+# Клавиатуры сквадов зависят от выбора — кэшируем по (версия каталога, выбранные ключи)
+SQUADS_KB_CACHE_SIZE = 256
+_internal_squads_cache = LRUCache(SQUADS_KB_CACHE_SIZE)
+_external_squad_cache = LRUCache(16)
+# Страница /users зависит от списка на ней — кэшируем по (пользователи, есть ли соседние страницы)
+_users_page_cache = LRUCache(256)
+_users_filter_cache = LRUCache(64)
+# Главное меню зависит только от списка пресетов — кэшируем по его версии
+_main_menu_cache = LRUCache(4)
+
+# Быстрый выбор количества на экране подтверждения
+CREATE_COUNTS = tuple(count for count in (1, 5, 10, 25) if count <= PRESET_MAX_COUNT)
+
+STATUS_ICONS = {
+    "ACTIVE": "🟢",
+    "DISABLED": "⚪",
+    "LIMITED": "🟡",
+    "EXPIRED": "🔴",
+}
+
 
 def main_menu_kb():
+    presets = preset_store.all()
+    markup = _main_menu_cache.get(preset_store.version)
+    if markup is None:
+        markup = _build_main_menu_kb(presets)
+        _main_menu_cache.set(preset_store.version, markup)
+    return markup
+
+
+def _build_main_menu_kb(presets: dict) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
+    # Пресеты — сверху: создание по ним в одно нажатие
+    for key, preset in presets.items():
+        kb.button(text=f"⚡ {preset.name}", callback_data=f"pp_{key}")
     kb.button(text="👤 Создать пользователя", callback_data="start_create")
-    kb.adjust(1)
+    kb.button(text="📥 Массовое создание", callback_data="bulk_start")
+    kb.button(text="👥 Пользователи", callback_data="ub_open")
+    kb.adjust(*_rows(len(presets), 2), 1, 1, 1)
     return kb.as_markup()
 
 
+@cache
 def username_kb():
     kb = InlineKeyboardBuilder()
     kb.button(text="🎲 Сгенерировать", callback_data="username_generate")
@@ -18,6 +63,7 @@ def username_kb():
     return kb.as_markup()
 
 
+@cache
 def expire_kb():
     kb = InlineKeyboardBuilder()
     kb.button(text="+1 месяц", callback_data="exp_1")
@@ -35,6 +81,7 @@ def expire_kb():
     return kb.as_markup()
 
 
+@cache
 def skip_input_kb():
     kb = InlineKeyboardBuilder()
     kb.button(text="⏭ Пропустить", callback_data="skip")
@@ -43,6 +90,7 @@ def skip_input_kb():
     return kb.as_markup()
 
 
+@cache
 def traffic_kb():
     kb = InlineKeyboardBuilder()
 
@@ -62,19 +110,34 @@ def traffic_kb():
     return kb.as_markup()
 
 
+@cache
 def traffic_strategy_kb():
     kb = InlineKeyboardBuilder()
     kb.button(text="NO_RESET", callback_data="str_NO_RESET")
-    kb.button(text="MONTHLY (default)", callback_data="str_MONTHLY")
-    kb.button(text="WEEKLY", callback_data="str_WEEKLY")
-    kb.button(text="DAILY", callback_data="str_DAILY")
+    kb.button(text="MONTHLY (default)", callback_data="str_MONTH")
+    kb.button(text="WEEKLY", callback_data="str_WEEK")
+    kb.button(text="DAILY", callback_data="str_DAY")
     kb.button(text="⏭ Пропустить (MONTHLY)", callback_data="str_skip")
     kb.button(text="❌ Отмена", callback_data="cancel")
     kb.adjust(2, 2, 1, 1)
     return kb.as_markup()
 
 
-def internal_squads_kb(internal_squads: dict, selected: set) -> InlineKeyboardMarkup:
+def _catalog_version(squads: dict):
+    # Без явной версии ключом служит само содержимое каталога
+    return tuple((key, name) for key, (name, _) in squads.items())
+
+
+def internal_squads_kb(internal_squads: dict, selected: set, version=None) -> InlineKeyboardMarkup:
+    cache_key = (version if version is not None else _catalog_version(internal_squads), frozenset(selected))
+    markup = _internal_squads_cache.get(cache_key)
+    if markup is None:
+        markup = _build_internal_squads_kb(internal_squads, selected)
+        _internal_squads_cache.set(cache_key, markup)
+    return markup
+
+
+def _build_internal_squads_kb(internal_squads: dict, selected: set) -> InlineKeyboardMarkup:
     kb = InlineKeyboardBuilder()
 
     # Основные сквады
@@ -94,7 +157,16 @@ def internal_squads_kb(internal_squads: dict, selected: set) -> InlineKeyboardMa
     return kb.as_markup()
 
 
-def external_squad_kb(external_squads: dict):
+def external_squad_kb(external_squads: dict, version=None):
+    cache_key = version if version is not None else _catalog_version(external_squads)
+    markup = _external_squad_cache.get(cache_key)
+    if markup is None:
+        markup = _build_external_squad_kb(external_squads)
+        _external_squad_cache.set(cache_key, markup)
+    return markup
+
+
+def _build_external_squad_kb(external_squads: dict):
     kb = InlineKeyboardBuilder()
 
     for key, (name, _) in external_squads.items():
@@ -107,9 +179,204 @@ def external_squad_kb(external_squads: dict):
     return kb.as_markup()
 
 
-def confirm_kb():
+@cache
+def confirm_kb(count: int = 1):
+    kb = InlineKeyboardBuilder()
+    if count > 1:
+        kb.button(text=f"🚀 Создать {count}", callback_data="pr_run")
+    else:
+        kb.button(text="✅ Создать", callback_data="confirm_create")
+    kb.button(text="❌ Отмена", callback_data="cancel")
+    for option in CREATE_COUNTS:
+        kb.button(text=f"• ×{option} •" if option == count else f"×{option}", callback_data=f"prk_{option}")
+    kb.button(text="💾 Сохранить как пресет", callback_data="pr_save")
+    kb.adjust(2, len(CREATE_COUNTS), 1)
+    return kb.as_markup()
+
+
+@cache
+def preset_name_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⬅️ Назад", callback_data="pr_back")
+    return kb.as_markup()
+
+
+def presets_kb(presets: dict) -> InlineKeyboardMarkup:
+    """/presets: по кнопке удаления на пресет."""
+    kb = InlineKeyboardBuilder()
+    for key, preset in presets.items():
+        kb.button(text=f"🗑 {preset.name}", callback_data=f"prd_{key}")
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+@cache
+def confirm_retry_kb():
     kb = InlineKeyboardBuilder()
-    kb.button(text="✅ Создать", callback_data="confirm_create")
+    kb.button(text="🔁 Повторить", callback_data="confirm_create")
     kb.button(text="❌ Отмена", callback_data="cancel")
     kb.adjust(2)
     return kb.as_markup()
+
+
+@cache
+def processing_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⏳ Создаю…", callback_data="noop")
+    return kb.as_markup()
+
+
+@cache
+def bulk_upload_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="❌ Отмена", callback_data="cancel")
+    return kb.as_markup()
+
+
+def bulk_confirm_kb(count: int):
+    kb = InlineKeyboardBuilder()
+    kb.button(text=f"🚀 Создать {count}", callback_data="bulk_run")
+    kb.button(text="❌ Отмена", callback_data="cancel")
+    kb.adjust(2)
+    return kb.as_markup()
+
+
+def _rows(count: int, width: int) -> list[int]:
+    """Размеры рядов для adjust(): count кнопок по width в ряд, хвост — отдельным рядом."""
+    return [width] * (count // width) + ([count % width] if count % width else [])
+
+
+def users_page_kb(users: tuple, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    """users — ((uuid, username, status), ...) пользователей текущей страницы."""
+    cache_key = (users, has_prev, has_next)
+    markup = _users_page_cache.get(cache_key)
+    if markup is None:
+        markup = _build_users_page_kb(users, has_prev, has_next)
+        _users_page_cache.set(cache_key, markup)
+    return markup
+
+
+def _build_users_page_kb(users: tuple, has_prev: bool, has_next: bool) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+
+    for uuid, username, status in users:
+        kb.button(text=f"{STATUS_ICONS.get(status, '▫️')} {username}", callback_data=f"ubu_{uuid}")
+    kb.adjust(2)
+
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data="ub_prev"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data="ub_next"))
+    if nav:
+        kb.row(*nav)
+
+    kb.row(
+        InlineKeyboardButton(text="🔎 Фильтры", callback_data="ub_filters"),
+        InlineKeyboardButton(text="⚙️ Со всеми…", callback_data="ba_start"),
+        InlineKeyboardButton(text="✖️ Закрыть", callback_data="ub_close"),
+    )
+    return kb.as_markup()
+
+
+def users_filter_kb(tags: tuple, squads: tuple, version=None) -> InlineKeyboardMarkup:
+    """squads — ((key, name), ...) из каталога сквадов; version — версия каталога."""
+    cache_key = (tags, squads, version)
+    markup = _users_filter_cache.get(cache_key)
+    if markup is None:
+        markup = _build_users_filter_kb(tags, squads)
+        _users_filter_cache.set(cache_key, markup)
+    return markup
+
+
+def _build_users_filter_kb(tags: tuple, squads: tuple) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardBuilder()
+    sizes = []
+
+    for status, icon in STATUS_ICONS.items():
+        kb.button(text=f"{icon} {status}", callback_data=f"ubs_{status}")
+    kb.button(text="Любой статус", callback_data="ubs_all")
+    sizes += [2, 2, 1]
+
+    for tag in tags:
+        kb.button(text=f"🏷 {tag}", callback_data=f"ubt_{tag}")
+    if tags:
+        kb.button(text="Любой тег", callback_data="ubt_all")
+        sizes += _rows(len(tags), 3) + [1]
+
+    for key, name in squads:
+        kb.button(text=f"👥 {name}", callback_data=f"ubq_{key}")
+    if squads:
+        kb.button(text="Любой сквад", callback_data="ubq_all")
+        sizes += _rows(len(squads), 2) + [1]
+
+    kb.button(text="❌ Сбросить фильтры", callback_data="ub_reset")
+    kb.button(text="⬅️ К списку", callback_data="ub_list")
+    sizes.append(2)
+
+    kb.adjust(*sizes)
+    return kb.as_markup()
+
+
+@cache
+def user_detail_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⬅️ К списку", callback_data="ub_list")
+    return kb.as_markup()
+
+
+@cache
+def bulk_action_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="⏳ Продлить", callback_data="ba_extend")
+    kb.button(text="🔄 Сбросить трафик", callback_data="ba_reset_traffic")
+    kb.button(text="👥 Сменить сквады", callback_data="ba_squads")
+    kb.button(text="⛔ Отключить", callback_data="ba_disable")
+    kb.button(text="✅ Включить", callback_data="ba_enable")
+    kb.button(text="❌ Отмена", callback_data="cancel")
+    kb.adjust(2, 1, 2, 1)
+    return kb.as_markup()
+
+
+@cache
+def bulk_days_kb():
+    kb = InlineKeyboardBuilder()
+    for days in (7, 30, 90, 180, 365):
+        kb.button(text=f"+{days} дн.", callback_data=f"bad_{days}")
+    kb.button(text="❌ Отмена", callback_data="cancel")
+    kb.adjust(3, 2, 1)
+    return kb.as_markup()
+
+
+def bulk_action_confirm_kb(count: int):
+    kb = InlineKeyboardBuilder()
+    if count:
+        kb.button(text=f"🚀 Выполнить для {count}", callback_data="bj_run")
+    kb.button(text="❌ Отмена", callback_data="cancel")
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+def bulk_job_kb(job_id: str, running: bool, resumable: bool):
+    kb = InlineKeyboardBuilder()
+    if running:
+        kb.button(text="⏹ Остановить", callback_data=f"bjc_{job_id}")
+    elif resumable:
+        kb.button(text="🔁 Продолжить", callback_data=f"bjr_{job_id}")
+    else:
+        return main_menu_kb()
+    return kb.as_markup()
+
+
+@cache
+def stats_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="🔄 Пересчитать", callback_data="st_refresh")
+    return kb.as_markup()
+
+
+# Собираем статичные клавиатуры сразу при импорте, а не на первом нажатии
+for _kb in (username_kb, expire_kb, skip_input_kb, traffic_kb,
+            traffic_strategy_kb, confirm_kb, confirm_retry_kb, processing_kb, bulk_upload_kb,
+            user_detail_kb, bulk_action_kb, bulk_days_kb, stats_kb, preset_name_kb):
+    _kb()
@@ -0,0 +1,633 @@
+"""
+Нагрузочный прогон флоу создания пользователя — полностью офлайн.
+
+N админов параллельно проходят CreateUserFlow от /start до «✅ Создать» через
+настоящий Dispatcher из bot.py. Вместо Telegram — фейковая сессия Bot,
+вместо панели — локальный aiohttp-заглушка Remnawave с настраиваемой задержкой.
+
+    python loadtest.py --admins 50 --flows 4 --panel-latency 80
+    python loadtest.py --json report.json --max-p95 25     # в CI: код выхода 1 при регрессии
+    python loadtest.py --fail-rate 0.2 --stall-rate 0.05   # отказы панели: хвост ограничен deadline
+    python loadtest.py --import-time 5                     # холодный импорт bot.py, медиана 5 запусков
+    python loadtest.py --dispatch-bench 3000               # роутер колбэков против цепочки фильтров aiogram
+    python loadtest.py --keyboard-bench 5000               # клавиатуры: из кэша против сборки заново
+"""
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test for the create-user flow")
+    parser.add_argument("--admins", type=int, default=20, help="параллельных админов")
+    parser.add_argument("--flows", type=int, default=5, help="флоу на каждого админа")
+    parser.add_argument("--panel-latency", type=float, default=50, help="задержка заглушки панели, мс")
+    parser.add_argument("--tg-latency", type=float, default=0, help="задержка фейкового Bot API, мс")
+    parser.add_argument("--fail-rate", type=float, default=0, help="доля ответов панели 503")
+    parser.add_argument("--stall-rate", type=float, default=0, help="доля запросов, на которых панель зависает")
+    parser.add_argument("--stall", type=float, default=30, help="сколько висит зависший запрос, с")
+    parser.add_argument("--deadline", type=float, help="REMNAWAVE_DEADLINE для прогона, с")
+    parser.add_argument("--seed", type=int, default=1, help="seed для отказов")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="memory", help="FSM storage")
+    parser.add_argument("--rate-limit", action="store_true", help="включить лимитер исходящих запросов")
+    parser.add_argument("--no-tracemalloc", action="store_true", help="не считать пиковую память (быстрее)")
+    parser.add_argument("--json", metavar="PATH", help="сохранить отчёт в JSON")
+    parser.add_argument("--max-p95", type=float, metavar="MS", help="упасть, если p95 любого шага больше")
+    parser.add_argument("--import-time", type=int, metavar="RUNS", help="вместо прогона: замерить импорт bot.py")
+    parser.add_argument("--max-import", type=float, metavar="MS", help="упасть, если медиана импорта больше")
+    parser.add_argument("--dispatch-bench", type=int, metavar="N",
+                        help="вместо прогона: диспетчеризация колбэков, CallbackRouter против цепочки фильтров")
+    parser.add_argument("--keyboard-bench", type=int, metavar="N",
+                        help="вместо прогона: клавиатуры из кэша против сборки заново, N вызовов")
+    return parser.parse_args(argv)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))
+    return values[index]
+
+
+# =========================
+# Stub Remnawave panel
+# =========================
+
+def _now() -> str:
+    return datetime.datetime.now(tz=datetime.timezone.utc).isoformat()
+
+
+def _squads_payload(key: str, squads: list[tuple[str, str]], external: bool) -> dict:
+    items = []
+    for position, (name, squad_uuid) in enumerate(squads):
+        item = {"uuid": squad_uuid, "viewPosition": position, "name": name, "createdAt": _now(), "updatedAt": _now()}
+        if external:
+            item.update(info={"membersCount": 0}, templates=[])
+        items.append(item)
+    return {"response": {"total": len(items), key: items}}
+
+
+def _user_payload(body: dict, user_id: int) -> dict:
+    squads = [{"uuid": squad_uuid, "name": "squad"} for squad_uuid in body.get("activeInternalSquads") or []]
+    return {"response": {
+        "uuid": str(uuid.uuid4()),
+        "id": user_id,
+        "shortUuid": body.get("shortUuid") or "short",
+        "username": body["username"],
+        "status": "ACTIVE",
+        "trafficLimitBytes": body.get("trafficLimitBytes") or 0,
+        "trafficLimitStrategy": body.get("trafficLimitStrategy") or "NO_RESET",
+        "expireAt": body["expireAt"],
+        "telegramId": body.get("telegramId"),
+        "email": body.get("email"),
+        "description": body.get("description"),
+        "tag": body.get("tag"),
+        "hwidDeviceLimit": body.get("hwidDeviceLimit"),
+        "externalSquadUuid": body.get("externalSquadUuid"),
+        "trojanPassword": "x",
+        "vlessUuid": str(uuid.uuid4()),
+        "ssPassword": "x",
+        "createdAt": _now(),
+        "updatedAt": _now(),
+        "subscriptionUrl": f"https://sub.example/{body.get('shortUuid')}",
+        "activeInternalSquads": squads,
+        "userTraffic": {"usedTrafficBytes": 0, "lifetimeUsedTrafficBytes": 0},
+    }}
+
+
+class StubPanel:
+    """Заглушка панели. fail_rate запросов получают 503, stall_rate — висят stall секунд."""
+
+    def __init__(self, latency: float, fail_rate: float = 0, stall_rate: float = 0, stall: float = 30, seed: int = 1):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.stall_rate = stall_rate
+        self.stall = stall
+        self.random = random.Random(seed)
+        self.created = 0
+        self.requests = 0
+        self.failed = 0
+        self.stalled = 0
+
+    async def _delay(self):
+        """Задержка и отказы. Возвращает ответ-ошибку, если запрос надо «уронить»."""
+        from aiohttp import web
+
+        self.requests += 1
+        roll = self.random.random()
+        if roll < self.stall_rate:
+            self.stalled += 1
+            await asyncio.sleep(self.stall)
+        elif roll < self.stall_rate + self.fail_rate:
+            self.failed += 1
+            return web.json_response({"message": "Service Unavailable", "statusCode": 503}, status=503)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return None
+
+    async def create_user(self, request):
+        from aiohttp import web
+
+        body = await request.json()
+        if failure := await self._delay():
+            return failure
+        self.created += 1
+        return web.json_response(_user_payload(body, self.created), status=201)
+
+    async def internal_squads(self, request):
+        from aiohttp import web
+        from squads import SEED_INTERNAL_SQUADS
+
+        if failure := await self._delay():
+            return failure
+        return web.json_response(_squads_payload("internalSquads", SEED_INTERNAL_SQUADS, external=False))
+
+    async def external_squads(self, request):
+        from aiohttp import web
+        from squads import SEED_EXTERNAL_SQUADS
+
+        if failure := await self._delay():
+            return failure
+        return web.json_response(_squads_payload("externalSquads", SEED_EXTERNAL_SQUADS, external=True))
+
+    async def start(self, port: int):
+        from aiohttp import web
+
+        app = web.Application()
+        app.router.add_post("/api/users", self.create_user)
+        app.router.add_get("/api/internal-squads", self.internal_squads)
+        app.router.add_get("/api/external-squads", self.external_squads)
+        # Зависшие запросы на выходе не ждём
+        self._runner = web.AppRunner(app, access_log=None, shutdown_timeout=0.1)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+
+# =========================
+# Fake Telegram
+# =========================
+
+def make_fake_session(latency: float):
+    from aiogram.client.session.base import BaseSession
+    from aiogram.methods import EditMessageText, SendMessage
+    from aiogram.types import Chat, Message
+
+    class FakeSession(BaseSession):
+        """Отвечает на любые методы Bot API без сети, как успешный Telegram."""
+
+        def __init__(self):
+            super().__init__()
+            self.calls = 0
+
+        async def close(self):
+            pass
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def make_request(self, bot, method, timeout=None):
+            self.calls += 1
+            if latency:
+                await asyncio.sleep(latency)
+            if isinstance(method, (SendMessage, EditMessageText)):
+                return Message(
+                    message_id=getattr(method, "message_id", None) or 1,
+                    date=datetime.datetime.now(),
+                    chat=Chat(id=method.chat_id or 0, type="private"),
+                    text=method.text,
+                )
+            return True
+
+    return FakeSession()
+
+
+_update_ids = itertools.count(1)
+
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"admin{uid}"}
+
+
+def message_update(uid: int, text: str) -> dict:
+    update_id = next(_update_ids)
+    return {"update_id": update_id, "message": {
+        "message_id": update_id, "date": 0, "chat": {"id": uid, "type": "private"},
+        "from": _user(uid), "text": text,
+    }}
+
+
+def callback_update(uid: int, data: str, message_id: int = 1) -> dict:
+    update_id = next(_update_ids)
+    return {"update_id": update_id, "callback_query": {
+        "id": str(update_id), "from": _user(uid), "chat_instance": str(uid), "data": data,
+        "message": {"message_id": message_id, "date": 0, "chat": {"id": uid, "type": "private"}, "text": "…"},
+    }}
+
+
+def flow_script(uid: int) -> list[tuple[str, dict]]:
+    """Полный флоу: (шаг, апдейт). Шаг — состояние CreateUserFlow и нажатая кнопка/ввод."""
+    from squads import SEED_INTERNAL_SQUADS, build_squads
+
+    squad_key = next(iter(build_squads(SEED_INTERNAL_SQUADS)))
+    return [
+        ("start", message_update(uid, "/start")),
+        ("menu/start_create", callback_update(uid, "start_create")),
+        ("username/generate", callback_update(uid, "username_generate")),
+        ("expire_select/exp_1", callback_update(uid, "exp_1")),
+        ("expire_select/exp_1", callback_update(uid, "exp_1")),
+        ("expire_select/exp_next", callback_update(uid, "exp_next")),
+        ("email/skip", callback_update(uid, "skip")),
+        ("telegram_id/text", message_update(uid, str(uid))),
+        ("hwid_limit/text", message_update(uid, "3")),
+        ("tag/skip", callback_update(uid, "skip")),
+        ("description/text", message_update(uid, "loadtest")),
+        ("traffic_select/tr_50", callback_update(uid, "tr_50")),
+        ("traffic_select/tr_next", callback_update(uid, "tr_next")),
+        ("traffic_strategy/str_MONTH", callback_update(uid, "str_MONTH")),
+        ("internal_squads/toggle", callback_update(uid, f"int_{squad_key}")),
+        ("internal_squads/int_next", callback_update(uid, "int_next")),
+        ("external_squad/ext_skip", callback_update(uid, "ext_skip")),
+        ("confirm/confirm_create", callback_update(uid, "confirm_create")),
+    ]
+
+
+# =========================
+# Runner
+# =========================
+
+def admin_ids(count: int) -> list[int]:
+    return [1_000_000 + i for i in range(count)]
+
+
+async def run(args) -> dict:
+    from aiogram import Bot
+    from aiogram.methods import TelegramMethod
+    from aiogram.types import Update
+
+    from bot import create_dispatcher
+    from rate_limit import setup_rate_limiter
+    from remnawave_client import init_sdk, close_sdk
+    from squads import squad_catalog
+
+    panel = StubPanel(args.panel_latency / 1000, args.fail_rate, args.stall_rate, args.stall, args.seed)
+    await panel.start(args.panel_port)
+
+    session = make_fake_session(args.tg_latency / 1000)
+    bot = Bot(token="42:LOADTEST", session=session)
+    if args.rate_limit:
+        setup_rate_limiter(bot)
+    dp = create_dispatcher()
+    init_sdk()
+    await squad_catalog.refresh()
+
+    admins = admin_ids(args.admins)
+
+    latencies: dict[str, list[float]] = {}
+    errors: dict[str, int] = {}
+
+    async def feed(step: str, raw: dict):
+        update = Update.model_validate(raw, context={"bot": bot})
+        started = time.perf_counter()
+        try:
+            # Как в polling: метод, который вернул хендлер, отправляется отдельным запросом
+            result = await dp.feed_update(bot, update)
+            if isinstance(result, TelegramMethod):
+                await bot(result)
+        except Exception:
+            errors[step] = errors.get(step, 0) + 1
+        latencies.setdefault(step, []).append(time.perf_counter() - started)
+
+    async def admin(uid: int):
+        for _ in range(args.flows):
+            for step, raw in flow_script(uid):
+                await feed(step, raw)
+
+    if not args.no_tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(admin(uid) for uid in admins))
+    finally:
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1] if tracemalloc.is_tracing() else None
+        tracemalloc.stop()
+        await dp.storage.close()
+        await close_sdk()
+        await panel.stop()
+
+    total = sum(len(values) for values in latencies.values())
+    steps = {}
+    for step, values in latencies.items():
+        steps[step] = {
+            "count": len(values),
+            "errors": errors.get(step, 0),
+            "p50_ms": _percentile(values, 50) * 1000,
+            "p95_ms": _percentile(values, 95) * 1000,
+            "p99_ms": _percentile(values, 99) * 1000,
+        }
+
+    return {
+        "admins": args.admins,
+        "flows": args.flows,
+        "panel_latency_ms": args.panel_latency,
+        "tg_latency_ms": args.tg_latency,
+        "storage": args.storage,
+        "updates": total,
+        "seconds": elapsed,
+        "updates_per_second": total / elapsed,
+        "users_created": panel.created,
+        "panel_requests": panel.requests,
+        "panel_failed": panel.failed,
+        "panel_stalled": panel.stalled,
+        "bot_api_calls": session.calls,
+        "tracemalloc_peak_mb": peak / 1024**2 if peak is not None else None,
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "steps": steps,
+    }
+
+
+# Пакеты, которые bot.py не должен импортировать на старте — они грузятся в фоне или по требованию
+LAZY_PACKAGES = ("remnawave", "numpy", "pytz")
+
+
+def import_time(runs: int) -> dict:
+    """
+    Холодный импорт bot.py: каждый запуск — новый процесс с -X importtime.
+    Возвращает медиану и самые тяжёлые пакеты верхнего уровня последнего запуска.
+    """
+    totals, packages, loaded = [], {}, set()
+    env = {**os.environ, "PYTHONPATH": os.path.dirname(os.path.abspath(__file__))}
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import bot"],
+            capture_output=True, text=True, env=env, check=True,
+        )
+        packages = {}
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line.split("|")
+            if not cumulative.strip().isdigit():
+                continue
+            depth = (len(name) - len(name.lstrip())) // 2
+            name = name.strip()
+            loaded.add(name.split(".")[0])
+            if name == "bot":
+                totals.append(int(cumulative) / 1000)
+            elif depth == 1:
+                packages[name] = int(cumulative) / 1000
+    top = sorted(packages.items(), key=lambda item: -item[1])[:10]
+    return {
+        "runs": runs,
+        "median_ms": statistics.median(totals),
+        "min_ms": min(totals),
+        "top_ms": dict(top),
+        "eager_lazy_packages": [name for name in LAZY_PACKAGES if name in loaded],
+    }
+
+
+# =========================
+# Dispatch benchmark
+# =========================
+
+def filter_chain(dp, router):
+    """
+    «До» CallbackRouter: те же маршруты, но каждый — отдельным хендлером aiogram с
+    фильтрами F.data и StateFilter, в порядке приоритета router.resolve.
+    """
+    from aiogram import F
+    from aiogram.filters import StateFilter
+
+    dp.callback_query.handlers.clear()
+    for kind, state, key, handler in router.routes():
+        data_filter = F.data == key if kind == "action" else F.data.startswith(f"{key}_")
+        filters = (data_filter,) if state == "*" else (data_filter, StateFilter(state))
+        dp.callback_query.register(handler, *filters)
+    # Несовпавшие колбэки — как и роутер, просто гасим «часики»
+    dp.callback_query.register(lambda call: call.answer())
+
+
+async def dispatch_bench(args) -> dict:
+    """Медиана feed_update на колбэк: настоящий диспетчер, фейковая сессия, заглушка панели."""
+    from aiogram import Bot
+    from aiogram.fsm.storage.base import StorageKey
+    from aiogram.types import Update
+
+    from bot import create_callback_router, create_dispatcher
+    from remnawave_client import init_sdk, close_sdk
+    from squads import SEED_INTERNAL_SQUADS, build_squads, squad_catalog
+    from states import CreateUserFlow
+
+    panel = StubPanel(0)
+    await panel.start(args.panel_port)
+    bot = Bot(token="42:LOADTEST", session=make_fake_session(0))
+    init_sdk()
+    await squad_catalog.refresh()
+
+    uid = admin_ids(1)[0]
+    key = StorageKey(bot_id=bot.id, chat_id=uid, user_id=uid)
+    squad_key = next(iter(build_squads(SEED_INTERNAL_SQUADS)))
+    cases = (
+        ("unmatched", "zz_nothing", None),
+        ("int_<key> toggle", f"int_{squad_key}", CreateUserFlow.internal_squads),
+        ("ext_skip", "ext_skip", CreateUserFlow.external_squad),
+    )
+
+    results = {name: {} for name, _, _ in cases}
+    try:
+        for mode in ("filters", "router"):
+            dp = create_dispatcher()
+            if mode == "filters":
+                filter_chain(dp, create_callback_router())
+            for name, data, state in cases:
+                timings = []
+                for _ in range(args.dispatch_bench):
+                    # Состояние выставляем вне замера: ext_skip переводит флоу дальше
+                    await dp.storage.set_state(key, state)
+                    update = Update.model_validate(callback_update(uid, data), context={"bot": bot})
+                    started = time.perf_counter()
+                    await dp.feed_update(bot, update)
+                    timings.append(time.perf_counter() - started)
+                results[name][mode] = statistics.median(timings) * 1e6
+            await dp.storage.close()
+    finally:
+        await close_sdk()
+        await panel.stop()
+    return {"updates": args.dispatch_bench, "cases": results}
+
+
+def print_dispatch_report(report: dict):
+    print(f"callback dispatch, median of {report['updates']} updates\n")
+    print(f"{'callback':20} {'filters us':>11} {'router us':>10}")
+    for name, r in report["cases"].items():
+        print(f"{name:20} {r['filters']:>11.0f} {r['router']:>10.0f}")
+
+
+# =========================
+# Keyboard benchmark
+# =========================
+
+def keyboard_bench(calls: int) -> dict:
+    """Микросекунды на вызов: клавиатура из кэша против той же, собранной заново."""
+    import timeit
+
+    import keyboards
+    from presets import preset_store
+    from squads import SEED_EXTERNAL_SQUADS, SEED_INTERNAL_SQUADS, build_squads
+
+    internal = build_squads(SEED_INTERNAL_SQUADS)
+    external = build_squads(SEED_EXTERNAL_SQUADS)
+    selected = {next(iter(internal))}
+    # (название, из кэша, сборка заново); у @cache-функций сборка — __wrapped__
+    cases = [
+        (fn.__name__, fn, fn.__wrapped__)
+        for fn in (keyboards.expire_kb, keyboards.traffic_kb, keyboards.skip_input_kb, keyboards.confirm_kb)
+    ]
+    cases += [
+        ("main_menu_kb", keyboards.main_menu_kb, lambda: keyboards._build_main_menu_kb(preset_store.all())),
+        ("internal_squads_kb", lambda: keyboards.internal_squads_kb(internal, selected, 1),
+         lambda: keyboards._build_internal_squads_kb(internal, selected)),
+        ("external_squad_kb", lambda: keyboards.external_squad_kb(external, 1),
+         lambda: keyboards._build_external_squad_kb(external)),
+    ]
+
+    results = {}
+    for name, cached, build in cases:
+        cached()  # первый вызов кладёт клавиатуру в кэш
+        results[name] = {
+            "build_us": timeit.timeit(build, number=calls) / calls * 1e6,
+            "cached_us": timeit.timeit(cached, number=calls) / calls * 1e6,
+        }
+    return {"calls": calls, "keyboards": results}
+
+
+def print_keyboard_report(report: dict):
+    print(f"keyboards, {report['calls']} calls each\n")
+    print(f"{'keyboard':20} {'build us':>10} {'cached us':>10}")
+    for name, r in report["keyboards"].items():
+        print(f"{name:20} {r['build_us']:>10.1f} {r['cached_us']:>10.2f}")
+
+
+def print_import_report(report: dict):
+    print(f"import bot: median {report['median_ms']:.0f} ms, min {report['min_ms']:.0f} ms ({report['runs']} runs)\n")
+    for name, ms in report["top_ms"].items():
+        print(f"{name:32} {ms:>8.0f} ms")
+    if report["eager_lazy_packages"]:
+        print(f"\nimported at startup: {', '.join(report['eager_lazy_packages'])}")
+
+
+def print_report(report: dict):
+    print(
+        f"{report['admins']} admins x {report['flows']} flows, panel {report['panel_latency_ms']:.0f} ms, "
+        f"storage {report['storage']}"
+    )
+    print(
+        f"{report['updates']} updates in {report['seconds']:.2f}s -> {report['updates_per_second']:.0f} upd/s; "
+        f"users created: {report['users_created']}, Bot API calls: {report['bot_api_calls']}"
+    )
+    if report["panel_failed"] or report["panel_stalled"]:
+        print(f"panel: {report['panel_requests']} requests, {report['panel_failed']} answered 503, "
+              f"{report['panel_stalled']} stalled")
+    peak = report["tracemalloc_peak_mb"]
+    print(f"peak memory: {f'{peak:.1f} MB (tracemalloc), ' if peak is not None else ''}"
+          f"max RSS {report['max_rss_mb']:.1f} MB\n")
+
+    print(f"{'step':32} {'count':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for step, s in report["steps"].items():
+        print(f"{step:32} {s['count']:>6} {s['errors']:>4} {s['p50_ms']:>8.2f} {s['p95_ms']:>8.2f} {s['p99_ms']:>8.2f}")
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    args.panel_port = _free_port()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    workdir = tempfile.mkdtemp(prefix="adminbot-loadtest-")
+    # config.py читает окружение при импорте — выставляем до импорта бота
+    os.environ.update(
+        BOT_TOKEN="42:LOADTEST",
+        REMNAWAVE_BASE_URL=f"http://127.0.0.1:{args.panel_port}",
+        REMNAWAVE_TOKEN="loadtest",
+        EGAMES_COOKIE="loadtest",
+        BOT_MODE="polling",
+        FSM_STORAGE=args.storage,
+        FSM_SQLITE_PATH=os.path.join(workdir, "fsm.sqlite3"),
+        ADMIN_IDS=",".join(map(str, admin_ids(args.admins))),
+    )
+    if args.deadline is not None:
+        os.environ["REMNAWAVE_DEADLINE"] = str(args.deadline)
+    os.chdir(workdir)  # logs/ и data/ бота — во временную папку
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    if args.import_time:
+        report = import_time(args.import_time)
+        print_import_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        if report["eager_lazy_packages"]:
+            print("\nFAIL: lazy packages are imported at startup")
+            return 1
+        if args.max_import is not None and report["median_ms"] > args.max_import:
+            print(f"\nFAIL: import median > {args.max_import} ms")
+            return 1
+        return 0
+
+    from loguru import logger
+    logger.remove()
+
+    if args.dispatch_bench or args.keyboard_bench:
+        if args.dispatch_bench:
+            report = asyncio.run(dispatch_bench(args))
+            print_dispatch_report(report)
+        else:
+            report = keyboard_bench(args.keyboard_bench)
+            print_keyboard_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+        return 0
+
+    report = asyncio.run(run(args))
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    failed = [step for step, s in report["steps"].items() if s["errors"]]
+    if failed:
+        print(f"\nFAIL: errors in {', '.join(failed)}")
+        return 1
+    if args.max_p95 is not None:
+        slow = [step for step, s in report["steps"].items() if s["p95_ms"] > args.max_p95]
+        if slow:
+            print(f"\nFAIL: p95 > {args.max_p95} ms in {', '.join(slow)}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,240 @@
+import re
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable
+
+import httpx
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import TelegramType
+from aiohttp import web
+from loguru import logger
+
+from callback_router import CallbackRouter
+
+# Состояние FSM апдейта, который сейчас обрабатывается, — им помечаются и запросы к панели/Telegram.
+# Апдейт обрабатывается в своей задаче, так что значение не утекает в чужие апдейты.
+current_state: ContextVar[str] = ContextVar("current_state", default="none")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# =========================
+# Metric types
+# =========================
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, value: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [счётчики по бакетам (+Inf последним), сумма]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+        self._collectors: list[tuple[str, Callable[[], dict]]] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, prefix: str, fn: Callable[[], dict]):
+        """Числа, которые считаются где-то ещё (например, send_scheduler.stats()), — отдаём как gauge."""
+        self._collectors.append((prefix, fn))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for prefix, fn in self._collectors:
+            try:
+                values = fn()
+            except Exception as e:
+                logger.warning(f"Metrics collector {prefix} failed: {e}")
+                continue
+            for key, value in values.items():
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+handler_duration = registry.register(Histogram(
+    "bot_handler_duration_seconds", "Handler latency", ("handler", "state")))
+handler_errors = registry.register(Counter(
+    "bot_handler_errors_total", "Handler exceptions", ("handler", "state", "error")))
+remnawave_duration = registry.register(Histogram(
+    "remnawave_request_duration_seconds", "Remnawave panel API latency", ("method", "path", "status", "state")))
+telegram_duration = registry.register(Histogram(
+    "telegram_request_duration_seconds", "Bot API latency (without rate limiter queueing)",
+    ("method", "status", "state")))
+
+
+# =========================
+# Dispatcher middleware
+# =========================
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время и ошибки хендлеров. Для кнопок имя берётся из CallbackRouter, а не 'dispatch'."""
+
+    async def __call__(self, handler, event, data):
+        state = data.get("raw_state") or "none"
+        current_state.set(state)
+        name = _handler_name(data.get("handler"), state, event)
+
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            handler_errors.inc(name, state, type(e).__name__)
+            raise
+        finally:
+            handler_duration.observe(time.perf_counter() - started, name, state)
+
+
+def _handler_name(handler_object, state: str, event) -> str:
+    callback = getattr(handler_object, "callback", None)
+    if callback is None:
+        return "unknown"
+    router = getattr(callback, "__self__", None)
+    if isinstance(router, CallbackRouter):
+        resolved = router.resolve(None if state == "none" else state, getattr(event, "data", None) or "")
+        return resolved.__name__ if resolved else "unmatched"
+    return getattr(callback, "__name__", "unknown")
+
+
+# =========================
+# Remnawave (httpx transport)
+# =========================
+
+_UUID_RE = re.compile(r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}")
+
+
+def _normalize_path(path: str) -> str:
+    """/api/users/by-username/bob -> /api/users/by-username/{value}: метки не должны плодиться по id."""
+    path = _UUID_RE.sub("{uuid}", path)
+    parts = path.split("/")
+    for i in range(1, len(parts)):
+        if parts[i - 1].startswith("by-") or parts[i].isdigit():
+            parts[i] = "{value}"
+    return "/".join(parts)
+
+
+class MetricsTransport(httpx.AsyncBaseTransport):
+    """Обёртка над транспортом httpx — меряет каждый запрос SDK к панели."""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await self.transport.handle_async_request(request)
+            status = str(response.status_code)
+            return response
+        finally:
+            remnawave_duration.observe(
+                time.perf_counter() - started,
+                request.method, _normalize_path(request.url.path), status, current_state.get(),
+            )
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+# =========================
+# Bot API (session middleware)
+# =========================
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            telegram_duration.observe(
+                time.perf_counter() - started, type(method).__name__, status, current_state.get()
+            )
+
+
+# =========================
+# HTTP endpoint
+# =========================
+
+async def _metrics_view(request: web.Request) -> web.Response:
+    return web.Response(body=registry.render().encode(),
+                        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", _metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics: http://{host}:{port}/metrics")
+    return runner
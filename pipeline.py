@@ -0,0 +1,84 @@
+import asyncio
+from typing import Awaitable, Callable, Iterable, TypeVar
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+async def run_bounded(
+    items: Iterable[T],
+    worker: Callable[[T], Awaitable[R]],
+    concurrency: int,
+    on_done: Callable[[T, R | BaseException], None] | None = None,
+) -> list[R | BaseException]:
+    """
+    Прогоняет items через worker, держа в работе не больше concurrency вызовов.
+    Ошибка одного элемента не роняет остальные — исключение кладётся в результат.
+    Результаты возвращаются в порядке items.
+    """
+    items = list(items)
+    results: list[R | BaseException] = [None] * len(items)
+    queue = iter(enumerate(items))
+
+    async def loop():
+        # Общий итератор: каждый воркер забирает следующий свободный элемент
+        for index, item in queue:
+            try:
+                result = await worker(item)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                result = e
+            results[index] = result
+            if on_done:
+                on_done(item, result)
+
+    workers = max(1, min(concurrency, len(items)))
+    await asyncio.gather(*(loop() for _ in range(workers)))
+    return results
+
+
+class SingleFlight:
+    """
+    Одновременные вызовы с одним ключом выполняются один раз: первый запускает работу,
+    остальные подключаются к ней и получают тот же результат (или то же исключение).
+    linger — сколько секунд после успеха к результату ещё можно подключиться
+    (второе нажатие той же кнопки, пришедшее чуть позже первого).
+    """
+
+    def __init__(self, linger: float = 0):
+        self.linger = linger
+        self._inflight: dict[object, asyncio.Task] = {}
+
+    def in_flight(self, key) -> bool:
+        return key in self._inflight
+
+    def _forget(self, key, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def _done(self, key, task: asyncio.Task):
+        if self.linger and not task.cancelled() and task.exception() is None:
+            asyncio.get_running_loop().call_later(self.linger, self._forget, key, task)
+        else:
+            # Ошибку держать незачем: повтор должен уйти новым вызовом
+            self._forget(key, task)
+
+    def start(self, key, fn: Callable[[], Awaitable[R]]) -> tuple[asyncio.Task, bool]:
+        """
+        Без await: задача регистрируется сразу, до первого переключения event loop.
+        Возвращает (задача, shared).
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            return task, True
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda _: self._done(key, task))
+        return task, False
+
+    async def do(self, key, fn: Callable[[], Awaitable[R]]) -> tuple[R, bool]:
+        """Возвращает (результат, shared): shared=True, если подключились к чужому вызову."""
+        task, shared = self.start(key, fn)
+        # shield: отмена одного ожидающего не должна отменять работу для остальных
+        return await asyncio.shield(task), shared
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import math
+import os
+import secrets
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta, timezone
+
+from loguru import logger
+
+from config import PRESETS_PATH
+
+# Пресеты — кнопками в главном меню, больше не влезает
+MAX_PRESETS = 8
+MAX_NAME_LENGTH = 32
+# Как часто проверять mtime файла: под супервизором его может поменять другой воркер
+RELOAD_INTERVAL = 5
+
+
+@dataclass(frozen=True)
+class Preset:
+    """Повторяющаяся часть создания: всё, кроме username, email и Telegram ID."""
+    name: str
+    expire_days: int
+    traffic_limit_bytes: int  # 0 — безлимит
+    traffic_limit_strategy: str
+    active_internal_squads: tuple[str, ...] = ()  # UUID, а не ключи каталога — ключи меняются
+    external_squad_uuid: str | None = None
+    hwid_device_limit: int = 2
+    tag: str | None = None
+    description: str | None = None
+
+    @classmethod
+    def from_flow(cls, name: str, data: dict) -> "Preset":
+        """Из данных флоу на экране подтверждения — пошагового или уже по пресету."""
+        left = data["expire_at"] - datetime.now(tz=timezone.utc)
+        strategy = data.get("traffic_limit_strategy") or "MONTH"
+        return cls(
+            name=name,
+            expire_days=max(1, math.ceil(left.total_seconds() / 86400)),
+            traffic_limit_bytes=data.get("traffic_limit_bytes") or 0,
+            traffic_limit_strategy=getattr(strategy, "value", strategy),
+            active_internal_squads=tuple(data.get("active_internal_squads", [])),
+            external_squad_uuid=data.get("external_squad_uuid"),
+            hwid_device_limit=data.get("hwid_device_limit", 2),
+            tag=data.get("tag"),
+            description=data.get("description"),
+        )
+
+    def flow_data(self) -> dict:
+        """Данные флоу — такие же, как после последнего шага мастера."""
+        return {
+            "expire_at": datetime.now(tz=timezone.utc) + timedelta(days=self.expire_days),
+            "traffic_limit_bytes": self.traffic_limit_bytes,
+            "traffic_limit_strategy": self.traffic_limit_strategy,
+            "active_internal_squads": list(self.active_internal_squads),
+            "external_squad_uuid": self.external_squad_uuid,
+            "hwid_device_limit": self.hwid_device_limit,
+            "tag": self.tag,
+            "description": self.description,
+            "email": None,
+            "telegram_id": None,
+        }
+
+
+class PresetStore:
+    """
+    Пресеты в JSON-файле. Читаются из памяти; раз в reload_interval проверяется mtime
+    файла — так изменения, сделанные другим процессом, подхватываются без рестарта.
+    version растёт при каждом изменении списка — по ней кэшируется главное меню.
+    """
+
+    def __init__(self, path: str, reload_interval: float):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.version = 0
+        self._presets: dict[str, Preset] = {}
+        self._mtime: float | None = None
+        self._checked = -math.inf
+
+    def _stat(self) -> float | None:
+        try:
+            return os.stat(self.path).st_mtime
+        except OSError:
+            return None
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked < self.reload_interval:
+            return
+        self._checked = now
+
+        mtime = self._stat()
+        if mtime == self._mtime:
+            return
+        self._mtime = mtime
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                raw = json.load(f)
+            presets = {
+                key: Preset(**{**fields, "active_internal_squads": tuple(fields.get("active_internal_squads", ()))})
+                for key, fields in raw.items()
+            }
+        except FileNotFoundError:
+            presets = {}
+        except (OSError, ValueError, TypeError) as e:
+            logger.error(f"Presets file {self.path} is invalid, keeping the current list: {e}")
+            return
+        if presets != self._presets:
+            self._presets = presets
+            self.version += 1
+
+    def _write(self, presets: dict[str, Preset]):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({key: asdict(preset) for key, preset in presets.items()}, f, ensure_ascii=False, indent=2)
+        os.replace(tmp, self.path)
+
+    async def _commit(self, presets: dict[str, Preset]):
+        await asyncio.to_thread(self._write, presets)
+        self._presets = presets
+        self._mtime = self._stat()
+        self.version += 1
+
+    def all(self) -> dict[str, Preset]:
+        self._maybe_reload()
+        return self._presets
+
+    def get(self, key: str) -> Preset | None:
+        return self.all().get(key)
+
+    async def save(self, preset: Preset) -> str:
+        """Пресет с тем же именем перезаписывается. Возвращает ключ для callback_data."""
+        presets = dict(self.all())
+        key = next((key for key, old in presets.items() if old.name == preset.name), None)
+        if key is None:
+            if len(presets) >= MAX_PRESETS:
+                raise ValueError(f"пресетов уже {MAX_PRESETS}, удали ненужный в /presets")
+            key = secrets.token_hex(3)
+        presets[key] = preset
+        await self._commit(presets)
+        logger.info(f"Preset saved: {preset.name} ({key})")
+        return key
+
+    async def delete(self, key: str) -> Preset | None:
+        presets = dict(self.all())
+        preset = presets.pop(key, None)
+        if preset is not None:
+            await self._commit(presets)
+            logger.info(f"Preset deleted: {preset.name} ({key})")
+        return preset
+
+
+preset_store = PresetStore(PRESETS_PATH, RELOAD_INTERVAL)
@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import (
+    AnswerCallbackQuery,
+    EditMessageReplyMarkup,
+    EditMessageText,
+    TelegramMethod,
+)
+from aiogram.methods.base import TelegramType
+from loguru import logger
+
+from config import TG_GLOBAL_RATE, TG_CHAT_RATE, TG_CHAT_BURST, TG_GROUP_RATE, TG_MAX_RETRIES
+from utils import LRUCache
+
+# Меньше — раньше. Ответы на нажатия важнее всего: иначе у админа крутятся «часики»
+PRIORITY_CALLBACK_ANSWER = 0
+PRIORITY_EDIT = 1
+PRIORITY_DEFAULT = 2
+
+PRIORITIES = {
+    AnswerCallbackQuery: PRIORITY_CALLBACK_ANSWER,
+    EditMessageText: PRIORITY_EDIT,
+    EditMessageReplyMarkup: PRIORITY_EDIT,
+}
+
+
+class TokenBucket:
+    """Бакет с резервированием: токены могут уйти в минус, reserve() возвращает, сколько ждать."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def wait_time(self) -> float:
+        now = time.monotonic()
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """После 429: ничего не выдаём ближайшие seconds секунд."""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class SendScheduler:
+    """
+    Очередь исходящих запросов к Bot API.
+
+    Сначала запрос ждёт своей очереди в бакете чата (1 msg/s в личке, ~20/мин в группах),
+    потом — общий бакет бота (~30/s). Общий бакет раздаёт токены по приоритету.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float, group_rate: float):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = LRUCache(10000)
+        self._queue: list = []
+        self._seq = itertools.count()
+        self._pump: asyncio.Task | None = None
+
+        self.waiting = 0
+        self.requests = 0
+        self.delayed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.retry_after = 0
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # У групп и каналов id отрицательные, лимит у них строже
+            rate = self.chat_rate if chat_id > 0 else self.group_rate
+            bucket = TokenBucket(rate, self.chat_burst)
+            self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def acquire(self, chat_id: int | None, priority: int):
+        started = time.monotonic()
+        self.requests += 1
+        self.waiting += 1
+        try:
+            if chat_id is not None:
+                delay = self._chat_bucket(chat_id).reserve()
+                if delay:
+                    await asyncio.sleep(delay)
+
+            if not self._queue and self._global.wait_time() == 0:
+                self._global.take()
+            else:
+                future = asyncio.get_running_loop().create_future()
+                heapq.heappush(self._queue, (priority, next(self._seq), future))
+                if self._pump is None or self._pump.done():
+                    self._pump = asyncio.create_task(self._run_pump())
+                await future
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - started
+        if waited > 0.001:
+            self.delayed += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+    async def _run_pump(self):
+        while self._queue:
+            delay = self._global.wait_time()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            _, _, future = heapq.heappop(self._queue)
+            if not future.done():
+                self._global.take()
+                future.set_result(None)
+
+    def penalize(self, chat_id: int | None, seconds: float):
+        self.retry_after += 1
+        if chat_id is not None:
+            self._chat_bucket(chat_id).block(seconds)
+        else:
+            self._global.block(seconds)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.waiting,
+            "requests": self.requests,
+            "delayed": self.delayed,
+            "wait_seconds_total": round(self.wait_total, 3),
+            "wait_seconds_max": round(self.wait_max, 3),
+            "retry_after": self.retry_after,
+        }
+
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Пропускает запросы к Bot API через SendScheduler и сам переживает 429 (retry_after)."""
+
+    def __init__(self, scheduler: SendScheduler, max_retries: int = 3):
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ):
+        chat_id = getattr(method, "chat_id", None)
+        priority = PRIORITIES.get(type(method), PRIORITY_DEFAULT)
+
+        # getUpdates, getFile, setWebhook и т.п. лимитами на сообщения не покрываются
+        if chat_id is None and priority != PRIORITY_CALLBACK_ANSWER:
+            return await make_request(bot, method)
+        if not isinstance(chat_id, int):
+            chat_id = None  # @username канала — считаем только в общем бакете
+
+        for attempt in range(self.max_retries + 1):
+            await self.scheduler.acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logger.warning(f"Flood control on {type(method).__name__} (chat {chat_id}): retry in {e.retry_after}s")
+                self.scheduler.penalize(chat_id, e.retry_after)
+
+
+send_scheduler = SendScheduler(
+    global_rate=TG_GLOBAL_RATE,
+    chat_rate=TG_CHAT_RATE,
+    chat_burst=TG_CHAT_BURST,
+    group_rate=TG_GROUP_RATE,
+)
+
+
+def setup_rate_limiter(bot: Bot):
+    bot.session.middleware(RateLimitMiddleware(send_scheduler, max_retries=TG_MAX_RETRIES))
@@ -1,12 +1,123 @@
-from remnawave import RemnawaveSDK
-from config import REMNAWAVE_BASE_URL, REMNAWAVE_TOKEN, EGAMES_COOKIE
+import importlib
 
+import httpx
+from config import (
+    REMNAWAVE_BASE_URL,
+    REMNAWAVE_TOKEN,
+    EGAMES_COOKIE,
+    REMNAWAVE_POOL_SIZE,
+    REMNAWAVE_KEEPALIVE,
+    REMNAWAVE_KEEPALIVE_EXPIRY,
+    REMNAWAVE_TIMEOUT,
+    REMNAWAVE_CONNECT_TIMEOUT,
+    REMNAWAVE_DEADLINE,
+    REMNAWAVE_RETRIES,
+    REMNAWAVE_BACKOFF_BASE,
+    REMNAWAVE_BACKOFF_MAX,
+    REMNAWAVE_BREAKER_FAILURES,
+    REMNAWAVE_BREAKER_COOLDOWN,
+)
+from metrics import MetricsTransport
+from resilience import CircuitBreaker, ResilientTransport
 
-def get_sdk() -> RemnawaveSDK:
-    return RemnawaveSDK(
-        base_url=REMNAWAVE_BASE_URL,
-        token=REMNAWAVE_TOKEN,
-        custom_headers={
-            "Cookie": EGAMES_COOKIE
-        }
+# Пакет remnawave при импорте строит все pydantic-модели панели — ~1.3 с, а на старте
+# они не нужны. Модули бота берут имена SDK отсюда (panel.ApiError, panel.UserStatus),
+# и пакет загружается при первом обращении — обычно это фоновый прогрев после старта
+_LAZY_NAMES = {
+    "RemnawaveSDK": "remnawave",
+    "ApiError": "remnawave.exceptions",
+    "NotFoundError": "remnawave.exceptions",
+    "TrafficLimitStrategy": "remnawave.enums",
+    "UserStatus": "remnawave.enums",
+    "CreateUserRequestDto": "remnawave.models",
+    "BulkExtendExpirationDateRequestDto": "remnawave.models",
+    "BulkResetTrafficUsersRequestDto": "remnawave.models",
+    "BulkUpdateUsersRequestDto": "remnawave.models",
+    "BulkUpdateUsersSquadsRequestDto": "remnawave.models",
+    "UpdateUserFields": "remnawave.models",
+}
+
+
+def __getattr__(name: str):
+    module = _LAZY_NAMES.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def warm_up():
+    """Импорт пакета SDK заранее (в потоке), чтобы первый запрос админа его не ждал."""
+    importlib.import_module("remnawave")
+
+
+# Общий на процесс: если панель лежит, это видно всем хендлерам сразу
+panel_breaker = CircuitBreaker(REMNAWAVE_BREAKER_FAILURES, REMNAWAVE_BREAKER_COOLDOWN)
+
+# Один SDK (и один пул соединений) на весь процесс
+_sdk: "RemnawaveSDK | None" = None
+_client: httpx.AsyncClient | None = None
+
+
+def _build_client() -> httpx.AsyncClient:
+    base_url = REMNAWAVE_BASE_URL.rstrip("/")
+    if not base_url.endswith("/api"):
+        base_url += "/api"
+
+    token = REMNAWAVE_TOKEN if REMNAWAVE_TOKEN.startswith("Bearer ") else f"Bearer {REMNAWAVE_TOKEN}"
+    headers = {
+        "Authorization": token,
+        "Cookie": EGAMES_COOKIE,
+    }
+    # То же, что делает сам SDK для панели за reverse proxy без TLS
+    if base_url.startswith("http://"):
+        headers["x-forwarded-proto"] = "https"
+        headers["x-forwarded-for"] = "127.0.0.1"
+
+    # Свой транспорт — чтобы замерять каждый запрос; лимиты пула задаются на нём же
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=REMNAWAVE_POOL_SIZE,
+            max_keepalive_connections=REMNAWAVE_KEEPALIVE,
+            keepalive_expiry=REMNAWAVE_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        # Снаружи — повторы и breaker, внутри — метрики каждой попытки
+        transport=ResilientTransport(
+            MetricsTransport(transport),
+            breaker=panel_breaker,
+            deadline=REMNAWAVE_DEADLINE,
+            retries=REMNAWAVE_RETRIES,
+            backoff_base=REMNAWAVE_BACKOFF_BASE,
+            backoff_max=REMNAWAVE_BACKOFF_MAX,
+        ),
+        timeout=httpx.Timeout(REMNAWAVE_TIMEOUT, connect=REMNAWAVE_CONNECT_TIMEOUT),
     )
+
+
+def init_sdk() -> "RemnawaveSDK":
+    """Создаёт общий SDK с keep-alive пулом. Вызывается один раз при старте бота."""
+    global _sdk, _client
+    if _sdk is None:
+        from remnawave import RemnawaveSDK
+
+        _client = _build_client()
+        _sdk = RemnawaveSDK(client=_client)
+    return _sdk
+
+
+def get_sdk() -> "RemnawaveSDK":
+    return _sdk or init_sdk()
+
+
+async def close_sdk():
+    global _sdk, _client
+    if _client is not None:
+        await _client.aclose()
+    _sdk = None
+    _client = None
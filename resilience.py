@@ -0,0 +1,172 @@
+import asyncio
+import random
+import time
+
+import httpx
+from loguru import logger
+
+from metrics import Counter, registry
+
+# Эти методы можно безопасно повторить: повтор не создаст второй объект на панели
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Запрос гарантированно не дошёл до панели — повторять можно даже POST
+NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+RETRY_STATUSES = {429, 502, 503, 504}
+
+panel_retries = registry.register(Counter(
+    "remnawave_retries_total", "Retried panel requests", ("reason",)))
+panel_rejected = registry.register(Counter(
+    "remnawave_circuit_rejected_total", "Panel requests rejected by the open circuit breaker"))
+
+
+class PanelUnavailable(Exception):
+    """Панель недавно не отвечала — запрос даже не отправлялся (circuit breaker открыт)."""
+
+
+class CircuitBreaker:
+    """
+    После failures подряд ошибок (сеть, таймаут, 5xx) перестаём ходить в панель на cooldown секунд.
+    Потом пропускаем один пробный запрос: успех закрывает breaker, ошибка — снова открывает.
+    """
+
+    def __init__(self, failures: int, cooldown: float):
+        self.threshold = failures
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: float | None = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self._probing else "open"
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if not self._probing and time.monotonic() - self.opened_at >= self.cooldown:
+            self._probing = True
+            return True
+        return False
+
+    def success(self):
+        if self.opened_at is not None:
+            logger.info("Panel is back, circuit breaker closed")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def failure(self):
+        self.failures += 1
+        if self._probing or (self.opened_at is None and self.failures >= self.threshold):
+            if not self._probing:
+                logger.warning(f"Panel failed {self.failures} times in a row, circuit breaker opened")
+            self.opened_at = time.monotonic()
+        self._probing = False
+
+    def abandon(self):
+        """Пробный запрос отменили, не дождавшись ответа — пусть следующий попробует снова."""
+        self._probing = False
+
+    def stats(self) -> dict:
+        return {"open": int(self.opened_at is not None), "consecutive_failures": self.failures}
+
+
+def _retry_after(response: httpx.Response) -> float | None:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+class ResilientTransport(httpx.AsyncBaseTransport):
+    """
+    Обёртка над транспортом httpx для всех запросов SDK к панели:
+      - deadline на весь вызов вместе с повторами;
+      - повторы с full jitter backoff — только там, где повтор ничего не сломает;
+      - circuit breaker: пока панель лежит, сразу отвечаем PanelUnavailable.
+    """
+
+    def __init__(
+        self,
+        transport: httpx.AsyncBaseTransport,
+        breaker: CircuitBreaker,
+        deadline: float,
+        retries: int,
+        backoff_base: float,
+        backoff_max: float,
+    ):
+        self.transport = transport
+        self.breaker = breaker
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _attempt(self, request: httpx.Request, timeout: float) -> httpx.Response:
+        if not self.breaker.allow():
+            panel_rejected.inc()
+            raise PanelUnavailable("Панель не отвечает, повтори чуть позже")
+
+        try:
+            response = await asyncio.wait_for(self.transport.handle_async_request(request), timeout)
+        except (httpx.TransportError, asyncio.TimeoutError):
+            self.breaker.failure()
+            raise
+        except BaseException:
+            # Запрос отменили снаружи — панель тут ни при чём
+            self.breaker.abandon()
+            raise
+
+        if response.status_code >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+        return response
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        idempotent = request.method in IDEMPOTENT_METHODS
+        deadline = time.monotonic() + self.deadline
+        attempt = 0
+
+        while True:
+            response = error = None
+            try:
+                response = await self._attempt(request, max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError as e:
+                # POST мог дойти до панели — такой повторять нельзя
+                error = httpx.ReadTimeout(f"Panel deadline {self.deadline:.0f}s exceeded", request=request)
+                error.__cause__ = e
+                retryable, reason = idempotent, "timeout"
+            except httpx.TransportError as e:
+                error = e
+                retryable = idempotent or isinstance(e, NOT_SENT_ERRORS)
+                reason = type(e).__name__
+            else:
+                status = response.status_code
+                if status not in RETRY_STATUSES:
+                    return response
+                # 429 панель отклонила до обработки — повторять можно любой метод
+                retryable, reason = idempotent or status == 429, str(status)
+
+            delay = self._backoff(attempt)
+            if response is not None:
+                delay = max(delay, _retry_after(response) or 0)
+            if not retryable or attempt >= self.retries or time.monotonic() + delay >= deadline:
+                if response is not None:
+                    return response
+                raise error
+
+            if response is not None:
+                await response.aclose()
+            panel_retries.inc(reason)
+            logger.warning(f"Panel {request.method} {request.url.path}: {reason}, retry {attempt + 1} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
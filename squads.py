@@ -0,0 +1,117 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+
+from loguru import logger
+
+from config import SQUADS_TTL, SQUADS_RETRY_INTERVAL
+from remnawave_client import get_sdk
+
+# =========================
+# Сквады по умолчанию
+# =========================
+
+# Используются, пока каталог ещё ни разу не загрузился с панели
+SEED_INTERNAL_SQUADS = [
+    ("ПРОМО-1", "6ee7a7cd-cfe0-49f1-9e6d-898ad2c61cb2"),
+    ("ПРОМО-2", "28c99966-6bd1-4eed-97c1-a230f31b015b"),
+    ("СВОИ", "ec4dc856-dc75-474f-b2cb-e0e95fc76626"),
+]
+
+SEED_EXTERNAL_SQUADS = [
+    ("Both", "77357f14-dd4e-4921-95e4-708fb56eaa02"),
+    ("Whitelist", "3ed64469-d522-4ae2-87d6-4e0a562f357c"),
+]
+
+
+def squad_key(uuid: str, taken: dict) -> str:
+    """
+    Короткий стабильный ключ для callback_data: начало UUID без дефисов.
+    Не зависит от порядка и названий, так что выбор в FSM переживает обновление каталога.
+    """
+    hex_uuid = str(uuid).replace("-", "")
+    for length in (8, 12, 32):
+        key = hex_uuid[:length]
+        if key not in taken or taken[key][1] == str(uuid):
+            return key
+    return hex_uuid
+
+
+def build_squads(items) -> dict:
+    """[(name, uuid), ...] -> {key: (name, uuid)} — формат, который ждут клавиатуры."""
+    squads = {}
+    for name, uuid in items:
+        squads[squad_key(uuid, squads)] = (name, str(uuid))
+    return squads
+
+
+@dataclass(frozen=True)
+class SquadCatalog:
+    version: int
+    internal: dict = field(default_factory=dict)
+    external: dict = field(default_factory=dict)
+
+
+class SquadCatalogCache:
+    """
+    Каталог сквадов в памяти с TTL.
+
+    get() никогда не ходит в сеть: отдаёт текущий снимок и, если он устарел,
+    запускает обновление в фоне (stale-while-revalidate). Если панель недоступна,
+    продолжаем отдавать последний успешно загруженный каталог.
+    """
+
+    def __init__(self, ttl: float, retry_interval: float):
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self._catalog = SquadCatalog(
+            version=0,
+            internal=build_squads(SEED_INTERNAL_SQUADS),
+            external=build_squads(SEED_EXTERNAL_SQUADS),
+        )
+        self._next_refresh = 0.0
+        self._task: asyncio.Task | None = None
+
+    def get(self) -> SquadCatalog:
+        if time.monotonic() >= self._next_refresh and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.refresh())
+        return self._catalog
+
+    async def refresh(self):
+        try:
+            sdk = get_sdk()
+            internal_resp, external_resp = await asyncio.gather(
+                sdk.internal_squads.get_internal_squads(),
+                sdk.external_squads.get_external_squads(),
+            )
+        except Exception as e:
+            self._next_refresh = time.monotonic() + self.retry_interval
+            logger.warning(f"Squad catalog refresh failed, serving last known: {e}")
+            return
+
+        internal = build_squads(
+            (s.name, s.uuid) for s in sorted(internal_resp.internal_squads, key=lambda s: s.view_position)
+        )
+        external = build_squads(
+            (s.name, s.uuid) for s in sorted(external_resp.external_squads, key=lambda s: s.view_position)
+        )
+        # Версию меняем только при реальных изменениях — кэш клавиатур остаётся тёплым
+        if internal != self._catalog.internal or external != self._catalog.external:
+            self._catalog = SquadCatalog(self._catalog.version + 1, internal, external)
+            logger.info(f"Squad catalog updated: {len(internal)} internal, {len(external)} external")
+        self._next_refresh = time.monotonic() + self.ttl
+
+    def start(self):
+        """Первая загрузка при старте — в фоне, старт бота её не ждёт."""
+        self.get()
+
+    async def stop(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+squad_catalog = SquadCatalogCache(ttl=SQUADS_TTL, retry_interval=SQUADS_RETRY_INTERVAL)
@@ -22,3 +22,16 @@ class CreateUserFlow(StatesGroup):
     external_squad = State()
 
     confirm = State()
+    preset_name = State()
+
+
+class BulkCreateFlow(StatesGroup):
+    upload = State()
+    confirm = State()
+
+
+class BulkActionFlow(StatesGroup):
+    action = State()
+    days = State()
+    squads = State()
+    confirm = State()
@@ -0,0 +1,152 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+from loguru import logger
+
+from config import STATS_PAGE_SIZE, STATS_TOP_N, STATS_TTL
+from pipeline import SingleFlight
+from remnawave_client import get_sdk
+
+# Окна «истекает в ближайшие N дней»
+EXPIRE_WINDOWS = (1, 7, 30)
+
+
+def _numpy():
+    # Ленивый импорт: numpy нужен только /stats и грузится ~0.1 с — не на старте бота
+    try:
+        import numpy
+    except ImportError as e:
+        raise RuntimeError("/stats requires the 'numpy' package") from e
+    return numpy
+
+
+@dataclass(frozen=True)
+class StatsReport:
+    total: int
+    by_status: dict[str, int]
+    by_strategy: dict[str, int]
+    by_squad: dict[str, int]  # uuid внутреннего сквада -> пользователей
+    no_squad: int
+    expiring: dict[int, int]  # дней -> пользователей, истекающих в этом окне
+    top_traffic: tuple[tuple[str, int], ...]  # (username, used_traffic_bytes)
+    used_traffic_bytes: int
+    computed_at: float
+    seconds: float
+
+
+class Columns:
+    """
+    Пользователи из стрима, разложенные по колонкам. Каждая страница — свой кусок
+    массивов; склеиваются они один раз в report(). Строковые значения (статус,
+    стратегия, сквад) хранятся кодами — тогда распределения считает np.bincount.
+    Методы блокирующие, вызываются через asyncio.to_thread.
+    """
+
+    def __init__(self):
+        self.np = _numpy()
+        self.codes: dict[str, dict[str, int]] = {"status": {}, "strategy": {}, "squad": {}}
+        self.status, self.strategy, self.used, self.expire = [], [], [], []
+        self.squads, self.squad_counts = [], []
+        # Имена нужны только для топа по трафику — обычный список, индекс совпадает с колонками
+        self.usernames: list[str] = []
+
+    def _code(self, kind: str, value) -> int:
+        codes = self.codes[kind]
+        return codes.setdefault(str(value), len(codes))
+
+    def add(self, users: list):
+        np, n = self.np, len(users)
+        self.status.append(np.fromiter((self._code("status", u.status) for u in users), np.int16, n))
+        self.strategy.append(np.fromiter((self._code("strategy", u.traffic_limit_strategy) for u in users), np.int16, n))
+        self.used.append(np.fromiter((int(u.used_traffic_bytes or 0) for u in users), np.int64, n))
+        self.expire.append(np.fromiter((u.expire_at.timestamp() if u.expire_at else 0 for u in users), np.float64, n))
+        self.squad_counts.append(np.fromiter((len(u.active_internal_squads) for u in users), np.int16, n))
+        self.squads.append(np.fromiter(
+            (self._code("squad", s.uuid) for u in users for s in u.active_internal_squads), np.int32
+        ))
+        self.usernames.extend(u.username for u in users)
+
+    def _column(self, parts: list, dtype):
+        return self.np.concatenate(parts) if parts else self.np.empty(0, dtype)
+
+    def _distribution(self, kind: str, column) -> dict[str, int]:
+        counts = self.np.bincount(column, minlength=len(self.codes[kind])).tolist()
+        return {value: counts[code] for value, code in self.codes[kind].items()}
+
+    def report(self, now: float, top_n: int, started: float) -> StatsReport:
+        np = self.np
+        status = self._column(self.status, np.int16)
+        used = self._column(self.used, np.int64)
+        expire = self._column(self.expire, np.float64)
+
+        # Топ без полной сортировки: argpartition отбирает top_n, сортируем только их
+        k = min(top_n, len(used))
+        top = np.argpartition(used, len(used) - k)[len(used) - k:] if k else np.empty(0, np.int64)
+        top = top[np.argsort(used[top])[::-1]]
+
+        return StatsReport(
+            total=len(status),
+            by_status=self._distribution("status", status),
+            by_strategy=self._distribution("strategy", self._column(self.strategy, np.int16)),
+            by_squad=self._distribution("squad", self._column(self.squads, np.int32)),
+            no_squad=int(np.count_nonzero(self._column(self.squad_counts, np.int16) == 0)),
+            expiring={
+                days: int(np.count_nonzero((expire > now) & (expire <= now + days * 86400)))
+                for days in EXPIRE_WINDOWS
+            },
+            top_traffic=tuple((self.usernames[i], int(used[i])) for i in top.tolist() if used[i] > 0),
+            used_traffic_bytes=int(used.sum()),
+            computed_at=now,
+            seconds=time.monotonic() - started,
+        )
+
+
+class UserStats:
+    """
+    Отчёт /stats: один проход по get_users_stream, агрегация — в потоке.
+    Готовый отчёт живёт ttl секунд; одновременные запросы ждут один и тот же подсчёт.
+    """
+
+    def __init__(self, ttl: float, page_size: int, top_n: int):
+        self.ttl = ttl
+        self.page_size = page_size
+        self.top_n = top_n
+        self._report: StatsReport | None = None
+        self._computing = SingleFlight()
+
+    def cached(self) -> StatsReport | None:
+        report = self._report
+        if report is not None and time.time() - report.computed_at < self.ttl:
+            return report
+        return None
+
+    @property
+    def computing(self) -> bool:
+        return self._computing.in_flight("stats")
+
+    async def get(self, force: bool = False) -> StatsReport:
+        report = None if force else self.cached()
+        if report is None:
+            report, _ = await self._computing.do("stats", self._compute)
+        return report
+
+    async def _compute(self) -> StatsReport:
+        started = time.monotonic()
+        sdk = get_sdk()
+        columns = await asyncio.to_thread(Columns)
+        cursor = None
+        while True:
+            page = await sdk.users.get_users_stream(size=self.page_size, cursor=cursor)
+            await asyncio.to_thread(columns.add, page.users)
+            if not page.has_more or not page.next_cursor:
+                break
+            cursor = page.next_cursor
+
+        report = await asyncio.to_thread(columns.report, time.time(), self.top_n, started)
+        self._report = report
+        logger.info(f"User stats computed: {report.total} users in {report.seconds:.1f}s")
+        return report
+
+
+user_stats = UserStats(STATS_TTL, STATS_PAGE_SIZE, STATS_TOP_N)
@@ -0,0 +1,295 @@
+import asyncio
+import json
+import os
+import sqlite3
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from typing import Any, Mapping
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from loguru import logger
+
+from config import FSM_STORAGE, FSM_SQLITE_PATH, FSM_REDIS_URL, FSM_FLUSH_INTERVAL, FSM_CACHE_SIZE
+
+# Запись FSM: (state, data). None вместо записи — удалить ключ
+Record = tuple[str | None, dict[str, Any]]
+
+
+# =========================
+# Serialization
+# =========================
+
+def _default(value: Any):
+    # В данных флоу лежит expire_at (datetime) — JSON сам его не умеет
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, date):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _object_hook(obj: dict):
+    if len(obj) == 1:
+        if "__datetime__" in obj:
+            return datetime.fromisoformat(obj["__datetime__"])
+        if "__date__" in obj:
+            return date.fromisoformat(obj["__date__"])
+    return obj
+
+
+def dumps(data: dict) -> str:
+    return json.dumps(data, default=_default, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(raw: str | bytes) -> dict:
+    return json.loads(raw, object_hook=_object_hook)
+
+
+# =========================
+# Backends
+# =========================
+
+class StorageBackend(ABC):
+    """
+    Долговременное хранилище записей FSM.
+    Достаточно уметь читать одну запись и атомарно записать пачку — кэш и
+    склейку записей берёт на себя CachedStorage.
+    """
+
+    @abstractmethod
+    async def load(self, key: str) -> Record | None:
+        ...
+
+    @abstractmethod
+    async def save_many(self, records: Mapping[str, Record | None]) -> None:
+        ...
+
+    @abstractmethod
+    async def close(self) -> None:
+        ...
+
+
+class SQLiteBackend(StorageBackend):
+    """SQLite в WAL-режиме. Все обращения — в одном фоновом потоке, event loop не блокируется."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL)"
+        )
+        self._conn.commit()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _load(self, key: str) -> Record | None:
+        row = self._conn.execute("SELECT state, data FROM fsm WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], loads(row[1])
+
+    def _save_many(self, records: Mapping[str, Record | None]):
+        upserts = [(key, rec[0], dumps(rec[1])) for key, rec in records.items() if rec is not None]
+        deletes = [(key,) for key, rec in records.items() if rec is None]
+        with self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT INTO fsm (key, state, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data",
+                    upserts,
+                )
+            if deletes:
+                self._conn.executemany("DELETE FROM fsm WHERE key = ?", deletes)
+
+    async def load(self, key: str) -> Record | None:
+        return await self._run(self._load, key)
+
+    async def save_many(self, records: Mapping[str, Record | None]) -> None:
+        await self._run(self._save_many, records)
+
+    async def close(self) -> None:
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+
+class RedisBackend(StorageBackend):
+    """Redis (или совместимый KeyDB/Dragonfly). Запись — один JSON под ключом."""
+
+    def __init__(self, url: str, prefix: str = "adminbot:"):
+        try:
+            from redis.asyncio import Redis
+        except ImportError as e:
+            raise RuntimeError("FSM_STORAGE=redis requires the 'redis' package") from e
+        self._redis = Redis.from_url(url)
+        self._prefix = prefix
+
+    async def load(self, key: str) -> Record | None:
+        raw = await self._redis.get(self._prefix + key)
+        if raw is None:
+            return None
+        record = loads(raw)
+        return record["state"], record["data"]
+
+    async def save_many(self, records: Mapping[str, Record | None]) -> None:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            for key, rec in records.items():
+                if rec is None:
+                    pipe.delete(self._prefix + key)
+                else:
+                    pipe.set(self._prefix + key, dumps({"state": rec[0], "data": rec[1]}))
+            await pipe.execute()
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+
+# =========================
+# Write-behind storage
+# =========================
+
+class CachedStorage(BaseStorage):
+    """
+    FSM storage с кэшем в памяти процесса и отложенной записью.
+
+    Чтения после первого обращения к ключу идут из кэша. Записи только помечают
+    ключ грязным; раз в flush_interval все изменения уходят в backend одной
+    пачкой, так что пара update_data + set_state в хендлере — это одна запись.
+
+    Кэш рассчитан на то, что апдейты одного чата обрабатывает один процесс.
+    """
+
+    def __init__(
+        self,
+        backend: StorageBackend,
+        flush_interval: float = 0.5,
+        cache_size: int = 10000,
+        key_builder: KeyBuilder | None = None,
+    ):
+        self.backend = backend
+        self.flush_interval = flush_interval
+        self.cache_size = cache_size
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache: OrderedDict[str, Record] = OrderedDict()
+        self._dirty: set[str] = set()
+        self._flush_task: asyncio.Task | None = None
+        self._flush_lock = asyncio.Lock()
+
+    async def _record(self, key: StorageKey) -> tuple[str, Record]:
+        skey = self.key_builder.build(key)
+        record = self._cache.get(skey)
+        if record is None:
+            record = await self.backend.load(skey) or (None, {})
+            # Пока грузили, запись могла появиться — кэш главнее
+            record = self._cache.setdefault(skey, record)
+            self._cache.move_to_end(skey)
+            # Ключи, которые только читают (чужие и бесстатусные апдейты), тоже держат место
+            self._evict()
+        else:
+            self._cache.move_to_end(skey)
+        return skey, record
+
+    def _put(self, skey: str, record: Record):
+        self._cache[skey] = record
+        self._cache.move_to_end(skey)
+        self._dirty.add(skey)
+        self._evict()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    def _evict(self):
+        # Выкидываем только чистые записи — грязные ещё не на диске
+        if len(self._cache) <= self.cache_size:
+            return
+        for skey in list(self._cache):
+            if len(self._cache) <= self.cache_size:
+                break
+            if skey not in self._dirty:
+                del self._cache[skey]
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.flush_interval)
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("FSM storage flush failed, will retry")
+            if self._dirty:
+                self._flush_task = asyncio.create_task(self._delayed_flush())
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch = {}
+            for skey in self._dirty:
+                state, data = self._cache[skey]
+                batch[skey] = None if state is None and not data else (state, data.copy())
+            self._dirty.clear()
+            try:
+                await self.backend.save_many(batch)
+            except BaseException:
+                # Вернём ключи в грязные — запишем при следующем flush
+                self._dirty.update(batch)
+                raise
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        skey, (_, data) = await self._record(key)
+        self._put(skey, (state.state if isinstance(state, State) else state, data))
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        _, (state, _) = await self._record(key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            msg = f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            raise DataNotDictLikeError(msg)
+        skey, (state, _) = await self._record(key)
+        self._put(skey, (state, data.copy()))
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        _, (_, data) = await self._record(key)
+        return data.copy()
+
+    async def get_record(self, key: StorageKey) -> Record:
+        """Состояние и данные за одно обращение."""
+        _, (state, data) = await self._record(key)
+        return state, data.copy()
+
+    async def set_record(self, key: StorageKey, state: StateType, data: Mapping[str, Any]) -> None:
+        """Состояние и данные одной записью — для StateTx."""
+        skey = self.key_builder.build(key)
+        self._put(skey, (state.state if isinstance(state, State) else state, dict(data)))
+
+    async def close(self) -> None:
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+        await self.backend.close()
+
+
+def create_storage() -> BaseStorage:
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    if FSM_STORAGE == "redis":
+        backend = RedisBackend(FSM_REDIS_URL)
+    else:
+        backend = SQLiteBackend(FSM_SQLITE_PATH)
+    return CachedStorage(backend, flush_interval=FSM_FLUSH_INTERVAL, cache_size=FSM_CACHE_SIZE)
@@ -0,0 +1,466 @@
+import argparse
+import asyncio
+import json
+import multiprocessing as mp
+import os
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+from typing import Awaitable, Callable
+
+import aiohttp
+from aiohttp import web
+from loguru import logger
+
+# python supervisor.py [--workers N] — бот на нескольких ядрах.
+#
+# Апдейты принимает один процесс (polling или webhook) и раздаёт воркерам по chat_id:
+# все апдейты чата попадают в один и тот же воркер и обрабатываются там строго по
+# порядку. Воркер — обычный бот (create_dispatcher) без своего приёма апдейтов.
+# Упавший воркер перезапускается, неначатые апдейты достаются новому процессу.
+# Не начатые к остановке супервизора сохраняются в файл и отдаются воркерам при запуске.
+#
+# config здесь импортируется только внутри функций: воркер стартует через spawn,
+# заново импортирует этот модуль и должен выставить свои переменные окружения
+# (доля лимита Bot API, порт метрик, файл лога) до первого импорта config.
+
+TELEGRAM_API = "https://api.telegram.org"
+# То, что регистрирует create_dispatcher(); воркер сверяет при старте
+ALLOWED_UPDATES = ["message", "callback_query"]
+POLL_TIMEOUT = 30
+# Упал быстрее — перезапускаем с нарастающей паузой, чтобы не крутить падения
+CRASH_LOOP_SECONDS = 10
+RESTART_DELAY_MAX = 30
+# Сколько воркер доделывает начатое при остановке, прежде чем его убьют
+STOP_TIMEOUT = 15
+
+
+def update_chat_id(raw: dict) -> int:
+    """Чат апдейта прямо из JSON, без разбора в модели aiogram."""
+    for key, payload in raw.items():
+        if key == "update_id" or not isinstance(payload, dict):
+            continue
+        # callback_query: чат — у сообщения с кнопкой; inline-запросы — только от пользователя
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+        user = payload.get("from") or payload.get("user")
+        if user:
+            return user["id"]
+    return raw["update_id"]
+
+
+def shard(chat_id: int, workers: int) -> int:
+    return chat_id % workers
+
+
+# =========================
+# Worker
+# =========================
+
+class ChatQueues:
+    """Апдейты одного чата — строго друг за другом, разных чатов — параллельно."""
+
+    def __init__(self):
+        self._tails: dict[int, asyncio.Task] = {}
+
+    def submit(self, chat_id: int, job: Callable[[], Awaitable]):
+        task = asyncio.create_task(self._after(self._tails.get(chat_id), job))
+        self._tails[chat_id] = task
+        task.add_done_callback(partial(self._forget, chat_id))
+
+    def _forget(self, chat_id: int, task: asyncio.Task):
+        if self._tails.get(chat_id) is task:
+            del self._tails[chat_id]
+
+    @staticmethod
+    async def _after(previous: asyncio.Task | None, job: Callable[[], Awaitable]):
+        if previous is not None:
+            # Только ждём: упавший прошлый апдейт — не повод пропускать этот
+            await asyncio.wait((previous,))
+        await job()
+
+    async def drain(self, timeout: float):
+        if self._tails:
+            await asyncio.wait(list(self._tails.values()), timeout=timeout)
+
+
+def worker_main(index: int, workers: int, inbox, acks, env: dict):
+    os.environ.update(env)
+    # Ctrl+C получает вся группа процессов — воркеры останавливает супервизор
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker(index, workers, inbox, acks))
+
+
+async def _worker(index: int, workers: int, inbox, acks):
+    from aiogram.methods import TelegramMethod
+    from aiogram.types import Update
+
+    import bot as app
+    from user_index import user_index
+
+    bot = app.create_bot()
+    dp = app.create_dispatcher()
+    unknown = set(dp.resolve_used_update_types()) - set(ALLOWED_UPDATES)
+    if unknown:
+        logger.warning(f"Handlers for {sorted(unknown)} will never fire: supervisor does not request them")
+
+    # База индекса общая: с панели её выгружает только воркер 0, остальные перечитывают
+    user_index.shared = True
+    user_index.leader = index == 0
+    stop_services = await app.start_services(bot, owns=lambda chat_id: shard(chat_id, workers) == index)
+    await dp.emit_startup(bot=bot)
+
+    loop = asyncio.get_running_loop()
+    updates: asyncio.Queue = asyncio.Queue()
+
+    def read_inbox():
+        while True:
+            raw = inbox.get()
+            loop.call_soon_threadsafe(updates.put_nowait, raw)
+            if raw is None:
+                return
+
+    threading.Thread(target=read_inbox, name="inbox", daemon=True).start()
+    loop.add_signal_handler(signal.SIGTERM, updates.put_nowait, None)
+
+    async def handle(raw: dict):
+        # Подтверждаем в момент начала: начатый апдейт после падения воркера не повторяем
+        acks.put((index, raw["update_id"]))
+        try:
+            update = Update.model_validate(raw, context={"bot": bot})
+            # Как в polling: метод, который вернул хендлер, отправляется отдельным запросом
+            result = await dp.feed_update(bot, update)
+            if isinstance(result, TelegramMethod):
+                await dp.silent_call_request(bot, result)
+        except Exception:
+            logger.exception(f"Update {raw['update_id']} failed")
+
+    chats = ChatQueues()
+    logger.info(f"Worker {index} of {workers} started, pid {os.getpid()}")
+    try:
+        while (raw := await updates.get()) is not None:
+            chats.submit(update_chat_id(raw), partial(handle, raw))
+        await chats.drain(STOP_TIMEOUT)
+    finally:
+        try:
+            await dp.emit_shutdown(bot=bot)
+        finally:
+            await stop_services()
+            await bot.session.close()
+            logger.info(f"Worker {index} stopped")
+
+
+# =========================
+# Supervisor
+# =========================
+
+class TelegramApiError(Exception):
+    def __init__(self, method: str, response: dict):
+        super().__init__(f"{method}: {response.get('error_code')} {response.get('description')}")
+        self.retry_after = (response.get("parameters") or {}).get("retry_after")
+
+
+class WorkerSlot:
+    """Место воркера: сам процесс меняется при рестартах, апдейты в pending — нет."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: mp.Process | None = None
+        self.inbox = None
+        # update_id -> апдейт: отданы воркеру, но он их ещё не начал
+        self.pending: OrderedDict[int, dict] = OrderedDict()
+        self.started_at = 0.0
+        self.restart_at: float | None = None
+        self.crashes = 0
+        self.restarts = 0
+        self.routed = 0
+
+
+class Supervisor:
+    def __init__(self, workers: int, max_pending: int):
+        self.max_pending = max_pending
+        self.slots = [WorkerSlot(index) for index in range(workers)]
+        # Следующий update_id для getUpdates (только polling)
+        self.offset: int | None = None
+        self._ctx = mp.get_context("spawn")
+        # Одна очередь подтверждений на всех: (номер воркера, update_id)
+        self._acks = self._ctx.Queue()
+        # update_id, отданные из файла при запуске: если Telegram пришлёт их снова, пропускаем
+        self._replayed: set[int] = set()
+
+    # ---------- воркеры ----------
+
+    def _worker_env(self, index: int) -> dict:
+        from config import LOG_PATH, METRICS_PORT, TG_GLOBAL_RATE
+
+        base, ext = os.path.splitext(LOG_PATH)
+        return {
+            # Лимит Bot API считается на бота, а не на процесс — каждому воркеру его доля
+            "TG_GLOBAL_RATE": str(TG_GLOBAL_RATE / len(self.slots)),
+            "METRICS_PORT": str(METRICS_PORT + index) if METRICS_PORT else "0",
+            "LOG_PATH": f"{base}.w{index}{ext}",
+        }
+
+    def _spawn(self, slot: WorkerSlot):
+        slot.inbox = self._ctx.Queue()
+        slot.process = self._ctx.Process(
+            target=worker_main,
+            args=(slot.index, len(self.slots), slot.inbox, self._acks, self._worker_env(slot.index)),
+            name=f"bot-worker-{slot.index}",
+        )
+        slot.process.start()
+        slot.started_at = time.monotonic()
+        slot.restart_at = None
+        # Отданное прошлому процессу и не начатое им — новому, в том же порядке
+        for raw in slot.pending.values():
+            slot.inbox.put(raw)
+
+    def _ack(self, index: int, update_id: int):
+        self.slots[index].pending.pop(update_id, None)
+
+    def _read_acks(self, loop: asyncio.AbstractEventLoop):
+        while (item := self._acks.get()) is not None:
+            loop.call_soon_threadsafe(self._ack, *item)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(0.5)
+            now = time.monotonic()
+            for slot in self.slots:
+                if slot.process.exitcode is None:
+                    continue
+                if slot.restart_at is None:
+                    uptime = now - slot.started_at
+                    slot.crashes = slot.crashes + 1 if uptime < CRASH_LOOP_SECONDS else 0
+                    # Пауза ещё и даёт дочитать подтверждения, отправленные воркером перед смертью
+                    delay = min(RESTART_DELAY_MAX, 2 ** slot.crashes)
+                    slot.restart_at = now + delay
+                    logger.error(
+                        f"Worker {slot.index} (pid {slot.process.pid}) exited with code {slot.process.exitcode} "
+                        f"after {uptime:.0f}s, restart in {delay}s, {len(slot.pending)} updates waiting"
+                    )
+                elif now >= slot.restart_at:
+                    slot.restarts += 1
+                    self._spawn(slot)
+                    logger.info(f"Worker {slot.index} restarted, pid {slot.process.pid}")
+
+    async def _stop_workers(self):
+        # None встаёт в очередь после всех апдейтов — воркер доделывает их и выходит
+        for slot in self.slots:
+            if slot.process.exitcode is None:
+                slot.inbox.put(None)
+        deadline = time.monotonic() + STOP_TIMEOUT + 10
+        for slot in self.slots:
+            await asyncio.to_thread(slot.process.join, max(0.0, deadline - time.monotonic()))
+            if slot.process.exitcode is None:
+                logger.warning(f"Worker {slot.index} did not stop in time, killing")
+                slot.process.kill()
+                await asyncio.to_thread(slot.process.join)
+
+    # ---------- неначатые апдейты между запусками ----------
+
+    @staticmethod
+    def _read_pending(path: str) -> list[dict]:
+        try:
+            with open(path, encoding="utf-8") as f:
+                updates = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            logger.error(f"Pending updates file {path} is invalid, skipping it: {e}")
+            updates = []
+        os.remove(path)
+        return updates
+
+    @staticmethod
+    def _write_pending(path: str, updates: list[dict]):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(updates, f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    async def replay_pending(self):
+        """Отдаёт воркерам то, что прошлый запуск принял, но не успел начать."""
+        from config import SUPERVISOR_PENDING_PATH
+
+        updates = await asyncio.to_thread(self._read_pending, SUPERVISOR_PENDING_PATH)
+        for raw in updates:
+            self._replayed.add(raw["update_id"])
+            self.route(raw)
+        if updates:
+            logger.info(f"Replayed {len(updates)} updates not started before the last stop")
+
+    async def save_pending(self):
+        """После остановки воркеров: неначатые апдейты — в файл, в порядке update_id."""
+        from config import SUPERVISOR_PENDING_PATH
+
+        updates = sorted(
+            (raw for slot in self.slots for raw in slot.pending.values()), key=lambda raw: raw["update_id"]
+        )
+        if not updates:
+            return
+        try:
+            await asyncio.to_thread(self._write_pending, SUPERVISOR_PENDING_PATH, updates)
+        except OSError as e:
+            logger.error(f"Failed to save {len(updates)} pending updates, they are lost: {e}")
+            return
+        logger.info(f"Saved {len(updates)} updates not started by workers")
+
+    # ---------- приём апдейтов ----------
+
+    def route(self, raw: dict):
+        slot = self.slots[shard(update_chat_id(raw), len(self.slots))]
+        slot.pending[raw["update_id"]] = raw
+        slot.routed += 1
+        # Если воркер как раз умер — апдейт уйдёт новому процессу из pending
+        slot.inbox.put(raw)
+
+    @property
+    def full(self) -> bool:
+        return any(len(slot.pending) >= self.max_pending for slot in self.slots)
+
+    async def _api(self, session: aiohttp.ClientSession, method: str, **params):
+        from config import BOT_TOKEN
+
+        async with session.post(f"{TELEGRAM_API}/bot{BOT_TOKEN}/{method}", json=params) as response:
+            data = await response.json()
+        if not data.get("ok"):
+            raise TelegramApiError(method, data)
+        return data["result"]
+
+    async def poll(self, session: aiohttp.ClientSession):
+        # Telegram не отдаёт getUpdates, пока висит webhook от прошлого режима
+        await self._api(session, "deleteWebhook")
+        logger.info("Supervisor polling started")
+        backoff = 1.0
+        while True:
+            if self.full:
+                # Воркер не успевает — не забираем новые, Telegram подержит их у себя
+                await asyncio.sleep(0.1)
+                continue
+            try:
+                updates = await self._api(
+                    session, "getUpdates", offset=self.offset, timeout=POLL_TIMEOUT, allowed_updates=ALLOWED_UPDATES
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError, TelegramApiError) as e:
+                delay = getattr(e, "retry_after", None) or backoff
+                logger.warning(f"getUpdates failed: {e}, retry in {delay:.0f}s")
+                await asyncio.sleep(delay)
+                backoff = min(backoff * 2, RESTART_DELAY_MAX)
+                continue
+            backoff = 1.0
+            for raw in updates:
+                self.offset = raw["update_id"] + 1
+                # Уже отдан из файла: прошлый запуск сохранил его, но не смог подтвердить
+                if raw["update_id"] not in self._replayed:
+                    self.route(raw)
+
+    async def confirm(self, session: aiohttp.ClientSession):
+        """
+        После остановки воркеров: подтверждаем Telegram всё полученное. Не начатое
+        к этому моменту уже сохранено в файл (save_pending) — повторно его не запрашиваем,
+        иначе Telegram прислал бы заново и то, что воркеры успели начать.
+        """
+        try:
+            await self._api(session, "getUpdates", offset=self.offset, limit=1, timeout=0)
+        except Exception as e:
+            logger.warning(f"Failed to confirm updates up to {self.offset}: {e}")
+
+    async def serve_webhook(self, session: aiohttp.ClientSession):
+        from config import WEBHOOK_BASE_URL, WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET
+
+        async def receive(request: web.Request) -> web.Response:
+            if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+                return web.Response(status=401)
+            if self.full:
+                # Telegram повторит доставку позже
+                return web.Response(status=503)
+            self.route(await request.json())
+            return web.Response()
+
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, receive)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        params = {"secret_token": WEBHOOK_SECRET} if WEBHOOK_SECRET else {}
+        # Одно соединение: параллельные запросы Telegram могли бы переставить апдейты чата.
+        # Хендлер только кладёт апдейт в очередь, так что соединение освобождается сразу
+        await self._api(
+            session, "setWebhook", url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+            allowed_updates=ALLOWED_UPDATES, max_connections=1, **params,
+        )
+        logger.info(f"Supervisor webhook listening on {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    # ---------- запуск ----------
+
+    async def run(self, receive: Callable[[aiohttp.ClientSession], Awaitable]):
+        loop = asyncio.get_running_loop()
+        for slot in self.slots:
+            self._spawn(slot)
+        await self.replay_pending()
+        reader = threading.Thread(target=self._read_acks, args=(loop,), name="acks", daemon=True)
+        reader.start()
+        stop = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        watcher = asyncio.create_task(self._watch())
+        timeout = aiohttp.ClientTimeout(total=POLL_TIMEOUT + 10)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            try:
+                receiving = asyncio.create_task(receive(session))
+                stopping = asyncio.create_task(stop.wait())
+                await asyncio.wait((receiving, stopping), return_when=asyncio.FIRST_COMPLETED)
+                for task in (receiving, stopping):
+                    task.cancel()
+                results = await asyncio.gather(receiving, stopping, return_exceptions=True)
+                if isinstance(results[0], Exception):
+                    logger.opt(exception=results[0]).error("Receiving updates crashed")
+            finally:
+                watcher.cancel()
+                await asyncio.gather(watcher, return_exceptions=True)
+                await self._stop_workers()
+                self._acks.put(None)
+                await asyncio.to_thread(reader.join)
+                # Подтверждения, которые поток успел передать в loop
+                await asyncio.sleep(0)
+                await self.save_pending()
+                if self.offset is not None:
+                    await self.confirm(session)
+        logger.info("Supervisor stopped: " + ", ".join(
+            f"worker {slot.index} routed {slot.routed}, restarts {slot.restarts}" for slot in self.slots
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бот на нескольких процессах: апдейты шардируются по chat_id")
+    parser.add_argument("--workers", type=int, default=0, help="число воркеров (по умолчанию SUPERVISOR_WORKERS)")
+    args = parser.parse_args()
+
+    from config import BOT_MODE, FSM_STORAGE, LOG_PATH, SUPERVISOR_MAX_PENDING, SUPERVISOR_WORKERS
+
+    # FSM в памяти у каждого процесса своя — после рестарта воркера админ потерял бы шаг флоу
+    if FSM_STORAGE == "memory":
+        sys.exit("error: supervisor needs a shared FSM storage, set FSM_STORAGE=sqlite or redis")
+    workers = args.workers or SUPERVISOR_WORKERS or os.cpu_count() or 1
+
+    base, ext = os.path.splitext(LOG_PATH)
+    logger.add(f"{base}.supervisor{ext}", level="INFO", rotation="10 MB", retention="1 month", compression="gz",
+               enqueue=True)
+    logger.info(f"Supervisor is launched: {workers} workers, {BOT_MODE}")
+    supervisor = Supervisor(workers, SUPERVISOR_MAX_PENDING)
+    asyncio.run(supervisor.run(supervisor.serve_webhook if BOT_MODE == "webhook" else supervisor.poll))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from loadtest import _free_port  # noqa: E402
+
+# config.py читает окружение при импорте — выставляем до импорта бота, как loadtest.py.
+# Всё, что бот пишет на диск, — во временную папку, а не в data/ и logs/ репозитория
+PANEL_PORT = _free_port()
+WORKDIR = tempfile.mkdtemp(prefix="adminbot-tests-")
+ADMIN_ID = 1_000_000
+
+os.environ.update(
+    BOT_TOKEN="42:TEST",
+    REMNAWAVE_BASE_URL=f"http://127.0.0.1:{PANEL_PORT}",
+    REMNAWAVE_TOKEN="test",
+    EGAMES_COOKIE="test",
+    BOT_MODE="polling",
+    FSM_STORAGE="sqlite",
+    FSM_SQLITE_PATH=os.path.join(WORKDIR, "fsm.sqlite3"),
+    USER_INDEX_PATH=os.path.join(WORKDIR, "users.sqlite3"),
+    PRESETS_PATH=os.path.join(WORKDIR, "presets.json"),
+    BULK_JOBS_DIR=os.path.join(WORKDIR, "jobs"),
+    EXPORT_TMP_DIR=os.path.join(WORKDIR, "exports"),
+    AUDIT_PATH=os.path.join(WORKDIR, "audit.jsonl"),
+    LOG_PATH=os.path.join(WORKDIR, "bot.log"),
+    WEBHOOK_SECRET="test-secret",
+    ADMIN_IDS=str(ADMIN_ID),
+)
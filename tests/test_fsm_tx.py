@@ -0,0 +1,105 @@
+import asyncio
+from collections import Counter
+from typing import Any, Mapping
+
+import pytest
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+from conftest import ADMIN_ID, PANEL_PORT
+from loadtest import StubPanel, flow_script, make_fake_session
+
+READS = ("get_state", "get_data", "get_record")
+WRITES = ("set_state", "set_data", "set_record")
+
+
+class CountingStorage(BaseStorage):
+    """Обёртка над storage бота: считает обращения, сами данные хранит inner."""
+
+    def __init__(self, inner: BaseStorage):
+        self.inner = inner
+        self.calls = Counter()
+
+    async def get_state(self, key: StorageKey) -> str | None:
+        self.calls["get_state"] += 1
+        return await self.inner.get_state(key)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        self.calls["set_state"] += 1
+        await self.inner.set_state(key, state)
+
+    async def get_data(self, key: StorageKey) -> dict[str, Any]:
+        self.calls["get_data"] += 1
+        return await self.inner.get_data(key)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        self.calls["set_data"] += 1
+        await self.inner.set_data(key, data)
+
+    # StateTx берёт запись целиком, если storage это умеет, — как CachedStorage
+    async def get_record(self, key: StorageKey):
+        self.calls["get_record"] += 1
+        return await self.inner.get_record(key)
+
+    async def set_record(self, key: StorageKey, state: StateType, data: Mapping[str, Any]) -> None:
+        self.calls["set_record"] += 1
+        await self.inner.set_record(key, state, data)
+
+    async def close(self) -> None:
+        await self.inner.close()
+
+
+async def _run_flow() -> list[tuple[str, int, int]]:
+    from aiogram import Bot
+    from aiogram.methods import TelegramMethod
+    from aiogram.types import Update
+
+    from bot import create_dispatcher
+    from remnawave_client import close_sdk, init_sdk
+    from squads import squad_catalog
+    from storage import create_storage
+
+    panel = StubPanel(0)
+    await panel.start(PANEL_PORT)
+    bot = Bot(token="42:TEST", session=make_fake_session(0))
+    storage = CountingStorage(create_storage())
+    dp = create_dispatcher(storage)
+    init_sdk()
+    await squad_catalog.refresh()
+
+    steps = []
+    try:
+        for step, raw in flow_script(ADMIN_ID):
+            storage.calls.clear()
+            result = await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+            if isinstance(result, TelegramMethod):
+                await bot(result)
+            reads = sum(storage.calls[name] for name in READS)
+            writes = sum(storage.calls[name] for name in WRITES)
+            steps.append((step, reads, writes))
+    finally:
+        await dp.storage.close()
+        await close_sdk()
+        await panel.stop()
+    return steps
+
+
+@pytest.fixture(scope="module")
+def steps() -> list[tuple[str, int, int]]:
+    return asyncio.run(_run_flow())
+
+
+def test_flow_runs_every_step(steps):
+    assert [step for step, _, _ in steps] == [step for step, _ in flow_script(ADMIN_ID)]
+
+
+def test_one_read_and_one_write_per_step(steps):
+    for step, reads, writes in steps:
+        # Одно чтение — состояние для фильтров (FSMContextMiddleware), остальное — хендлер
+        assert reads - 1 <= 1, f"{step}: {reads - 1} handler reads"
+        assert writes <= 1, f"{step}: {writes} writes"
+
+
+def test_repeated_tap_does_not_write(steps):
+    # В flow_script exp_1 нажимается дважды: второе нажатие ничего не меняет
+    taps = [writes for step, _, writes in steps if step == "expire_select/exp_1"]
+    assert taps == [1, 0]
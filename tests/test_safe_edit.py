@@ -0,0 +1,56 @@
+import asyncio
+from types import SimpleNamespace
+
+
+class SlowMessage:
+    """Сообщение, чьи правки висят, пока тест их не отпустит; показанное — в shown."""
+
+    def __init__(self, message_id: int):
+        self.chat = SimpleNamespace(id=1)
+        self.message_id = message_id
+        self.shown = None
+        self.sent = []
+        self.release = asyncio.Event()
+
+    async def edit_text(self, text: str, reply_markup=None, **kwargs):
+        self.sent.append(text)
+        await self.release.wait()
+        self.shown = text
+
+
+async def _taps(message_id: int, texts: list[str]) -> SlowMessage:
+    """Первая правка (A) уже показана, потом texts приходят, пока первая из них в полёте."""
+    from handlers.create_user import safe_edit_text
+
+    message = SlowMessage(message_id)
+    message.release.set()
+    await safe_edit_text(message, "A")
+    message.release.clear()
+
+    first = asyncio.create_task(safe_edit_text(message, texts[0]))
+    await asyncio.sleep(0)
+    for text in texts[1:]:
+        await safe_edit_text(message, text)
+    message.release.set()
+    await first
+    return message
+
+
+def test_return_to_shown_text_while_editing():
+    # exp_1 → exp_3 → exp_1 быстро: A показан, B в полёте, пришёл снова A
+    message = asyncio.run(_taps(101, ["B", "A"]))
+    assert message.shown == "A"
+    assert message.sent == ["A", "B", "A"]
+
+
+def test_return_to_shown_text_replaces_pending():
+    # B в полёте, C ждёт своей очереди, пришёл A — уходит A, а не C
+    message = asyncio.run(_taps(102, ["B", "C", "A"]))
+    assert message.shown == "A"
+    assert message.sent == ["A", "B", "A"]
+
+
+def test_same_text_is_not_resent():
+    message = asyncio.run(_taps(103, ["B", "B"]))
+    assert message.shown == "B"
+    assert message.sent == ["A", "B"]
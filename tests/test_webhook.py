@@ -0,0 +1,125 @@
+import asyncio
+import itertools
+import re
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import MultipartReader
+from aiohttp.test_utils import TestClient, TestServer
+
+from conftest import ADMIN_ID, PANEL_PORT
+from loadtest import StubPanel, flow_script, make_fake_session
+
+# В текстах меняются от прогона к прогону только UUID панели, даты и время — маскируем цифры
+_VOLATILE = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|\d")
+
+
+def _normalize(method: str, fields: dict) -> tuple:
+    return (method, tuple(sorted((key, _VOLATILE.sub("#", str(value))) for key, value in fields.items())))
+
+
+def _recording_session(calls: list):
+    """Фейковая сессия loadtest, которая записывает каждый метод так же, как его сериализует webhook."""
+    session = make_fake_session(0)
+    make_request = session.make_request
+
+    async def record(bot, method, timeout=None):
+        fields = {}
+        for key, value in method.model_dump(warnings=False).items():
+            value = session.prepare_value(value, bot=bot, files={})
+            if value:
+                fields[key] = value
+        calls.append(_normalize(method.__api_method__, fields))
+        return await make_request(bot, method, timeout)
+
+    session.make_request = record
+    return session
+
+
+async def _run(mode: str, updates: list[tuple[str, dict]]) -> tuple[list, list, int]:
+    """
+    Прогоняет updates через polling-путь или webhook. Возвращает вызовы Bot API,
+    состояния FSM после каждого апдейта и сколько методов ушло ответом на webhook.
+    """
+    from aiogram import Bot
+    from aiogram.methods import TelegramMethod
+    from aiogram.types import Update
+
+    from bot import create_dispatcher, create_webhook_app
+    from config import WEBHOOK_PATH, WEBHOOK_SECRET
+    from remnawave_client import close_sdk, init_sdk
+    from squads import squad_catalog
+
+    panel = StubPanel(0)
+    await panel.start(PANEL_PORT)
+    calls, states = [], []
+    in_response = 0
+    bot = Bot(token="42:TEST", session=_recording_session(calls))
+    dp = create_dispatcher(MemoryStorage())
+    init_sdk()
+    await squad_catalog.refresh()
+    key = StorageKey(bot_id=bot.id, chat_id=ADMIN_ID, user_id=ADMIN_ID)
+
+    client = None
+    if mode == "webhook":
+        client = TestClient(TestServer(create_webhook_app(dp, bot)))
+        await client.start_server()
+    try:
+        for step, raw in updates:
+            if client is None:
+                # Как в polling: возвращённый хендлером метод уходит отдельным запросом
+                result = await dp.feed_update(bot, Update.model_validate(raw, context={"bot": bot}))
+                if isinstance(result, TelegramMethod):
+                    await bot(result)
+            else:
+                response = await client.post(WEBHOOK_PATH, json=raw,
+                                             headers={"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET})
+                assert response.status == 200, step
+                if response.content_type.startswith("multipart/"):
+                    # Метод в ответе на webhook: Telegram выполнит его сам
+                    fields = {}
+                    async for part in MultipartReader.from_response(response):
+                        fields[part.name] = await part.text()
+                    calls.append(_normalize(fields.pop("method"), fields))
+                    in_response += 1
+            data = await dp.storage.get_data(key)
+            states.append((step, await dp.storage.get_state(key), sorted(data)))
+    finally:
+        if client is not None:
+            await client.close()
+        else:
+            await dp.storage.close()
+        await close_sdk()
+        await panel.stop()
+    return calls, states, in_response
+
+
+def _fresh_process(monkeypatch):
+    """Каждый прогон — как отдельный процесс бота: одинаковые id из пула, пустые кэши хендлеров."""
+    from handlers import create_user
+    from id_pool import id_pool
+    from pipeline import SingleFlight
+
+    # username и short_uuid из пула случайны — в обоих прогонах должны совпасть
+    counter = itertools.count()
+    monkeypatch.setattr(id_pool, "take", lambda: f"user{next(counter):04d}")
+    # Иначе второй прогон не перерисует уже показанный экран и подключится к созданию первого
+    create_user._rendered.clear()
+    monkeypatch.setattr(create_user, "_creating", SingleFlight(linger=create_user.CREATE_LINGER))
+
+
+def test_webhook_matches_polling(monkeypatch):
+    updates = flow_script(ADMIN_ID)
+
+    _fresh_process(monkeypatch)
+    polling_calls, polling_states, _ = asyncio.run(_run("polling", updates))
+    _fresh_process(monkeypatch)
+    webhook_calls, webhook_states, in_response = asyncio.run(_run("webhook", updates))
+
+    assert webhook_states == polling_states
+    assert webhook_calls == polling_calls
+    # Флоу дошёл до конца: пользователь создан, состояние сброшено
+    assert polling_states[-1][1] is None
+    assert any("Пользователь создан" in dict(fields).get("text", "") for _, fields in polling_calls)
+    # Путь, ради которого webhook: call.answer() и т.п. ушли в теле ответа, без запроса к Bot API
+    assert in_response > 0
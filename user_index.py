@@ -0,0 +1,498 @@
+import asyncio
+import json
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from loguru import logger
+
+from config import USER_INDEX_PATH, USER_INDEX_REFRESH, USER_INDEX_RETRY_INTERVAL, USER_INDEX_PAGE_SIZE
+from config import USER_INDEX_FOLLOW_INTERVAL
+from remnawave_client import get_sdk
+
+# Порядок колонок в users — в нём же user_row() отдаёт значения
+COLUMNS = (
+    "uuid",
+    "short_uuid",
+    "username",
+    "status",
+    "tag",
+    "email",
+    "telegram_id",
+    "expire_at",
+    "traffic_limit_bytes",
+    "used_traffic_bytes",
+    "description",
+    "internal_squads",
+    "external_squad",
+    "created_at",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uuid TEXT PRIMARY KEY,
+    short_uuid TEXT NOT NULL,
+    username TEXT NOT NULL COLLATE NOCASE,
+    status TEXT NOT NULL,
+    tag TEXT COLLATE NOCASE,
+    email TEXT COLLATE NOCASE,
+    telegram_id INTEGER,
+    expire_at TEXT,
+    traffic_limit_bytes INTEGER,
+    used_traffic_bytes INTEGER,
+    description TEXT,
+    internal_squads TEXT NOT NULL,
+    external_squad TEXT,
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS users_username ON users (username);
+CREATE INDEX IF NOT EXISTS users_short_uuid ON users (short_uuid);
+CREATE INDEX IF NOT EXISTS users_status ON users (status, username);
+CREATE INDEX IF NOT EXISTS users_tag ON users (tag, username);
+CREATE INDEX IF NOT EXISTS users_email ON users (email);
+CREATE INDEX IF NOT EXISTS users_telegram_id ON users (telegram_id);
+"""
+
+# Поиск по подстроке: FTS5 с триграммами (SQLite 3.34+), индекс сам следует за users
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+    username, email, tag, description, content='users', tokenize='trigram'
+);
+CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+    INSERT INTO users_fts (rowid, username, email, tag, description)
+    VALUES (new.rowid, new.username, new.email, new.tag, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+    INSERT INTO users_fts (users_fts, rowid, username, email, tag, description)
+    VALUES ('delete', old.rowid, old.username, old.email, old.tag, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username, email, tag, description ON users BEGIN
+    INSERT INTO users_fts (users_fts, rowid, username, email, tag, description)
+    VALUES ('delete', old.rowid, old.username, old.email, old.tag, old.description);
+    INSERT INTO users_fts (rowid, username, email, tag, description)
+    VALUES (new.rowid, new.username, new.email, new.tag, new.description);
+END;
+"""
+
+UPSERT = (
+    f"INSERT INTO users ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))}) "
+    f"ON CONFLICT(uuid) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in COLUMNS[1:])}"
+)
+
+# Верхняя граница для поиска по префиксу диапазоном: username >= 'ab' AND username < 'ab\U0010ffff'
+PREFIX_END = "\U0010ffff"
+
+UUID_PREFIX = re.compile(r"[0-9a-f]{8}(-[0-9a-f]{0,4}){0,4}[0-9a-f]*")
+MIN_SUBSTRING = 3  # короче триграмма не ищет
+
+
+@dataclass(frozen=True)
+class UserFilter:
+    """Фильтр списка: пустое поле — без ограничения. squad — UUID внутреннего или внешнего сквада."""
+    status: str | None = None
+    tag: str | None = None
+    squad: str | None = None
+
+
+@dataclass(frozen=True)
+class IndexedUser:
+    uuid: str
+    short_uuid: str
+    username: str
+    status: str
+    tag: str | None
+    email: str | None
+    telegram_id: int | None
+    expire_at: str | None
+    traffic_limit_bytes: int | None
+    used_traffic_bytes: int | None
+
+
+SELECT = f"SELECT {', '.join(IndexedUser.__dataclass_fields__)} FROM users"
+
+
+def user_row(user) -> tuple:
+    """UserResponseDto -> строка таблицы users."""
+    return (
+        str(user.uuid),
+        user.short_uuid,
+        user.username,
+        str(user.status),
+        user.tag,
+        user.email,
+        user.telegram_id,
+        user.expire_at.isoformat() if user.expire_at else None,
+        int(user.traffic_limit_bytes or 0),
+        int(user.used_traffic_bytes or 0),
+        user.description,
+        json.dumps(sorted(str(s.uuid) for s in user.active_internal_squads)),
+        str(user.external_squad_uuid) if user.external_squad_uuid else None,
+        user.created_at.isoformat() if user.created_at else None,
+    )
+
+
+def parse_query(query: str) -> tuple[str, str]:
+    """
+    "tag:VIP" / "#VIP" -> ("tag", "VIP"); "email:" / "tg:" / "uuid:" — явно;
+    без префикса -> ("auto", query): ищем сразу по всем полям.
+    """
+    query = query.strip()
+    kind, sep, value = query.partition(":")
+    if sep and kind.lower() in ("tag", "email", "tg", "uuid", "user") and value.strip():
+        return kind.lower(), value.strip()
+    if query.startswith("#") and len(query) > 1:
+        return "tag", query[1:]
+    return "auto", query
+
+
+class UserIndex:
+    """
+    Копия списка пользователей панели в SQLite — чтобы /find отвечал за миллисекунды,
+    а не выкачивал с панели десятки тысяч пользователей на каждый поиск.
+
+    Заполняется постраничной выгрузкой (get_users_stream, keyset-курсор) и раз
+    в refresh_interval обновляется. Фильтра «изменённые с» у панели нет, поэтому
+    обновление снова проходит весь стрим, но в базу пишет только изменившиеся
+    строки и удаляет пропавших. Созданных ботом добавляем сразу через upsert().
+    Все обращения к SQLite — в одном фоновом потоке, event loop не блокируется.
+
+    Под супервизором базу делят несколько процессов: по расписанию выгружает только
+    лидер (leader=True), остальные раз в follow_interval смотрят PRAGMA data_version
+    и, если базу менял кто-то другой, перечитывают хэши строк.
+    """
+
+    def __init__(self, path: str, refresh_interval: float, retry_interval: float, page_size: int,
+                 follow_interval: float):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.page_size = page_size
+        self.follow_interval = follow_interval
+        self.leader = True
+        self.shared = False
+        self.fts = False
+        self.synced_at: float | None = None
+        # Растёт при каждом изменении данных — по нему кэши страниц понимают, что устарели
+        self.version = 0
+        self.sync_seconds = 0.0
+        self._conn: sqlite3.Connection | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="user-index")
+        # uuid -> hash строки: по нему понимаем, что пользователь изменился и строку надо переписать
+        self._rows: dict[str, int] = {}
+        self._data_version: int | None = None
+        self._task: asyncio.Task | None = None
+        self._follow_task: asyncio.Task | None = None
+        self._wake = asyncio.Event()
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    # ---------- поток SQLite ----------
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        # Воркеры супервизора пишут в ту же базу — ждём чужую транзакцию, а не падаем
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        try:
+            self._conn.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"SQLite without FTS5 trigram ({e}), substring search falls back to LIKE")
+        self._conn.commit()
+        self._load_rows()
+
+    def _load_rows(self):
+        self._rows = {row[0]: hash(row) for row in self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM users")}
+        self._data_version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _reload_if_changed(self) -> bool:
+        """data_version меняется только от чужих коммитов — свои записи перечитывать не нужно."""
+        if self._conn.execute("PRAGMA data_version").fetchone()[0] == self._data_version:
+            return False
+        self._load_rows()
+        return True
+
+    def _write(self, upserts: list[tuple], deletes: list[str]):
+        with self._conn:
+            if upserts:
+                self._conn.executemany(UPSERT, upserts)
+            if deletes:
+                self._conn.executemany("DELETE FROM users WHERE uuid = ?", [(uuid,) for uuid in deletes])
+
+    def _query(self, sql: str, params: tuple) -> list[IndexedUser]:
+        return [IndexedUser(*row) for row in self._conn.execute(sql, params)]
+
+    def _search(self, kind: str, value: str, limit: int) -> list[IndexedUser]:
+        prefix = (value, value + PREFIX_END)
+        if kind == "tag":
+            return self._query(f"{SELECT} WHERE tag = ? ORDER BY username LIMIT ?", (value, limit))
+        if kind == "email":
+            return self._query(f"{SELECT} WHERE email >= ? AND email < ? ORDER BY email LIMIT ?", (*prefix, limit))
+        if kind == "tg":
+            if not value.isdigit():
+                return []
+            return self._query(f"{SELECT} WHERE telegram_id = ? ORDER BY username LIMIT ?", (int(value), limit))
+        if kind == "uuid":
+            low = value.lower()
+            return self._query(
+                f"{SELECT} WHERE (uuid >= ? AND uuid < ?) OR short_uuid = ? ORDER BY username LIMIT ?",
+                (low, low + PREFIX_END, value, limit),
+            )
+        if kind == "user":
+            return self._query(f"{SELECT} WHERE username >= ? AND username < ? ORDER BY username LIMIT ?",
+                               (*prefix, limit))
+
+        # Без префикса: точные совпадения по всем полям, потом префикс username, потом подстрока
+        conditions = ["username >= ? AND username < ?", "short_uuid = ?", "tag = ?"]
+        params: list = [*prefix, value, value]
+        if "@" in value:
+            conditions.append("email >= ? AND email < ?")
+            params += prefix
+        if value.isdigit():
+            conditions.append("telegram_id = ?")
+            params.append(int(value))
+        if UUID_PREFIX.fullmatch(value.lower()):
+            conditions.append("(uuid >= ? AND uuid < ?)")
+            params += [value.lower(), value.lower() + PREFIX_END]
+        found = self._query(
+            f"{SELECT} WHERE {' OR '.join(f'({c})' for c in conditions)} "
+            f"ORDER BY username = ? DESC, username LIMIT ?",
+            (*params, value, limit),
+        )
+
+        if len(found) < limit and len(value) >= MIN_SUBSTRING:
+            seen = {user.uuid for user in found}
+            if self.fts:
+                # Без ORDER BY: сортировка всех совпадений по подстроке стоила бы дороже самого поиска
+                sql = f"{SELECT} WHERE rowid IN (SELECT rowid FROM users_fts WHERE users_fts MATCH ? LIMIT ?)"
+                phrase = '"' + value.replace('"', '""') + '"'
+                more = self._query(sql, (phrase, limit + len(seen)))
+            else:
+                like = "%" + value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+                sql = (f"{SELECT} WHERE username LIKE ?1 ESCAPE '\\' OR email LIKE ?1 ESCAPE '\\' "
+                       f"OR tag LIKE ?1 ESCAPE '\\' OR description LIKE ?1 ESCAPE '\\' LIMIT ?2")
+                more = self._query(sql, (like, limit + len(seen)))
+            more = sorted((user for user in more if user.uuid not in seen), key=lambda user: user.username.lower())
+            found += more[:limit - len(found)]
+        return found
+
+    def _filter_sql(self, filters: UserFilter) -> tuple[list[str], list]:
+        conditions, params = [], []
+        if filters.status:
+            conditions.append("status = ?")
+            params.append(filters.status)
+        if filters.tag:
+            conditions.append("tag = ?")
+            params.append(filters.tag)
+        if filters.squad:
+            conditions.append("(external_squad = ? OR instr(internal_squads, ?) > 0)")
+            params += [filters.squad, f'"{filters.squad}"']
+        return conditions, params
+
+    def _page(self, filters: UserFilter, after: tuple[str, str] | None, limit: int) -> list[IndexedUser]:
+        conditions, params = self._filter_sql(filters)
+        if after is not None:
+            # Keyset: следующая страница начинается строго после последней строки предыдущей
+            conditions.append("(username, uuid) > (?, ?)")
+            params += after
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._query(f"{SELECT}{where} ORDER BY username, uuid LIMIT ?", (*params, limit))
+
+    def _count(self, filters: UserFilter) -> int:
+        conditions, params = self._filter_sql(filters)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return self._conn.execute(f"SELECT count(*) FROM users{where}", params).fetchone()[0]
+
+    def _uuids(self, filters: UserFilter) -> list[str]:
+        conditions, params = self._filter_sql(filters)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        return [row[0] for row in self._conn.execute(f"SELECT uuid FROM users{where} ORDER BY username", params)]
+
+    def _taken(self, values: list[str]) -> set[str]:
+        found = set()
+        for start in range(0, len(values), 500):
+            chunk = values[start:start + 500]
+            marks = ", ".join("?" * len(chunk))
+            sql = (f"SELECT username FROM users WHERE username IN ({marks}) "
+                   f"UNION ALL SELECT short_uuid FROM users WHERE short_uuid IN ({marks})")
+            found.update(row[0].lower() for row in self._conn.execute(sql, chunk + chunk))
+        return {value for value in values if value.lower() in found}
+
+    def _tags(self, limit: int) -> list[str]:
+        sql = "SELECT tag FROM users WHERE tag IS NOT NULL GROUP BY tag ORDER BY count(*) DESC, tag LIMIT ?"
+        return [row[0] for row in self._conn.execute(sql, (limit,))]
+
+    # ---------- API ----------
+
+    @property
+    def ready(self) -> bool:
+        """Индекс можно показывать: выгрузка прошла или в базе остались данные с прошлого запуска."""
+        return self.synced_at is not None or bool(self._rows)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    async def search(self, query: str, limit: int = 20) -> list[IndexedUser]:
+        kind, value = parse_query(query)
+        return await self._run(self._search, kind, value, limit)
+
+    async def page(self, filters: UserFilter, after: tuple[str, str] | None, limit: int) -> list[IndexedUser]:
+        return await self._run(self._page, filters, after, limit)
+
+    async def count(self, filters: UserFilter) -> int:
+        return await self._run(self._count, filters)
+
+    async def uuids(self, filters: UserFilter) -> list[str]:
+        """Все UUID под фильтром — цели массового действия."""
+        return await self._run(self._uuids, filters)
+
+    async def taken(self, values: list[str]) -> set[str]:
+        """
+        Какие из values уже заняты как username или short_uuid. Регистр не учитываем:
+        лучше отбросить лишний ID, чем получить отказ панели на подтверждении.
+        """
+        if self._conn is None or not values:
+            return set()
+        return await self._run(self._taken, values)
+
+    async def tags(self, limit: int = 12) -> list[str]:
+        """Самые частые теги — для кнопок фильтра."""
+        return await self._run(self._tags, limit)
+
+    async def _apply(self, upserts: list[tuple], deletes: list[str]):
+        await self._run(self._write, upserts, deletes)
+        for row in upserts:
+            self._rows[row[0]] = hash(row)
+        for uuid in deletes:
+            self._rows.pop(uuid, None)
+        self.version += 1
+
+    async def upsert(self, users):
+        """Созданные/изменённые ботом пользователи — в индекс сразу, не дожидаясь обновления."""
+        if self._conn is None:
+            return
+        rows = [row for row in map(user_row, users) if self._rows.get(row[0]) != hash(row)]
+        if rows:
+            await self._apply(rows, [])
+
+    async def remove(self, uuids):
+        if self._conn is None:
+            return
+        uuids = [uuid for uuid in uuids if uuid in self._rows]
+        if uuids:
+            await self._apply([], uuids)
+
+    async def sync(self):
+        started = time.monotonic()
+        # Удаляем только тех, кто был в индексе до начала прохода:
+        # пользователь, созданный ботом во время выгрузки, в старых страницах отсутствует законно
+        known = set(self._rows)
+        seen: set[str] = set()
+        changed = 0
+        cursor = None
+        sdk = get_sdk()
+
+        while True:
+            page = await sdk.users.get_users_stream(size=self.page_size, cursor=cursor)
+            upserts = []
+            for user in page.users:
+                row = user_row(user)
+                seen.add(row[0])
+                if self._rows.get(row[0]) != hash(row):
+                    upserts.append(row)
+            if upserts:
+                await self._apply(upserts, [])
+                changed += len(upserts)
+            if not page.has_more or not page.next_cursor:
+                break
+            cursor = page.next_cursor
+
+        gone = list(known - seen)
+        if gone:
+            await self._apply([], gone)
+
+        self.synced_at = time.monotonic()
+        self.sync_seconds = self.synced_at - started
+        logger.info(
+            f"User index synced: {len(seen)} users, {changed} changed, {len(gone)} removed "
+            f"in {self.sync_seconds:.1f}s"
+        )
+
+    async def _loop(self):
+        # Не лидер выгружает только по request_refresh(), расписание — у лидера
+        delay = None
+        while True:
+            if self.leader or self._wake.is_set():
+                self._wake.clear()
+                try:
+                    await self.sync()
+                    delay = self.refresh_interval if self.leader else None
+                except Exception as e:
+                    logger.warning(f"User index sync failed, serving last known: {e}")
+                    delay = self.retry_interval
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay)
+            except asyncio.TimeoutError:
+                if not self.leader:
+                    self._wake.set()
+
+    async def _follow(self):
+        while True:
+            await asyncio.sleep(self.follow_interval)
+            try:
+                if await self._run(self._reload_if_changed):
+                    self.version += 1
+            except Exception as e:
+                logger.warning(f"User index reload failed: {e}")
+
+    def request_refresh(self):
+        """Обновить индекс вне расписания — например, после массового действия на панели."""
+        self._wake.set()
+
+    async def start(self):
+        """Открывает базу и запускает выгрузку в фоне — старт бота её не ждёт."""
+        if self._conn is None:
+            await self._run(self._open)
+            logger.info(f"User index opened: {len(self._rows)} users from the last run")
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+        if self.shared and (self._follow_task is None or self._follow_task.done()):
+            self._follow_task = asyncio.create_task(self._follow())
+
+    async def stop(self):
+        for task in (self._task, self._follow_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        if self._conn is not None:
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=True)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._rows),
+            "sync_seconds": round(self.sync_seconds, 3),
+            "age_seconds": round(time.monotonic() - self.synced_at, 1) if self.synced_at else -1,
+        }
+
+
+user_index = UserIndex(
+    USER_INDEX_PATH,
+    refresh_interval=USER_INDEX_REFRESH,
+    retry_interval=USER_INDEX_RETRY_INTERVAL,
+    page_size=USER_INDEX_PAGE_SIZE,
+    follow_interval=USER_INDEX_FOLLOW_INTERVAL,
+)
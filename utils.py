@@ -1,12 +1,32 @@
 import secrets
 import string
+import time
+from collections import OrderedDict
 from datetime import datetime
 
 ALPHABET = string.ascii_letters + string.digits + "_"
 
+# Байт -> символ алфавита. Берём только байты < 252 (63 * 4): с остальными b % 63
+# давал бы первым символам чуть большую вероятность. Отбрасывается ~1.6% байтов
+_ACCEPTED = len(ALPHABET) * (256 // len(ALPHABET))
+_BYTE_TO_CHAR = bytes(ord(ALPHABET[b % len(ALPHABET)]) if b < _ACCEPTED else 0 for b in range(256))
+_REJECTED = bytes(range(_ACCEPTED, 256))
+
+
+def generate_ids(count: int, length: int = 16) -> list[str]:
+    """count случайных ID: один вызов token_bytes на всю пачку вместо secrets.choice на символ."""
+    need = count * length
+    chars = b""
+    while len(chars) < need:
+        # С запасом на отброшенные байты — почти всегда хватает одного прохода
+        raw = secrets.token_bytes((need - len(chars)) * 33 // 32 + 16)
+        chars += raw.translate(_BYTE_TO_CHAR, _REJECTED)
+    text = chars[:need].decode("ascii")
+    return [text[i:i + length] for i in range(0, need, length)]
+
 
 def generate_shortid(length=16) -> str:
-    return "".join(secrets.choice(ALPHABET) for _ in range(length))
+    return generate_ids(1, length)[0]
 
 
 def format_datetime(dt: datetime | None) -> str:
@@ -21,3 +41,60 @@ def bytes_to_gb(value: int | None) -> str:
     if value == 0:
         return "♾ Безлимит"
     return f"{value / 1024**3:.0f} GB"
+
+
+class LRUCache:
+    """Ограниченный по размеру dict: при переполнении выкидывается самый давно использованный ключ."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class TTLCache(LRUCache):
+    """LRUCache, в котором запись живёт не дольше ttl секунд."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if time.monotonic() >= expires:
+            self.pop(key)
+            return default
+        return value
+
+    def set(self, key, value):
+        super().set(key, (time.monotonic() + self.ttl, value))
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, self) is not self